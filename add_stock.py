@@ -1,16 +1,41 @@
+import argparse
+import json
 import os
 import re
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from sheet_manager import SheetManager
 
-def get_telegram_updates(bot_token, offset=None):
-    url = f"https://api.telegram.org/bot{bot_token}/getUpdates"
-    params = {"timeout": 10}
+def tg_api_base():
+    """Bot API 地址 (可指向本地替身服务联调：python stub_servers.py --service telegram)"""
+    return os.getenv("TG_API_BASE", "https://api.telegram.org").rstrip("/")
+
+_TG_SESSION = None
+
+def _tg_session():
+    """进程内共享的 keep-alive 会话，多次上传复用同一 TLS 连接"""
+    global _TG_SESSION
+    if _TG_SESSION is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=int(os.getenv("TG_PUSH_WORKERS", "2")))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _TG_SESSION = session
+    return _TG_SESSION
+
+def get_telegram_updates(bot_token, offset=None, timeout=10):
+    """timeout 为长轮询秒数：有新消息立即返回，否则服务端挂起至超时"""
+    url = f"{tg_api_base()}/bot{bot_token}/getUpdates"
+    params = {"timeout": timeout}
     if offset:
         params["offset"] = offset
     
     try:
-        resp = requests.get(url, params=params, timeout=15)
+        resp = _tg_session().get(url, params=params, timeout=timeout + 15)
         if resp.status_code == 200:
             return resp.json().get("result", [])
     except Exception as e:
@@ -18,17 +43,105 @@ def get_telegram_updates(bot_token, offset=None):
     return []
 
 def send_telegram_message(bot_token, chat_id, text):
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{tg_api_base()}/bot{bot_token}/sendMessage"
     data = {
         "chat_id": chat_id,
         "text": text,
         "parse_mode": "Markdown" # 开启 Markdown 以便支持等宽字体
     }
     try:
-        requests.post(url, json=data, timeout=10)
+        _tg_session().post(url, json=data, timeout=10)
     except:
         pass
 
+def tg_request(bot_token, method, data=None, files=None, timeout=120):
+    """
+    调用 Bot API 并重试：429 按响应里的 retry_after 等待，5xx / 网络错误指数退避。
+    files 为 {字段名: 文件路径}，每次重试重新打开文件。
+    """
+    url = f"{tg_api_base()}/bot{bot_token}/{method}"
+    max_retries = int(os.getenv("TG_MAX_RETRIES", "5"))
+    last_err = ""
+    for attempt in range(1, max_retries + 1):
+        handles = {name: open(path, "rb") for name, path in (files or {}).items()}
+        try:
+            upload = {name: (os.path.basename(f.name), f) for name, f in handles.items()} or None
+            resp = _tg_session().post(url, data=data, files=upload, timeout=timeout)
+        except requests.RequestException as e:
+            last_err, wait = str(e), min(2 ** attempt, 30)
+        else:
+            try:
+                body = resp.json()
+            except ValueError:
+                body = {}
+            if resp.status_code == 200 and body.get("ok"):
+                return body
+            last_err = f"HTTP {resp.status_code}: {body.get('description') or resp.text[:200]}"
+            if resp.status_code == 429:
+                wait = body.get("parameters", {}).get("retry_after") or 1
+                print(f"   ⏳ Telegram 限流，按 retry_after 等待 {wait}s ({attempt}/{max_retries})")
+            elif resp.status_code >= 500:
+                wait = min(2 ** attempt, 30)
+            else:
+                raise RuntimeError(f"Telegram {method} 失败: {last_err}")
+        finally:
+            for f in handles.values(): f.close()
+        if attempt < max_retries: time.sleep(wait)
+    raise RuntimeError(f"Telegram {method} 重试 {max_retries} 次仍失败: {last_err}")
+
+def _caption(path):
+    return f"Analysis: {os.path.basename(path)}"
+
+def send_documents(bot_token, chat_id, paths, workers=None):
+    """
+    每 10 个文件一组用 sendMediaGroup 发送 (组内只有 1 个文件时用 sendDocument)，
+    各组通过共享会话并行上传。返回成功发送的文件数。
+    """
+    paths = [p for p in paths if os.path.isfile(p)]
+    groups = [paths[i:i + 10] for i in range(0, len(paths), 10)]
+
+    def send_group(group):
+        if len(group) == 1:
+            tg_request(bot_token, "sendDocument", data={"chat_id": chat_id, "caption": _caption(group[0])},
+                       files={"document": group[0]})
+        else:
+            media = [{"type": "document", "media": f"attach://file{i}", "caption": _caption(p)} for i, p in enumerate(group)]
+            tg_request(bot_token, "sendMediaGroup", data={"chat_id": chat_id, "media": json.dumps(media)},
+                       files={f"file{i}": p for i, p in enumerate(group)})
+        return len(group)
+
+    workers = workers or int(os.getenv("TG_PUSH_WORKERS", "2"))
+    sent = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(send_group, g) for g in groups]
+        for group, future in zip(groups, futures):
+            try:
+                sent += future.result()
+                print(f"   ✅ 已发送 {len(group)} 份: {', '.join(os.path.basename(p) for p in group)}")
+            except Exception as e:
+                print(f"   ❌ 发送失败 ({len(group)} 份): {e}")
+    return sent
+
+def push_reports(list_path="push_list.txt"):
+    """读取 main.py 生成的推送清单并发送到 TG_CHAT_ID"""
+    bot_token, chat_id = os.getenv("TG_BOT_TOKEN"), os.getenv("TG_CHAT_ID")
+    if not bot_token or not chat_id:
+        print("❌ 缺少 TG_BOT_TOKEN / TG_CHAT_ID")
+        return 0
+    if not os.path.exists(list_path):
+        print(f"⚠️ 未找到 {list_path}")
+        return 0
+    with open(list_path, "r", encoding="utf-8") as f:
+        paths = [line.strip() for line in f if line.strip()]
+    missing = [p for p in paths if not os.path.isfile(p)]
+    for p in missing: print(f"   ⚠️ 文件不存在，跳过: {p}")
+
+    print(f"📤 推送 {len(paths) - len(missing)} 份报告...")
+    t0 = time.time()
+    sent = send_documents(bot_token, chat_id, paths)
+    print(f"📤 推送完成: {sent}/{len(paths) - len(missing)} 份, 耗时 {time.time() - t0:.1f}s")
+    return sent
+
 def parse_command(text):
     text = text.strip()
     code_match = re.search(r"\d{6}", text)
@@ -57,28 +170,12 @@ def parse_command(text):
         "intent": intent, "code": code, "date": date, "price": price, "qty": qty
     }
 
-def main():
-    bot_token = os.getenv("TG_BOT_TOKEN")
-    if not bot_token:
-        print("❌ 缺少 TG_BOT_TOKEN")
-        return
-
-    print("☁️ 正在连接 Google Sheets...")
-    try:
-        sm = SheetManager()
-        print("✅ 表格连接成功")
-    except Exception as e:
-        print(f"❌ 表格连接失败: {e}")
-        return
-
-    updates = get_telegram_updates(bot_token)
-    if not updates:
-        print("📭 无新消息")
-        return
-
+def process_updates(sm, bot_token, updates):
+    """处理一批消息：本地修改 -> 一次写回表格 -> 回复。返回本批最大的 update_id"""
     print(f"📥 收到 {len(updates)} 条消息，开始处理...")
     
     max_update_id = 0
+    replies = []
     
     for update in updates:
         update_id = update["update_id"]
@@ -110,18 +207,119 @@ def main():
             except Exception as e:
                 action_result = f"❌ 操作失败: {e}"
         
-        # 2. 【关键】无论成功失败，都拉取最新的全量持仓
+        # 2. 【关键】无论成功失败，都附上最新的全量持仓 (来自本地模型，不再重新下载整表)
         portfolio_summary = sm.get_portfolio_summary()
         
         # 3. 拼接最终回复
-        final_reply = f"{action_result}\n{portfolio_summary}"
-        
-        print(f"     -> 结果已发送")
+        replies.append((chat_id, f"{action_result}\n{portfolio_summary}"))
+
+    # 4. 整批修改一次性写回表格，写入成功后再回复
+    try:
+        sm.flush()
+    except Exception as e:
+        print(f"❌ 写回表格失败: {e}")
+        replies = [(chat_id, f"❌ 写回表格失败，本批指令未生效: {e}") for chat_id, _ in replies]
+        sm.invalidate()  # 丢弃未生效的暂存修改，避免下一批被一并写入；下次使用时重新读取
+
+    for chat_id, final_reply in replies:
         send_telegram_message(bot_token, chat_id, final_reply)
+    if replies: print(f"     -> {len(replies)} 条结果已发送")
+    return max_update_id
+
+def _connect_sheet():
+    print("☁️ 正在连接 Google Sheets...")
+    try:
+        sm = SheetManager()
+        print("✅ 表格连接成功")
+        return sm
+    except Exception as e:
+        print(f"❌ 表格连接失败: {e}")
+        return None
+
+def main():
+    bot_token = os.getenv("TG_BOT_TOKEN")
+    if not bot_token:
+        print("❌ 缺少 TG_BOT_TOKEN")
+        return
+
+    sm = _connect_sheet()
+    if not sm: return
+
+    updates = get_telegram_updates(bot_token)
+    if not updates:
+        print("📭 无新消息")
+        return
+
+    max_update_id = process_updates(sm, bot_token, updates)
 
     if max_update_id > 0:
         print(f"🧹 清理消息队列 (Offset: {max_update_id + 1})")
-        get_telegram_updates(bot_token, offset=max_update_id + 1)
+        get_telegram_updates(bot_token, offset=max_update_id + 1, timeout=0)
+
+def run_daemon(max_runtime_s=0):
+    """
+    常驻模式：只认证一次表格，getUpdates 长轮询 (DAEMON_POLL_TIMEOUT，默认 50 秒)，
+    消息到达即处理。每批处理完后下一次轮询带上 offset，即向 Telegram 确认已处理的消息。
+    表格缓存超过 DAEMON_SHEET_TTL_S (默认 60 秒) 时先重新读取，避免手工改表后行号错位。
+    max_runtime_s > 0 时运行到时间后退出 (例如 CI 任务的时长上限)。
+    """
+    bot_token = os.getenv("TG_BOT_TOKEN")
+    if not bot_token:
+        print("❌ 缺少 TG_BOT_TOKEN")
+        return
+
+    sm = _connect_sheet()
+    if not sm: return
+
+    poll_timeout = int(os.getenv("DAEMON_POLL_TIMEOUT", "50"))
+    sheet_ttl = float(os.getenv("DAEMON_SHEET_TTL_S", "60"))
+    started = time.time()
+    loaded_at = 0.0
+    offset = None
+    def _on_term(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _on_term)  # CI 取消 / kill 时同样走确认 offset 的退出流程
+    print(f"🛰️ 常驻模式启动 (长轮询 {poll_timeout}s{f', 最长运行 {max_runtime_s}s' if max_runtime_s else ''})")
+
+    try:
+        while not max_runtime_s or time.time() - started < max_runtime_s:
+            polled_at = time.time()
+            if max_runtime_s:
+                remaining = max_runtime_s - (time.time() - started)
+                updates = get_telegram_updates(bot_token, offset, timeout=max(0, min(poll_timeout, int(remaining))))
+            else:
+                updates = get_telegram_updates(bot_token, offset, timeout=poll_timeout)
+            if not updates:
+                # 长轮询本应挂起；立即返回空结果多半是网络或接口出错，稍等再试免得空转
+                if time.time() - polled_at < 1: time.sleep(min(5, poll_timeout or 1))
+                continue
+
+            if time.time() - loaded_at > sheet_ttl:
+                try:
+                    sm.reload()
+                    loaded_at = time.time()
+                except Exception as e:
+                    print(f"   ⚠️ 重新读取表格失败，沿用缓存: {e}")
+
+            max_update_id = process_updates(sm, bot_token, updates)
+            offset = max(offset or 0, max_update_id + 1)
+    except KeyboardInterrupt:
+        print("\n🛑 收到中断信号")
+    finally:
+        if offset:
+            get_telegram_updates(bot_token, offset=offset, timeout=0)  # 确认最后一批
+        print(f"🛰️ 常驻模式退出 (运行 {time.time() - started:.0f}s)")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Telegram 指令处理 / 报告推送")
+    parser.add_argument("--push", metavar="PUSH_LIST", help="推送清单中的 PDF (如 push_list.txt)，不处理指令")
+    parser.add_argument("--daemon", action="store_true", help="常驻长轮询模式，消息到达即处理")
+    parser.add_argument("--max-runtime", type=float, default=float(os.getenv("DAEMON_MAX_RUNTIME_S", "0")),
+                        help="常驻模式最长运行秒数 (0 为不限)")
+    args = parser.parse_args()
+    if args.push:
+        push_reports(args.push)
+    elif args.daemon:
+        run_daemon(args.max_runtime)
+    else:
+        main()
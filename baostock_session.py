@@ -0,0 +1,94 @@
+import atexit
+import threading
+import pandas as pd
+import baostock as bs
+
+# 需要重新登录的错误码：未登录 / 会话失效 + 所有 socket 类错误 (10002xxx)
+_NO_LOGIN = "10001001"
+_SOCKET_ERR_PREFIX = "10002"
+
+
+def _needs_relogin(error_code: str) -> bool:
+    return error_code == _NO_LOGIN or str(error_code).startswith(_SOCKET_ERR_PREFIX)
+
+
+def result_to_frame(rs) -> pd.DataFrame:
+    """
+    按页整体取出 ResultData，避免逐行 rs.next()/get_row_data() 循环。
+    baostock 每页最多 BAOSTOCK_PER_PAGE_COUNT 行，next() 在当前页读完后才会请求下一页。
+    """
+    rows = []
+    while rs.data:
+        rows.extend(rs.data)
+        rs.cur_row_num = len(rs.data)  # 标记当前页已读完，下一次 next() 才会翻页
+        if not rs.next(): break
+    return pd.DataFrame(rows, columns=rs.fields)
+
+
+class BaoStockSession:
+    """
+    整次运行共享的 BaoStock 会话：
+    - 首次查询时登录一次，进程退出时登出；
+    - baostock 客户端基于全局 socket，不是线程安全的，所有查询串行执行；
+    - 会话过期或连接断开时自动重新登录并重试一次。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._logged_in = False
+        self.logins = 0
+        self.queries = 0
+
+    def _login(self):
+        lg = bs.login()
+        if lg.error_code != '0':
+            raise ConnectionError(f"BaoStock login failed: {lg.error_code} {lg.error_msg}")
+        self._logged_in = True
+        self.logins += 1
+
+    def _ensure_login(self):
+        if not self._logged_in: self._login()
+
+    def query_history_k(self, code: str, fields: str, **kwargs) -> pd.DataFrame:
+        """query_history_k_data_plus 的线程安全封装，返回整张结果表 (全部为字符串列)"""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    self._ensure_login()
+                    rs = bs.query_history_k_data_plus(code, fields, **kwargs)
+                except OSError:
+                    # socket 层异常：视为连接已断开，重登后再试
+                    self._logged_in = False
+                    if attempt == 2: raise
+                    continue
+
+                if rs.error_code == '0':
+                    self.queries += 1
+                    return result_to_frame(rs)
+                if _needs_relogin(rs.error_code) and attempt == 1:
+                    print(f"   🔄 [BaoStock] 会话失效 ({rs.error_code})，重新登录...", flush=True)
+                    self._logged_in = False
+                    continue
+                raise RuntimeError(f"BaoStock query failed: {rs.error_code} {rs.error_msg}")
+        return pd.DataFrame()
+
+    def close(self):
+        with self._lock:
+            if self._logged_in:
+                try: bs.logout()
+                except Exception: pass
+                self._logged_in = False
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session() -> BaoStockSession:
+    """进程级单例，退出时自动登出"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = BaoStockSession()
+            atexit.register(_SESSION.close)
+        return _SESSION
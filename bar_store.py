@@ -0,0 +1,112 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# 每列一个定长二进制文件：date 为 int64 纳秒时间戳，其余为 float64
+BAR_COLUMNS = ["open", "high", "low", "close", "volume"]
+_DATE_FILE = "date.i8"
+_ITEM_SIZE = 8
+
+
+class BarStore:
+    """
+    按 (代码, 周期, 复权方式) 划分的本地 K 线仓库（列式存储）。
+    目录结构: {root}/{symbol}_{tf}m_{adjust}/date.i8, open.f8, high.f8 ...
+    - 一个目录只存一种复权方式的价格，不同复权的数据不会混在一起。
+    - 追加友好：新 K 线直接写入各列文件尾部，无需重写历史。
+    - 可内存映射：读取时用 np.memmap，只拷贝需要的尾部数据。
+    """
+
+    def __init__(self, root: str = None, adjust: str = "qfq"):
+        self.root = root or os.getenv("BAR_STORE_DIR", "data/store")
+        self.adjust = adjust
+
+    def _dir(self, symbol: str, tf_min: int) -> str:
+        return os.path.join(self.root, f"{symbol}_{int(tf_min)}m_{self.adjust}")
+
+    def clear(self, symbol: str, tf_min: int):
+        """删除该 (代码, 周期) 的全部数据 (如除权除息后前复权价整体变化)"""
+        shutil.rmtree(self._dir(symbol, tf_min), ignore_errors=True)
+
+    @staticmethod
+    def _col_file(col: str) -> str:
+        return _DATE_FILE if col == "date" else f"{col}.f8"
+
+    def count(self, symbol: str, tf_min: int) -> int:
+        """已存储的 K 线根数（以最短的列为准，防止写入中断导致列长不一致）"""
+        d = self._dir(symbol, tf_min)
+        if not os.path.isdir(d): return 0
+        sizes = []
+        for col in ["date"] + BAR_COLUMNS:
+            path = os.path.join(d, self._col_file(col))
+            if not os.path.exists(path): return 0
+            sizes.append(os.path.getsize(path) // _ITEM_SIZE)
+        return min(sizes)
+
+    def _memmap(self, symbol: str, tf_min: int, col: str, n: int) -> np.ndarray:
+        dtype = np.int64 if col == "date" else np.float64
+        path = os.path.join(self._dir(symbol, tf_min), self._col_file(col))
+        return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+
+    def last_timestamp(self, symbol: str, tf_min: int):
+        n = self.count(symbol, tf_min)
+        if n == 0: return None
+        dates = self._memmap(symbol, tf_min, "date", n)
+        return pd.Timestamp(int(dates[-1]), unit="ns")
+
+    def load(self, symbol: str, tf_min: int, tail: int = None) -> pd.DataFrame:
+        """读取 (最近 tail 根) K 线，返回与 fetch 结果同结构的 DataFrame"""
+        n = self.count(symbol, tf_min)
+        if n == 0:
+            return pd.DataFrame(columns=["date"] + BAR_COLUMNS)
+
+        start = max(0, n - tail) if tail else 0
+        data = {}
+        for col in ["date"] + BAR_COLUMNS:
+            arr = self._memmap(symbol, tf_min, col, n)
+            data[col] = np.array(arr[start:])
+        data["date"] = pd.to_datetime(data["date"], unit="ns")
+        return pd.DataFrame(data)
+
+    def upsert(self, symbol: str, tf_min: int, df: pd.DataFrame) -> int:
+        """
+        写入新 K 线：从 df 的最早时间点起截断旧数据尾部，再追加合并后的结果。
+        这样既能追加新 K 线，也能修正上次运行时尚未走完的最后一根。
+        返回写入的根数。
+        """
+        if df is None or df.empty: return 0
+
+        new = df[["date"] + BAR_COLUMNS].dropna(subset=["date", "close"])
+        if new.empty: return 0
+        new_dates = new["date"].values.astype("datetime64[ns]").view(np.int64)
+        first_ts = int(new_dates.min())
+
+        d = self._dir(symbol, tf_min)
+        os.makedirs(d, exist_ok=True)
+
+        n = self.count(symbol, tf_min)
+        cut = n
+        if n > 0:
+            dates = self._memmap(symbol, tf_min, "date", n)
+            cut = int(np.searchsorted(dates, first_ts, side="left"))
+
+        # 被截断部分中可能有 df 未覆盖的 K 线，先合并再写回
+        if cut < n:
+            old_tail = self.load(symbol, tf_min, tail=n - cut)
+            new = pd.concat([old_tail, new], ignore_index=True)
+        new = new.assign(date=pd.to_datetime(new["date"]))
+        new = new.drop_duplicates(subset=["date"], keep="last").sort_values("date")
+
+        for col in ["date"] + BAR_COLUMNS:
+            path = os.path.join(d, self._col_file(col))
+            if col == "date":
+                values = new["date"].values.astype("datetime64[ns]").view(np.int64)
+            else:
+                values = new[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            with open(path, "ab") as f:
+                f.truncate(cut * _ITEM_SIZE)
+                f.seek(cut * _ITEM_SIZE)
+                f.write(np.ascontiguousarray(values).tobytes())
+
+        return len(new)
@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# 基准使用固定模板，保证 prompt 长度只取决于 K 线数据，基线之间可比
+BENCH_TEMPLATE = (
+    "You are analyzing {symbol} with the Wyckoff method.\n"
+    "Latest bar: {latest_time}, price {latest_price}.\n"
+    "Identify the current phase, key events (SC, AR, ST, Spring, SOS, LPS) and give a trading plan.\n\n"
+    "{csv_data}\n"
+)
+
+STAGES = ("volume_fix", "indicators", "prompt", "llm_stub", "chart", "pdf")
+# 未选中但被后续阶段依赖的阶段照常执行、不计时
+_DEPENDS = {"chart": {"indicators"}, "pdf": {"indicators", "llm_stub", "chart"}}
+
+_SNAPSHOT_RE = re.compile(r"(\d{6})_(\d+m)_\d{8}_\d{6}\.csv$")
+
+
+def load_snapshots(data_dir: str, period: str = None, per_group: int = 5) -> list[tuple[str, str, pd.DataFrame]]:
+    """
+    读取 data/ 下的 K 线快照 ({代码}_{周期}_{时间戳}.csv)，按 (周期, 根数档位) 分组，
+    每组按文件名顺序取前 per_group 个，结果与目录内容一一对应、可复现。
+    """
+    groups: dict[tuple, list] = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+        match = _SNAPSHOT_RE.search(os.path.basename(path))
+        if not match or (period and match.group(2) != period): continue
+        df = pd.read_csv(path, encoding="utf-8-sig", parse_dates=["date"])
+        df = df[["date", "open", "high", "low", "close", "volume"]].dropna(subset=["date", "close"])
+        if df.empty: continue
+        key = (match.group(2), bar_bucket(len(df)))
+        if len(groups.setdefault(key, [])) < per_group:
+            groups[key].append((match.group(1), match.group(2), df.reset_index(drop=True)))
+    return [item for key in sorted(groups) for item in groups[key]]
+
+
+def bar_bucket(n: int) -> int:
+    """根数档位：向上取整到 100"""
+    return max(100, -(-n // 100) * 100)
+
+
+def _stub_env(work_dir: str) -> dict:
+    """LLM 指向本地确定性替身；熔断 / 延迟统计写入临时目录，不污染正式运行的状态"""
+    from stub_servers import LLMStubServer
+    server = LLMStubServer().start()
+    env = dict(server.env())
+    env.update({
+        "GEMINI_API_KEY": "bench", "CUSTOM_API_KEY": "bench", "OPENAI_API_KEY": "bench",
+        "WYCKOFF_PROMPT_TEMPLATE": BENCH_TEMPLATE,
+        "LLM_CACHE": "0", "LLM_STREAM": "0", "LLM_HEDGE": "0", "LLM_PROVIDER_RANKING": "0",
+        "GEMINI_CONTEXT_CACHE": "0", "RATE_LIMIT_GEMINI": "1000/s", "TRACE": "0",
+        "CHART_PROCESSES": "0", "PDF_PROCESSES": "0",
+        "PROVIDER_STATS_FILE": os.path.join(work_dir, "provider_stats.json"),
+        "CIRCUIT_STATE_FILE": os.path.join(work_dir, "circuit_breakers.json"),
+    })
+    return env
+
+
+def _timed(func) -> tuple[float, object]:
+    # 各阶段自带的日志打印不计入，也不刷屏
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        out = func()
+        return (time.perf_counter() - t0) * 1000, out
+
+
+class StageFailed(Exception):
+    """某阶段没有产出有效结果 (返回失败 / 输出文件缺失)，其耗时不能作为样本"""
+
+
+def _remove(path: str):
+    if os.path.exists(path): os.remove(path)
+
+
+def run(snapshots: list, stages: tuple, out_dir: str, repeat: int = 1) -> dict:
+    """逐个快照依次执行各阶段，返回 {(阶段, 周期, 根数档位): [耗时毫秒...]}；任一阶段失败时抛出 StageFailed"""
+    import main
+
+    os.makedirs(out_dir, exist_ok=True)
+    needed = set(stages).union(*(_DEPENDS.get(s, set()) for s in stages))
+    timings: dict[tuple, list] = {}
+    warmed = set()
+    for i, (symbol, period, df) in enumerate(snapshots):
+        info = {"timeframe": period.rstrip("m"), "bars": str(len(df))}
+        chart_path = os.path.join(out_dir, f"{symbol}_{i}.png")
+        pdf_path = os.path.join(out_dir, f"{symbol}_{i}.pdf")
+        # 模拟双源合并：BaoStock 为股、AkShare 近段为手，重叠区间覆盖尾部 1/3
+        overlap = df.tail(max(10, len(df) // 3)).copy()
+        overlap["volume"] = (overlap["volume"] / 100).round()
+        ctx = {"df": df, "report": None}
+
+        steps = {
+            "volume_fix": lambda: main._detect_and_fix_volume_units(df, overlap),
+            "indicators": lambda: ctx.__setitem__("df", main.add_indicators(df)),
+            "prompt": lambda: main.get_prompt_content(symbol, ctx["df"], info),
+            "llm_stub": lambda: ctx.__setitem__("report", main.ai_analyze(symbol, ctx["df"], info)),
+            "chart": lambda: main.generate_local_chart(symbol, ctx["df"], chart_path, period),
+            "pdf": lambda: main.generate_pdf_report(symbol, chart_path, ctx["report"] or "# stub\n", pdf_path),
+        }
+        # 各阶段是否真正产出了结果 (绘图失败只打印日志不抛异常，PDF 失败返回 False)
+        checks = {
+            "volume_fix": lambda out: len(out) == 2,
+            "indicators": lambda out: "ma50" in ctx["df"].columns,
+            "prompt": lambda out: bool(out),
+            "llm_stub": lambda out: bool(ctx["report"]) and not main._analysis_failed(ctx["report"]),
+            "chart": lambda out: os.path.getsize(chart_path) > 0 if os.path.exists(chart_path) else False,
+            "pdf": lambda out: out is True and os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 0,
+        }
+        for stage in STAGES:
+            if stage not in needed: continue
+            for _ in range(repeat + (stage not in warmed)):
+                # 先删掉上一轮的输出，确保检查的是本轮生成的文件
+                if stage == "chart": _remove(chart_path)
+                if stage == "pdf": _remove(pdf_path)
+                ms, out = _timed(steps[stage])
+                if not checks[stage](out):
+                    raise StageFailed(f"{stage} 阶段失败: {symbol} {period} ({len(df)} 根)，可单独运行 --stages {stage} 排查")
+                if stage not in warmed:
+                    warmed.add(stage)  # 首次调用包含导入、字体注册、建图等一次性开销，不计入
+                    continue
+                if stage in stages:
+                    timings.setdefault((stage, period, bar_bucket(len(df))), []).append(ms)
+    return timings
+
+
+def summarize(timings: dict) -> dict:
+    """{"阶段|周期|根数": {"n", "p50_ms", "p95_ms"}}"""
+    result = {}
+    for (stage, period, bars), values in sorted(timings.items(), key=lambda kv: (STAGES.index(kv[0][0]), kv[0][1], kv[0][2])):
+        result[f"{stage}|{period}|{bars}"] = {
+            "n": len(values),
+            "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3),
+        }
+    return result
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> tuple[str, list]:
+    """按 p50 与基线对比，返回 (表格, 超出容忍度的条目)"""
+    lines = [f"   {'stage':<12}{'period':>7}{'bars':>6}{'n':>5}{'p50':>10}{'p95':>10}{'baseline':>10}{'delta':>9}"]
+    regressions = []
+    for key, row in summary.items():
+        stage, period, bars = key.split("|")
+        base = baseline.get(key, {}).get("p50_ms")
+        delta = "" if not base else f"{(row['p50_ms'] - base) / base:+.0%}"
+        flag = ""
+        if base and row["p50_ms"] > base * (1 + tolerance):
+            regressions.append(key)
+            flag = " ❌"
+        lines.append(f"   {stage:<12}{period:>7}{bars:>6}{row['n']:>5}{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms"
+                     f"{(f'{base:.1f}ms' if base else '-'):>10}{delta:>9}{flag}")
+    return "\n".join(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准：用 data/ 下的 K 线快照回放 CPU 阶段 (LLM 为本地替身)")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--period", help="只测某个周期，如 5m")
+    parser.add_argument("--per-group", type=int, default=5, help="每个 (周期, 根数档位) 取几个快照")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"逗号分隔，可选 {','.join(STAGES)}")
+    parser.add_argument("--baseline", default=os.getenv("BENCH_BASELINE", "data/bench_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写为新基线")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("BENCH_TOLERANCE", "0.25")),
+                        help="p50 超过基线的比例上限，超出时退出码为 1")
+    parser.add_argument("--out", default="reports/bench", help="图表 / PDF 输出目录 (须在项目目录内，xhtml2pdf 不读取目录外的图片)")
+    args = parser.parse_args()
+
+    stages = tuple(s for s in args.stages.split(",") if s)
+    unknown = set(stages) - set(STAGES)
+    if unknown: parser.error(f"未知阶段: {', '.join(sorted(unknown))}")
+
+    snapshots = load_snapshots(args.data, args.period, args.per_group)
+    if not snapshots:
+        print(f"⚠️ {args.data} 下没有可用的 K 线快照", flush=True)
+        sys.exit(1)
+    os.environ.update(_stub_env(args.out))
+    print(f"📊 离线基准: {len(snapshots)} 个快照, 阶段 {', '.join(stages)}, 每项重复 {args.repeat} 次", flush=True)
+
+    t0 = time.perf_counter()
+    try:
+        summary = summarize(run(snapshots, stages, args.out, args.repeat))
+    except StageFailed as e:
+        print(f"❌ {e}", flush=True)
+        sys.exit(1)
+    print(f"   用时 {time.perf_counter() - t0:.1f}s", flush=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+    table, regressions = compare(summary, baseline, args.tolerance)
+    print(table, flush=True)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+                       "cpu_count": os.cpu_count(), "results": summary}, f, ensure_ascii=False, indent=1)
+        print(f"💾 基线已保存: {args.baseline}", flush=True)
+    elif regressions:
+        print(f"❌ {len(regressions)} 项 p50 超过基线 {args.tolerance:.0%}: {', '.join(regressions)}", flush=True)
+        sys.exit(1)
+    elif baseline:
+        print(f"✅ 未超过基线 (容忍度 {args.tolerance:.0%})", flush=True)
+
+
+if __name__ == "__main__":
+    main()
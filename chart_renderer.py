@@ -0,0 +1,225 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import matplotlib
+matplotlib.use("Agg")  # 无界面后端：不初始化 GUI，CI 与子进程中都可用
+import matplotlib.pyplot as plt
+import mplfinance as mpf
+import pandas as pd
+from PIL import Image
+
+# K 线配色与样式只构建一次
+_MARKET_COLORS = mpf.make_marketcolors(up='#ff3333', down='#00b060', edge='inherit', wick='inherit',
+                                       volume={'up': '#ff3333', 'down': '#00b060'}, inherit=True)
+STYLE = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=_MARKET_COLORS, gridstyle=':', y_on_right=True)
+
+FIGSIZE = (7.0, 5.8)
+# 价格区 / 成交量区位置 (figure 坐标)，固定布局免去 bbox_inches='tight' 的二次排版
+_PRICE_RECT = [0.04, 0.34, 0.82, 0.58]
+_VOLUME_RECT = [0.04, 0.15, 0.82, 0.19]
+
+
+def chart_format() -> str:
+    """CHART_FORMAT: png8 (调色板量化，默认) | png (真彩色) | svg (矢量)"""
+    fmt = os.getenv("CHART_FORMAT", "png8").lower()
+    return fmt if fmt in ("png", "png8", "svg") else "png8"
+
+
+def chart_extension() -> str:
+    return "svg" if chart_format() == "svg" else "png"
+
+
+def display_width_cm() -> float:
+    """图表在 PDF 中的显示宽度 (A4 去掉左右页边距后为 17cm)"""
+    return float(os.getenv("CHART_DISPLAY_WIDTH_CM", "15"))
+
+
+def default_dpi() -> float:
+    """按显示宽度与目标打印精度 CHART_PRINT_DPI 反推渲染 dpi，位图像素与 PDF 中的显示尺寸一一对应"""
+    print_dpi = float(os.getenv("CHART_PRINT_DPI", "120"))
+    return print_dpi * display_width_cm() / 2.54 / FIGSIZE[0]
+
+
+class ChartRenderer:
+    """
+    复用同一个 Figure / Axes 绘制多只股票 (mplfinance 外部 Axes 模式)：
+    每次只清空坐标轴重画，省去建图、建样式与自动排版的开销。
+    同一实例不能被多个线程同时使用。
+    """
+
+    def __init__(self, figsize: tuple = None, dpi: float = None):
+        self.dpi = dpi or default_dpi()
+        self.fig = mpf.figure(style=STYLE, figsize=figsize or FIGSIZE)
+        plt.close(self.fig)  # 脱离 pyplot 的全局图表管理，只由本实例持有
+        self.ax_price = self.fig.add_axes(_PRICE_RECT, style=STYLE)
+        self.ax_volume = self.fig.add_axes(_VOLUME_RECT, style=STYLE, sharex=self.ax_price)
+        self.rendered = 0
+
+    def render(self, symbol: str, df: pd.DataFrame, save_path: str, period: str,
+               scale: float = 1.0, colors: int = None) -> bool:
+        """scale / colors 用于超出报告体积上限时降低分辨率与调色板颜色数"""
+        if df.empty: return False
+        plot_df = df.set_index("date") if "date" in df.columns else df
+        if not isinstance(plot_df.index, pd.DatetimeIndex):
+            plot_df = plot_df.set_axis(pd.to_datetime(plot_df.index))
+
+        self.ax_price.clear()
+        self.ax_volume.clear()
+        apds = []
+        if 'ma50' in plot_df.columns and plot_df['ma50'].notna().any():
+            apds.append(mpf.make_addplot(plot_df['ma50'], ax=self.ax_price, color='#ff9900', width=1.5))
+        if 'ma200' in plot_df.columns and plot_df['ma200'].notna().any():
+            apds.append(mpf.make_addplot(plot_df['ma200'], ax=self.ax_price, color='#2196f3', width=2.0))
+
+        mpf.plot(plot_df, type='candle', ax=self.ax_price, volume=self.ax_volume, addplot=apds,
+                 datetime_format='%b %d, %H:%M', warn_too_much_data=2000)
+        self.ax_price.set_title(f"Wyckoff: {symbol} ({period} | {len(plot_df)} bars)", fontweight='bold')
+        self.ax_price.tick_params(labelbottom=False)
+        self.ax_volume.yaxis.tick_right()
+        self.ax_volume.yaxis.set_label_position("right")
+        self.ax_volume.set_ylabel("Volume")
+        self._save(save_path, scale, colors)
+        self.rendered += 1
+        return True
+
+    def _save(self, save_path: str, scale: float, colors: Optional[int]):
+        fmt = chart_format()
+        if fmt == "svg":
+            self.fig.savefig(save_path, format="svg")
+            return
+        if fmt == "png":
+            self.fig.savefig(save_path, dpi=self.dpi * scale)
+            return
+        # 图表只有少量纯色 + 抗锯齿边缘，量化为调色板 PNG 体积通常只有真彩色的几分之一
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format="png", dpi=self.dpi * scale)
+        buf.seek(0)
+        colors = colors or int(os.getenv("CHART_COLORS", "128"))
+        img = Image.open(buf).convert("RGB").quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        img.save(save_path, format="PNG", optimize=True)
+
+
+_LOCAL = threading.local()
+
+
+def get_renderer() -> ChartRenderer:
+    """每个线程 / 进程各持有一个渲染器"""
+    renderer = getattr(_LOCAL, "renderer", None)
+    if renderer is None:
+        renderer = _LOCAL.renderer = ChartRenderer()
+    return renderer
+
+
+def render_chart(symbol: str, df: pd.DataFrame, save_path: str, period: str,
+                 scale: float = 1.0, colors: int = None) -> float:
+    """绘制一张图，返回耗时 (毫秒)；进程池任务入口"""
+    t0 = time.perf_counter()
+    get_renderer().render(symbol, df, save_path, period, scale, colors)
+    return (time.perf_counter() - t0) * 1000
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def chart_processes() -> int:
+    """CHART_PROCESSES: 0 关闭进程池 (默认)，-1 使用全部 CPU 核"""
+    n = int(os.getenv("CHART_PROCESSES", "0"))
+    return (os.cpu_count() or 1) if n < 0 else n
+
+
+def pool_context():
+    """
+    子进程不用 fork：进程池由流水线工作线程按需拉起子进程，此时其他线程可能正持有
+    requests 连接池 / logging / BaoStock 会话等锁，fork 出的子进程继承到已锁住的锁会死锁。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _POOL
+    workers = chart_processes()
+    if workers <= 0: return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+        return _POOL
+
+
+def render_many(jobs: list, workers: int = None) -> list:
+    """jobs: [(symbol, df, save_path, period)]；多进程并行绘制，返回各图耗时 (毫秒)"""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_chart, *job) for job in jobs]
+        return [f.result() for f in futures]
+
+
+# ---------- 基准测试：python chart_renderer.py --bench ----------
+
+def _render_legacy(symbol: str, df: pd.DataFrame, save_path: str, period: str):
+    """原实现：每次重建样式 + 新建 Figure + bbox_inches='tight'"""
+    plot_df = df.copy()
+    plot_df.set_index("date", inplace=True)
+    mc = mpf.make_marketcolors(up='#ff3333', down='#00b060', edge='inherit', wick='inherit', volume={'up': '#ff3333', 'down': '#00b060'}, inherit=True)
+    s = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mc, gridstyle=':', y_on_right=True)
+    apds = [mpf.make_addplot(plot_df['ma50'], color='#ff9900', width=1.5),
+            mpf.make_addplot(plot_df['ma200'], color='#2196f3', width=2.0)]
+    mpf.plot(plot_df, type='candle', style=s, addplot=apds, volume=True,
+             title=f"Wyckoff: {symbol} ({period} | {len(plot_df)} bars)",
+             savefig=dict(fname=save_path, dpi=150, bbox_inches='tight'), warn_too_much_data=2000)
+    plt.close("all")
+
+
+def _sample_bars(n: int, seed: int) -> pd.DataFrame:
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.05, n))
+    df = pd.DataFrame({
+        "date": pd.date_range("2024-01-02 09:35", periods=n, freq="5min"),
+        "open": close + rng.normal(0, 0.02, n), "close": close,
+        "volume": rng.integers(1_000, 100_000, n).astype(float),
+    })
+    df["high"] = df[["open", "close"]].max(axis=1) + 0.03
+    df["low"] = df[["open", "close"]].min(axis=1) - 0.03
+    df["ma50"] = df["close"].rolling(50).mean()
+    df["ma200"] = df["close"].rolling(200).mean()
+    return df
+
+
+def bench(count: int, bars: int, out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    frames = [_sample_bars(bars, i) for i in range(count)]
+    jobs = [(f"{i:06d}", df, os.path.join(out_dir, f"{i:06d}_{{}}.png"), "5m") for i, df in enumerate(frames)]
+
+    def run(name, func):
+        t0 = time.perf_counter()
+        func()
+        ms = (time.perf_counter() - t0) * 1000 / count
+        print(f"   {name:<10}{ms:>10.1f} ms/图", flush=True)
+        return ms
+
+    print(f"📊 绘图基准: {count} 张, 每张 {bars} 根", flush=True)
+    legacy = run("legacy", lambda: [_render_legacy(s, df, p.format("legacy"), per) for s, df, p, per in jobs])
+    reuse = run("reuse", lambda: [render_chart(s, df, p.format("reuse"), per) for s, df, p, per in jobs])
+    pool = run("pool", lambda: render_many([(s, df, p.format("pool"), per) for s, df, p, per in jobs]))
+    print(f"   复用 Figure 提速 {legacy / reuse:.1f}x, 进程池 ({os.cpu_count()} 核) 提速 {legacy / pool:.1f}x", flush=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="K 线图渲染器")
+    parser.add_argument("--bench", action="store_true", help="对比原实现 / 复用 Figure / 进程池的每图耗时")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--out", default="reports/bench_charts")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.count, args.bars, args.out)
+    else:
+        parser.print_help()
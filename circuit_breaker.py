@@ -0,0 +1,150 @@
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 失败类型
+FAILURE_ERROR = "error"    # 普通错误：连续多次才熔断，冷却后半开探测
+FAILURE_FATAL = "fatal"    # 致命错误 (Key 无效 / 未配置)：本次运行内不再尝试
+FAILURE_QUOTA = "quota"    # 配额耗尽：熔断到下一次配额重置，并落盘跨运行保留
+
+
+def next_gemini_quota_reset(now: float = None) -> float:
+    """Gemini 每日配额在太平洋时间 0 点重置"""
+    tz = ZoneInfo("America/Los_Angeles")
+    current = datetime.fromtimestamp(now or time.time(), tz)
+    reset = (current + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return reset.timestamp()
+
+
+class CircuitBreaker:
+    """
+    单个 LLM 提供方的熔断器：
+    closed --(失败)--> open --(到期)--> half_open --(探测成功)--> closed
+                                               \\--(探测失败)--> open
+    半开状态只放行一个探测请求，其余调用直接跳过，不增加延迟。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown_s: float = 300.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.reason = ""
+        self.persist = False
+        self.failures = 0
+        self.skipped = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() >= self.open_until:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.open_until = 0.0
+            self.reason = ""
+            self.persist = False
+            self._probing = False
+
+    def release_probe(self):
+        """放行的调用既未成功也未失败 (如对冲落败被取消)：归还半开探测名额，状态不变"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self, kind: str = FAILURE_ERROR, reason: str = "", until: float = None):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            self.reason = reason[:200]
+            if kind == FAILURE_FATAL:
+                self._trip(math.inf, persist=False)
+            elif kind == FAILURE_QUOTA:
+                self._trip(until or time.time() + self.cooldown_s, persist=True)
+            elif self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._trip(time.time() + self.cooldown_s, persist=False)
+
+    def _trip(self, until: float, persist: bool):
+        self.state = OPEN
+        self.open_until = until
+        self.persist = persist
+
+    def describe(self) -> str:
+        if self.state == CLOSED: return "closed"
+        if math.isinf(self.open_until): return f"{self.state} (本次运行)"
+        until = datetime.fromtimestamp(self.open_until).strftime("%m-%d %H:%M")
+        return f"{self.state} (至 {until})"
+
+
+class BreakerRegistry:
+    """
+    按名称管理熔断器；配额类熔断写入 JSON 文件，下次运行启动时恢复。
+    到期的条目在下次调用时自动进入半开探测。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("CIRCUIT_STATE_FILE", "data/circuit_breakers.json")
+        self.failure_threshold = int(os.getenv("CB_FAILURE_THRESHOLD", "3"))
+        self.cooldown_s = float(os.getenv("CB_COOLDOWN_S", "300"))
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, item in saved.items():
+            b = self.get(name)
+            b.state = OPEN
+            b.open_until = float(item.get("open_until", 0))
+            b.reason = item.get("reason", "")
+            b.persist = True
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(name)
+            if b is None:
+                b = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.cooldown_s)
+            return b
+
+    def save(self):
+        with self._lock:
+            state = {
+                name: {"open_until": b.open_until, "reason": b.reason}
+                for name, b in self._breakers.items()
+                if b.persist and b.state != CLOSED and b.open_until > time.time()
+            }
+        if not state and not os.path.exists(self.path): return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+
+    def summary(self) -> str:
+        lines = []
+        for name, b in sorted(self._breakers.items()):
+            if b.state == CLOSED and not b.skipped: continue
+            lines.append(f"   🔌 {name}: {b.describe()}, 跳过 {b.skipped} 次 {('- ' + b.reason[:80]) if b.reason else ''}")
+        return "\n".join(lines)
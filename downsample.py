@@ -0,0 +1,120 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+
+
+def find_anchor_bars(df: pd.DataFrame, target: int, climax_mult: float = 3.0, swing_window: int = 5) -> np.ndarray:
+    """
+    必须原样保留的 K 线（威科夫分析的关键点）：
+    - 放量高潮：成交量 >= climax_mult x 近 50 根成交量中位数，最多保留量比最大的 target/6 根；
+    - 波段高/低点：high/low 为前后 swing_window 根内的极值，数量超过 target/6 时
+      逐步放宽窗口，只保留更大级别的高低点。
+    首尾两根总是保留。锚点总数不超过目标的 1/3，给普通 K 线留出足够的桶。
+    """
+    n = len(df)
+    anchors = np.zeros(n, dtype=bool)
+    if n == 0: return anchors
+    anchors[0] = anchors[-1] = True
+    quota = max(1, target // 6)
+
+    if "volume" in df.columns:
+        vol = df["volume"].astype(float).to_numpy()
+        med = pd.Series(vol).rolling(50, min_periods=1).median().to_numpy()
+        ratio = np.divide(vol, med, out=np.zeros(n), where=med > 0)
+        climax = np.flatnonzero(ratio >= climax_mult)
+        if len(climax) > quota:
+            climax = climax[np.argsort(ratio[climax])[-quota:]]
+        anchors[climax] = True
+
+    w = max(1, swing_window)
+    while True:
+        size = 2 * w + 1
+        is_high = df["high"].eq(df["high"].rolling(size, center=True, min_periods=1).max()).to_numpy()
+        is_low = df["low"].eq(df["low"].rolling(size, center=True, min_periods=1).min()).to_numpy()
+        swings = is_high | is_low
+        if swings.sum() <= quota or size >= n:
+            return anchors | swings
+        w *= 2
+
+
+def _aggregate(chunk: pd.DataFrame) -> dict:
+    """把若干根 K 线合并为一根：时间取最后一根 (与 K 线结束时刻标注一致)"""
+    row = chunk.iloc[-1].to_dict()
+    row["open"] = chunk["open"].iloc[0]
+    row["high"] = chunk["high"].max()
+    row["low"] = chunk["low"].min()
+    if "volume" in chunk.columns: row["volume"] = chunk["volume"].sum()
+    return row
+
+
+def downsample_ohlc(df: pd.DataFrame, target: int, anchors: np.ndarray) -> pd.DataFrame:
+    """锚点单独成桶、原样保留；锚点之间的普通 K 线按固定桶宽合并为 OHLC"""
+    n = len(df)
+    n_anchor = int(anchors.sum())
+    free = n - n_anchor
+    # 每段锚点间的尾桶可能不满，按 "锚点数 + 段数" 预留位置
+    slots = max(1, target - 2 * n_anchor - 1)
+    bucket = max(1, math.ceil(free / slots))
+
+    rows = []
+    run_start = None
+    for i in range(n + 1):
+        if i < n and not anchors[i]:
+            if run_start is None: run_start = i
+            continue
+        if run_start is not None:
+            for s in range(run_start, i, bucket):
+                rows.append(_aggregate(df.iloc[s:min(i, s + bucket)]))
+            run_start = None
+        if i < n:
+            rows.append(df.iloc[i].to_dict())
+    return pd.DataFrame(rows, columns=df.columns)
+
+
+def _lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：在 y 上挑选 n_out 个最能保持形状的点"""
+    n = len(y)
+    if n_out >= n or n_out < 3: return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = [0]
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], max(edges[b] + 1, edges[b + 1])
+        nlo, nhi = edges[b + 1], edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[nlo:max(nlo + 1, nhi)].mean()
+        avg_y = y[nlo:max(nlo + 1, nhi)].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out.append(a)
+    out.append(n - 1)
+    return np.unique(out)
+
+
+def downsample_lttb(df: pd.DataFrame, target: int, anchors: np.ndarray) -> pd.DataFrame:
+    """LTTB 变体：在收盘价上选点，并强制并入全部锚点；选中的 K 线原样保留"""
+    n_out = max(3, target - int(anchors.sum()))
+    picked = _lttb_indices(df["close"].to_numpy(dtype=float), n_out)
+    keep = np.zeros(len(df), dtype=bool)
+    keep[picked] = True
+    keep |= anchors
+    return df[keep].reset_index(drop=True)
+
+
+def downsample_bars(df: pd.DataFrame, mode: str = None, target: int = None) -> tuple[pd.DataFrame, dict]:
+    """
+    可选降采样：DOWNSAMPLE=ohlc|lttb (默认 off)，DOWNSAMPLE_TARGET=目标根数。
+    返回 (结果, 统计信息)。K 线数未超过目标或未开启时原样返回。
+    """
+    mode = (mode or os.getenv("DOWNSAMPLE", "off")).lower()
+    target = int(target or os.getenv("DOWNSAMPLE_TARGET", "600"))
+    stats = {"mode": mode, "bars_in": len(df), "bars_out": len(df), "anchors": 0}
+    if mode not in ("ohlc", "lttb") or len(df) <= target:
+        return df, stats
+
+    anchors = find_anchor_bars(df, target, climax_mult=float(os.getenv("DOWNSAMPLE_CLIMAX_MULT", "3.0")))
+    out = downsample_ohlc(df, target, anchors) if mode == "ohlc" else downsample_lttb(df, target, anchors)
+    out = out.reset_index(drop=True)
+    stats.update(bars_out=len(out), anchors=int(anchors.sum()))
+    return out, stats
@@ -0,0 +1,110 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _pool_size() -> int:
+    """连接池大小：默认与 LLM 并发线程数一致"""
+    default = os.getenv("LLM_WORKERS") or os.getenv("MAX_WORKERS", "4")
+    return max(1, int(os.getenv("HTTP_POOL_SIZE", default)))
+
+
+class ReuseStats:
+    """统计请求数与新建 TCP 连接数，用于确认 keep-alive 生效"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def add_request(self):
+        with self._lock: self.requests += 1
+
+    def add_connection(self):
+        with self._lock: self.connections += 1
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections)
+
+
+_SESSIONS: dict[str, requests.Session] = {}
+_OPENAI_CLIENTS: dict[tuple, "OpenAI"] = {}
+_STATS: dict[str, ReuseStats] = {}
+_LOCK = threading.Lock()
+
+
+def _stats(name: str) -> ReuseStats:
+    if name not in _STATS: _STATS[name] = ReuseStats()
+    return _STATS[name]
+
+
+def _session_connections(session: requests.Session) -> int:
+    """urllib3 每个连接池都记录了新建连接数 (num_connections)"""
+    total = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            total += getattr(pool, "num_connections", 0) if pool else 0
+    return total
+
+
+def get_session(name: str) -> requests.Session:
+    """按名称获取进程内共享的 requests.Session (连接池 + keep-alive)"""
+    with _LOCK:
+        session = _SESSIONS.get(name)
+        if session is None:
+            stats = _stats(name)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=_pool_size())
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.hooks["response"].append(lambda resp, *a, **kw: stats.add_request())
+            _SESSIONS[name] = session
+        return session
+
+
+def get_openai_client(name: str, api_key: str, base_url: str = None) -> "OpenAI":
+    """按 (名称, Key, base_url) 缓存 OpenAI 兼容客户端，底层 httpx 连接池在调用间复用"""
+    # openai 导入约 1 秒，只在首次真正需要客户端时加载
+    from openai import OpenAI, DefaultHttpxClient
+    try:
+        import httpx
+    except ImportError:  # 新版 openai 依赖的是 httpx2
+        import httpx2 as httpx
+
+    key = (name, api_key, base_url)
+    with _LOCK:
+        client = _OPENAI_CLIENTS.get(key)
+        if client is None:
+            stats = _stats(name)
+            size = _pool_size()
+
+            def tracer(event_name, info):
+                if event_name == "connection.connect_tcp.complete": stats.add_connection()
+
+            def on_request(request):
+                stats.add_request()
+                request.extensions["trace"] = tracer
+
+            http_client = DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                event_hooks={"request": [on_request]},
+            )
+            kwargs = {"api_key": api_key, "http_client": http_client}
+            if base_url: kwargs["base_url"] = base_url
+            client = _OPENAI_CLIENTS[key] = OpenAI(**kwargs)
+        return client
+
+
+def reuse_summary() -> str:
+    with _LOCK:
+        for name, session in _SESSIONS.items():
+            _STATS[name].connections = _session_connections(session)
+    lines = []
+    for name, st in sorted(_STATS.items()):
+        if not st.requests: continue
+        lines.append(f"   🔗 {name}: {st.requests} 次请求, 新建连接 {st.connections}, 复用 {st.reused}")
+    return "\n".join(lines)
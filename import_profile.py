@@ -0,0 +1,101 @@
+import atexit
+import builtins
+import os
+import subprocess
+import sys
+import threading
+import time
+
+_ORIG_IMPORT = builtins.__import__
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_START = time.perf_counter()
+# (开始时刻秒, 自身毫秒, 累计毫秒, 嵌套深度, 模块名)
+_RECORDS: list[tuple] = []
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # 已加载的模块直接返回，只统计真正触发加载的导入
+    if level == 0 and name in sys.modules:
+        return _ORIG_IMPORT(name, globals, locals, fromlist, level)
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None: stack = _LOCAL.stack = []
+    stack.append(0.0)  # 子导入累计耗时
+    t0 = time.perf_counter()
+    try:
+        return _ORIG_IMPORT(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.perf_counter() - t0
+        children = stack.pop()
+        if stack: stack[-1] += cumulative
+        with _LOCK:
+            _RECORDS.append((t0 - _START, (cumulative - children) * 1000, cumulative * 1000, len(stack), name))
+
+
+def install():
+    """PROFILE_IMPORTS=1 时由 main.py 最先调用：记录运行期间每次模块加载的耗时，退出时打印"""
+    if builtins.__import__ is _timed_import: return
+    builtins.__import__ = _timed_import
+    atexit.register(lambda: print(report(), flush=True))
+
+
+def report(top: int = None, min_ms: float = None) -> str:
+    """
+    仿 `python -X importtime` 的分解表：自身 / 累计毫秒，按嵌套深度缩进。
+    只列累计耗时 >= PROFILE_IMPORTS_MIN_MS (默认 5) 的导入；开始时刻可看出各依赖在哪个阶段才被加载。
+    """
+    top = top or int(os.getenv("PROFILE_IMPORTS_TOP", "40"))
+    min_ms = float(os.getenv("PROFILE_IMPORTS_MIN_MS", "5")) if min_ms is None else min_ms
+    with _LOCK:
+        records = [r for r in _RECORDS if r[2] >= min_ms]
+    roots = sum(r[2] for r in records if r[3] == 0)
+    lines = [f"\n⏱️ 导入耗时 (顶层合计 {roots:.0f} ms):", "   开始(s)   自身(ms)   累计(ms) | 模块"]
+    for started, self_ms, cum_ms, depth, name in sorted(records, key=lambda r: r[0])[:top]:
+        lines.append(f"   {started:>7.2f} {self_ms:>10.1f} {cum_ms:>10.1f} | {'  ' * depth}{name}")
+    return "\n".join(lines)
+
+
+def measure(module: str, runs: int = 3) -> float:
+    """在全新解释器中导入 module，返回多次中最快的一次 (秒)，排除磁盘缓存冷热的干扰"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    best = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        elapsed = float(out.stdout.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def breakdown(module: str, top: int = 15) -> str:
+    """用 -X importtime 取 module 冷启动时累计最慢的直接依赖 (嵌套深度 1)"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cum_us, name = line.split("|", 2)
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth != 1: continue
+        rows.append((int(cum_us), name.strip()))
+    rows.sort(reverse=True)
+    return "\n".join(f"   {cum / 1000:>8.1f} ms | {name}" for cum, name in rows[:top])
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="冷启动导入耗时检查")
+    parser.add_argument("module", nargs="?", default="main")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("COLD_START_BUDGET_S", "1.5")),
+                        help="导入耗时上限 (秒)，超出时退出码为 1")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    elapsed = measure(args.module, args.runs)
+    ok = elapsed <= args.budget
+    print(f"{'✅' if ok else '❌'} import {args.module}: {elapsed * 1000:.0f} ms (预算 {args.budget * 1000:.0f} ms, {args.runs} 次取最快)", flush=True)
+    print(breakdown(args.module), flush=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import json
+import os
+import threading
+from typing import Optional
+
+
+class LastReports:
+    """
+    每只股票最近一份报告基于的最后一根 K 线、周期与 PDF 路径，落盘跨运行保留 (LAST_REPORTS_FILE)。
+    用于变化检测：没有新 K 线的股票不再重复出报告。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("LAST_REPORTS_FILE", "data/last_reports.json")
+        self._reports: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._reports = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, symbol: str, key: str) -> Optional[dict]:
+        """同一配置 (周期 / 根数) 下的上一份报告；配置变了视为没有"""
+        with self._lock:
+            rec = self._reports.get(symbol)
+        return rec if rec and rec.get("key") == key else None
+
+    def record(self, symbol: str, key: str, last_bar: str, period: str, pdf: str):
+        with self._lock:
+            self._reports[symbol] = {"key": key, "last_bar": last_bar, "period": period, "pdf": pdf}
+
+    def save(self):
+        with self._lock:
+            data = dict(self._reports)
+        if not data: return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
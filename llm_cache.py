@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+
+class LLMCache:
+    """
+    按内容寻址的 LLM 结果缓存：key = sha256(模型 + 温度 + 最终 prompt)。
+    每条结果一个 JSON 文件 ({root}/{key[:2]}/{key}.json)，按 TTL 过期，
+    总大小超过上限时按最近访问时间淘汰最旧的条目。
+    """
+
+    def __init__(self, root: str = None, ttl_s: float = None, max_bytes: int = None):
+        self.root = root or os.getenv("LLM_CACHE_DIR", "data/llm_cache")
+        self.ttl_s = ttl_s if ttl_s is not None else float(os.getenv("LLM_CACHE_TTL_HOURS", "24")) * 3600
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("LLM_CACHE_MAX_MB", "50")) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float) -> str:
+        h = hashlib.sha256()
+        h.update(f"{model}\x00{temperature:.4f}\x00".encode("utf-8"))
+        h.update(prompt.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """读取未过期的条目 (不计入命中率)"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl_s > 0 and time.time() - entry.get("created", 0) > self.ttl_s:
+            try: os.remove(path)
+            except OSError: pass
+            return None
+        try: os.utime(path)  # 记录访问时间，供 LRU 淘汰
+        except OSError: pass
+        return entry
+
+    def lookup(self, keys: Iterable[str]) -> Optional[dict]:
+        """依次尝试多个 key (同一 prompt 在不同模型下的结果)，计一次命中/未命中"""
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                with self._lock: self.hits += 1
+                return entry
+        with self._lock: self.misses += 1
+        return None
+
+    def put(self, key: str, text: str, **meta):
+        if not text: return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created": time.time(), "text": text, **meta}
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        if self.max_bytes <= 0 or not os.path.isdir(self.root): return
+        with self._lock:
+            files = []
+            total = 0
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    if not name.endswith(".json"): continue
+                    p = os.path.join(dirpath, name)
+                    try: st = os.stat(p)
+                    except OSError: continue
+                    files.append((st.st_mtime, st.st_size, p))
+                    total += st.st_size
+            if total <= self.max_bytes: return
+            for _, size, p in sorted(files):
+                try: os.remove(p)
+                except OSError: continue
+                total -= size
+                self.evicted += 1
+                if total <= self.max_bytes: break
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"   💾 LLM 缓存: 命中 {self.hits}/{total} ({rate:.0%}), 淘汰 {self.evicted} 条"
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+class LLMStreamStalled(Exception):
+    """流式响应停滞 (距上一个分片超过 stall 超时) 或首 token 超时"""
+    pass
+
+
+class StreamBuffer:
+    """
+    流式报告缓冲区：分片到达即追加，记录首 token 时间 (TTFT) 与最后一次收到分片的时间。
+    设置了 LLM_STREAM_DIR 时同步写入 {dir}/{label}.md，便于运行中查看进度。
+    """
+
+    def __init__(self, label: str = "", stall_timeout_s: float = None, first_token_timeout_s: float = None):
+        self.label = label
+        self.stall_timeout_s = stall_timeout_s or float(os.getenv("LLM_STALL_TIMEOUT", "30"))
+        self.first_token_timeout_s = first_token_timeout_s or float(
+            os.getenv("LLM_FIRST_TOKEN_TIMEOUT", os.getenv("GEMINI_TIMEOUT", "120")))
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.chunks = 0
+        self.stalled = False
+        self.cancelled = False
+        self._parts: list[str] = []
+        self._abort: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+        self._sink = None
+
+        stream_dir = os.getenv("LLM_STREAM_DIR")
+        if stream_dir and label:
+            os.makedirs(stream_dir, exist_ok=True)
+            self._sink = open(os.path.join(stream_dir, f"{label}.md"), "w", encoding="utf-8")
+
+    def feed(self, text: str):
+        if not text: return
+        now = time.monotonic()
+        with self._lock:
+            if self.first_token_at is None: self.first_token_at = now
+            self.last_chunk_at = now
+            self.chunks += 1
+            self._parts.append(text)
+            if self._sink:
+                self._sink.write(text)
+                self._sink.flush()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def ttft_s(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.started
+
+    def reset(self):
+        """重试前清空已收到的分片"""
+        with self._lock:
+            self._parts.clear()
+            self.started = time.monotonic()
+            self.first_token_at = self.last_chunk_at = None
+            self.chunks = 0
+            self.stalled = False
+            if self._sink:
+                self._sink.seek(0)
+                self._sink.truncate()
+
+    def cancel(self):
+        """外部取消 (如对冲请求落败)：立即中断底层连接"""
+        self.cancelled = True
+        if self._abort: self._abort()
+
+    def close(self):
+        if self._sink:
+            self._sink.close()
+            self._sink = None
+
+    def _expired(self) -> bool:
+        now = time.monotonic()
+        if self.last_chunk_at is None:
+            return now - self.started > self.first_token_timeout_s
+        return now - self.last_chunk_at > self.stall_timeout_s
+
+    @contextmanager
+    def watch(self, abort: Callable[[], None]):
+        """
+        在读取流期间运行看门狗：按 "距上一个分片的时间" 判断停滞，
+        而不是整体耗时。停滞时调用 abort() 关闭连接，读取方随即抛出 LLMStreamStalled。
+        """
+        self._abort = abort
+        done = threading.Event()
+
+        def watchdog():
+            while not done.wait(0.5):
+                if self._expired():
+                    self.stalled = True
+                    try: abort()
+                    except Exception: pass
+                    return
+
+        t = threading.Thread(target=watchdog, daemon=True)
+        t.start()
+        try:
+            yield self
+        except Exception as e:
+            if self.stalled: raise LLMStreamStalled(self._stall_message()) from e
+            if self.cancelled: raise LLMStreamStalled(f"{self.label} cancelled") from e
+            raise
+        finally:
+            done.set()
+            self._abort = None
+        if self.stalled: raise LLMStreamStalled(self._stall_message())
+        if self.cancelled: raise LLMStreamStalled(f"{self.label} cancelled")
+
+    def _stall_message(self) -> str:
+        if self.first_token_at is None:
+            return f"no first token after {self.first_token_timeout_s:.0f}s"
+        return f"stream stalled for {self.stall_timeout_s:.0f}s after {self.chunks} chunks"
@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from bench import BENCH_TEMPLATE
+
+# OpenAI 兼容提供方在 LLM 替身里按模型名区分 (与 main.custom_model_name 一致)
+CUSTOM_MODEL = "DeepSeek-V3.2-a"
+
+DEFAULT_LLM_FAULTS = (
+    "gemini:429=0.08,gemini:503=0.05,gemini:quota=0.003,"
+    f"{CUSTOM_MODEL}:429=0.05,{CUSTOM_MODEL}:503=0.03,{CUSTOM_MODEL}:400=0.02"
+)
+
+_RESULT_PREFIX = "LOADTEST_RESULT "
+
+
+def _percentiles(values: list, qs=(50, 95, 99)) -> dict:
+    if not values: return {f"p{q}": None for q in qs}
+    return {f"p{q}": round(float(np.percentile(values, q)), 3) for q in qs}
+
+
+def _start_servers(args, n: int) -> dict:
+    from stub_servers import LLMStubServer, MarketDataStubServer, SheetsStubServer, TelegramStubServer
+    common = dict(retry_after=args.retry_after, seed=args.seed)
+    rows = [[f"{600000 + i:06d}" if i % 2 else f"{i + 1:06d}", "", "", "", args.timeframe, args.bars] for i in range(n)]
+    return {
+        "llm": LLMStubServer(latency_s=args.llm_latency, faults=args.llm_faults, **common).start(),
+        "market": MarketDataStubServer(latency_s=args.market_latency, faults=args.market_faults, **common).start(),
+        "sheets": SheetsStubServer(latency_s=args.sheets_latency, faults=args.sheets_faults, rows=rows, **common).start(),
+        "telegram": TelegramStubServer(latency_s=args.tg_latency, faults=args.tg_faults, **common).start(),
+    }
+
+
+def _run_env(args, servers: dict) -> dict:
+    env = {}
+    for server in servers.values(): env.update(server.env())
+    rate = args.rate_limit
+    env.update({
+        "GEMINI_API_KEY": "loadtest", "CUSTOM_API_KEY": "loadtest", "OPENAI_API_KEY": "loadtest",
+        "TG_BOT_TOKEN": "loadtest", "TG_CHAT_ID": "1",
+        "WYCKOFF_PROMPT_TEMPLATE": BENCH_TEMPLATE,
+        # 每次都要真正打到替身上，并保持 Gemini -> Custom -> OpenAI 的固定兜底顺序
+        "LLM_CACHE": "0", "LLM_PROVIDER_RANKING": "0", "LLM_HEDGE": "0", "GEMINI_CONTEXT_CACHE": "0",
+        "GEMINI_MAX_RETRIES": str(args.gemini_retries), "GEMINI_BASE_SLEEP": str(args.base_sleep),
+        "TRACE": "1", "TRACE_DIR": "data/trace", "TRACE_PROM": "data/metrics.prom",
+    })
+    for name in ("GEMINI", "CUSTOM", "OPENAI", "BAOSTOCK", "AKSHARE"):
+        env[f"RATE_LIMIT_{name}"] = rate
+    return env
+
+
+def _analyze_spans(spans: list, delivered: set) -> dict:
+    """
+    从追踪 span 计算每只股票端到端耗时、LLM 尾延迟、重试 / 降级 / 失败次数。
+    端到端耗时与报告数只统计 PDF 已生成且替身确实收到的股票 (delivered)。
+    """
+    by_symbol: dict[str, list] = {}
+    for sp in spans:
+        if sp.name.startswith("stage.") and sp.symbol: by_symbol.setdefault(sp.symbol, []).append(sp)
+    e2e, produced = [], 0
+    for symbol, items in by_symbol.items():
+        pdfs = [sp for sp in items if sp.name == "stage.pdf" and sp.status == "ok"]
+        fetches = [sp for sp in items if sp.name == "stage.fetch"]
+        produced += bool(pdfs)
+        if pdfs and fetches and symbol in delivered:
+            e2e.append(max(sp.start + sp.duration_s for sp in pdfs) - min(sp.start for sp in fetches))
+
+    llm = {}
+    for sp in spans:
+        if not sp.name.startswith("llm."): continue
+        row = llm.setdefault(sp.name[4:], {"calls": 0, "errors": 0, "retries": 0, "durations": []})
+        row["calls"] += 1
+        row["errors"] += sp.status != "ok"
+        row["retries"] += sp.attrs.get("retries", 0)
+        row["durations"].append(sp.duration_s)
+    analyze = [sp for sp in spans if sp.name == "stage.analyze"]
+    return {
+        "e2e_s": _percentiles(e2e),
+        "reports": len(e2e),
+        "produced": produced,
+        "llm": {name: dict({k: v for k, v in row.items() if k != "durations"}, **_percentiles(row["durations"], (50, 95)))
+                for name, row in sorted(llm.items())},
+        "fallbacks": sum(sp.attrs.get("fallbacks", 0) for sp in analyze),
+        "failed_analyses": sum(1 for sp in analyze if not sp.attrs.get("provider")),
+        "providers": {p: sum(1 for sp in analyze if sp.attrs.get("provider") == p)
+                      for p in sorted({sp.attrs.get("provider") for sp in analyze if sp.attrs.get("provider")})},
+    }
+
+
+def _checks(result: dict, servers: dict, pushed: int, delivered: int) -> dict:
+    """客户端行为是否符合预期：名称 -> (是否通过, 说明)"""
+    llm, tg, sheets = servers["llm"].requests, servers["telegram"].requests, servers["sheets"].requests
+    gemini = result["llm"].get("gemini", {})
+    fatal_llm = sum(llm[f"{p}_fault_quota"] for p in ("gemini", CUSTOM_MODEL)) + llm["gemini_fault_400"]
+    checks = {
+        "no_failed_analyses": (result["failed_analyses"] == 0, f"{result['failed_analyses']} 份分析全部提供方失败"),
+        "honors_retry_after": (llm["retry_early"] + tg["retry_early"] == 0,
+                               f"LLM {llm['retry_ok']}/{llm['retry_ok'] + llm['retry_early']}, "
+                               f"Telegram {tg['retry_ok']}/{tg['retry_ok'] + tg['retry_early']} 次 429 重发满足 Retry-After"),
+        "no_retry_on_fatal": (llm["retry_fatal"] + tg["retry_fatal"] == 0,
+                              f"{fatal_llm} 次 400 / 配额耗尽后重发 {llm['retry_fatal']} 次"),
+        "stops_after_block": (llm["after_block"] == 0, f"熔断后仍有 {llm['after_block']} 个新请求"),
+        "no_wasted_backoff": (gemini.get("retries", 0) == llm["gemini_retry"],
+                              f"Gemini 退避 {gemini.get('retries', 0)} 次, 实际重发 {llm['gemini_retry']} 次"),
+        "falls_back": (result["fallbacks"] == sum(result["llm"].get(p, {}).get("errors", 0) for p in ("gemini", "custom")),
+                       f"Gemini / Custom 失败 {sum(result['llm'].get(p, {}).get('errors', 0) for p in ('gemini', 'custom'))} 次, "
+                       f"降级 {result['fallbacks']} 次"),
+        "delivers_all": (delivered == pushed == result["produced"] == result["reports"] and len(tg_documents(servers)) == pushed,
+                         f"生成 {result['produced']} 份, 推送 {delivered}/{pushed}, 替身收到 {len(tg_documents(servers))} 份"),
+        "batched_sheet_writes": (sheets["batch_update_values"] + sheets["batch_update"] + sheets["append"] <= 3,
+                                 f"{sheets['batch_update_values'] + sheets['batch_update'] + sheets['append']} 次写入"),
+    }
+    return {name: {"ok": bool(ok), "detail": detail} for name, (ok, detail) in checks.items()}
+
+
+def tg_documents(servers: dict) -> set:
+    return set(servers["telegram"].documents)
+
+
+def run_child(args, n: int):
+    """在当前目录 (已清空的工作目录) 内跑一次完整流程：表格指令 -> 取数 / 分析 / 出图 / PDF -> 推送"""
+    servers = _start_servers(args, n)
+    os.environ.update(_run_env(args, servers))
+    for text in (f"{n + 1:06d} 2024-01-02 10.5 100", f"{600000 + n + 1:06d}", f"删除 {n + 1:06d}"):
+        servers["telegram"].push_update(text)
+
+    import add_stock
+    import main
+    import tracing
+
+    t0 = time.perf_counter()
+    with open("run.log", "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        add_stock.main()
+        t_sheet = time.perf_counter()
+        main.main()
+        t_main = time.perf_counter()
+        listed = []
+        if os.path.exists("push_list.txt"):
+            with open("push_list.txt", encoding="utf-8") as f:
+                listed = [line.strip() for line in f if line.strip()]
+        pushed = len(listed)
+        delivered = add_stock.push_reports()
+    t_end = time.perf_counter()
+
+    # 清单中存在的 PDF 且替身收到了同名文件，才算送达 (文件名以股票代码开头)
+    received = tg_documents(servers)
+    delivered_symbols = {os.path.basename(p).split("_")[0] for p in listed
+                         if os.path.isfile(p) and os.path.basename(p) in received}
+    tracer = tracing.get_tracer()
+    result = _analyze_spans(list(tracer.spans) if tracer else [], delivered_symbols)
+    symbols = n + 1  # 指令新增 1 只
+    result.update({
+        "symbols": symbols,
+        "wall_s": round(t_end - t0, 2),
+        "main_s": round(t_main - t_sheet, 2),
+        "push_s": round(t_end - t_main, 2),
+        # 从开始出报告到推送完成：只按已送达的报告计
+        "throughput_per_min": round(result["reports"] / max(t_end - t_sheet, 1e-9) * 60, 1),
+        "stub": {name: dict(server.requests) for name, server in servers.items()},
+    })
+    result["checks"] = _checks(result, servers, pushed, delivered)
+    print(_RESULT_PREFIX + json.dumps(result, ensure_ascii=False, default=str), flush=True)
+    for server in servers.values(): server.shutdown()
+
+
+def _child_argv(args, n: int) -> list:
+    argv = [sys.executable, os.path.abspath(__file__), "--child", str(n)]
+    for key, value in vars(args).items():
+        if key in ("symbols", "out", "child") or value is None: continue
+        argv += [f"--{key.replace('_', '-')}", str(value)]
+    return argv
+
+
+def _print_row(n: int, r: dict):
+    e2e, llm = r["e2e_s"], r["llm"]
+    llm_p95 = " ".join(f"{name}={row['p95']}s" for name, row in llm.items() if row.get("p95") is not None)
+    print(f"   {n:>6}{r['reports']:>8}{r['wall_s']:>9.1f}s{r['throughput_per_min']:>9.1f}/min"
+          f"{e2e['p50'] or 0:>8.1f}s{e2e['p95'] or 0:>8.1f}s{e2e['p99'] or 0:>8.1f}s  {llm_p95}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测：行情 / LLM / Sheets / Telegram 全部换成本地替身，注入延迟与故障")
+    parser.add_argument("--symbols", default="10,100,1000", help="逗号分隔的股票数量档位，每档单独一个子进程")
+    parser.add_argument("--out", default="reports/loadtest", help="工作目录 (须在项目目录内，xhtml2pdf 不读取目录外的图片)")
+    parser.add_argument("--timeframe", default="5")
+    parser.add_argument("--bars", default="300")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.5", help="见 stub_servers.parse_latency")
+    parser.add_argument("--llm-faults", default=DEFAULT_LLM_FAULTS,
+                        help="见 stub_servers.parse_faults；默认 OpenAI 作为最后兜底不注入故障")
+    parser.add_argument("--market-latency", default="uniform:0.02,0.15")
+    parser.add_argument("--market-faults", default="503=0.01")
+    parser.add_argument("--sheets-latency", default="uniform:0.05,0.3")
+    parser.add_argument("--sheets-faults", default="")
+    parser.add_argument("--tg-latency", default="uniform:0.05,0.3")
+    parser.add_argument("--tg-faults", default="429=0.05,503=0.02")
+    parser.add_argument("--retry-after", type=int, default=1, help="注入 429 时替身要求的等待秒数")
+    parser.add_argument("--gemini-retries", type=int, default=3)
+    parser.add_argument("--base-sleep", type=float, default=0.5, help="GEMINI_BASE_SLEEP")
+    parser.add_argument("--rate-limit", default="50/s,10", help="压测时各数据源 / 模型的 RATE_LIMIT_*")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args, args.child)
+        return
+
+    scales = [int(s) for s in args.symbols.split(",") if s.strip()]
+    print(f"🏋️ 压测档位: {', '.join(map(str, scales))} 只 (LLM 延迟 {args.llm_latency}, 故障 {args.llm_faults or '无'})", flush=True)
+    results, failed = {}, []
+    for n in scales:
+        work_dir = os.path.join(args.out, f"n{n}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        print(f"\n▶️ {n} 只 -> {work_dir}/run.log", flush=True)
+        proc = subprocess.run(_child_argv(args, n), cwd=work_dir, capture_output=True, text=True)
+        line = next((l for l in proc.stdout.splitlines() if l.startswith(_RESULT_PREFIX)), None)
+        if proc.returncode != 0 or line is None:
+            print(f"   ❌ 子进程失败 (exit {proc.returncode}):\n{proc.stderr[-2000:]}", flush=True)
+            failed.append(f"n{n}:crashed")
+            continue
+        result = results[n] = json.loads(line[len(_RESULT_PREFIX):])
+        for name, check in result["checks"].items():
+            print(f"   {'✅' if check['ok'] else '❌'} {name}: {check['detail']}", flush=True)
+            if not check["ok"]: failed.append(f"n{n}:{name}")
+
+    if results:
+        print(f"\n📊 压测结果 (只计已送达的报告；端到端 = 取数开始到 PDF 完成，吞吐含推送):", flush=True)
+        print(f"   {'股票':>6}{'报告':>8}{'总耗时':>10}{'吞吐':>13}{'e2e p50':>9}{'p95':>9}{'p99':>9}  LLM p95", flush=True)
+        for n, r in results.items(): _print_row(n, r)
+        with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({str(n): r for n, r in results.items()}, f, ensure_ascii=False, indent=1)
+
+    if failed:
+        print(f"\n❌ 未通过: {', '.join(failed)}", flush=True)
+        sys.exit(1)
+    print("\n✅ 全部检查通过", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,37 @@
 import os
+if os.getenv("PROFILE_IMPORTS") == "1":
+    import import_profile; import_profile.install()  # 须在其余导入之前，退出时打印导入耗时分解
 import time
 import requests
 from datetime import datetime, timedelta, timezone
 import pandas as pd
-import akshare as ak
-import baostock as bs
-import mplfinance as mpf
-from openai import OpenAI
 import numpy as np
-import markdown
-from xhtml2pdf import pisa
-from sheet_manager import SheetManager
+from bar_store import BarStore
 
+# akshare / baostock / openai / matplotlib / xhtml2pdf / gspread 合计数秒，均在首次用到的阶段内才导入，
+# 试运行 (--dry-run) 与只读表格的路径不为它们付出启动时间 (python import_profile.py 检查冷启动预算)
+import hashlib
+import io
+import sys
 import json
 import random
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from typing import Optional
+from rate_limiter import get_limiter, limiter_summary
+from http_clients import get_session as get_http_session, get_openai_client, reuse_summary
+from llm_cache import LLMCache
+from llm_stream import StreamBuffer
+from provider_stats import ProviderStats
+from circuit_breaker import BreakerRegistry, CLOSED, FAILURE_ERROR, FAILURE_FATAL, FAILURE_QUOTA, next_gemini_quota_reset
+from downsample import downsample_bars
+from resample import latest_bar_end, resample_a_share
+from prompt_encoder import encode_bars, estimate_tokens, fit_to_budget, price_decimals, token_budget
+from pipeline import Stage, StagedPipeline
+from run_journal import RunJournal
+from last_reports import LastReports
+import tracing
 
 # ==========================================
 # 0) Gemini 稳定性增强：429 退避 + 致命错误熔断 + 防断连
@@ -58,20 +74,96 @@ def _is_quota_exhausted(resp: requests.Response) -> bool:
     except: pass
     return False
 
-def call_gemini_http(prompt: str) -> str:
-    """第一优先级：Google 官方 API"""
+LLM_TEMPERATURE = 0.2
+
+def gemini_model_name() -> str:
+    return os.getenv("GEMINI_MODEL") or "gemini-1.5-flash"
+
+def custom_model_name() -> str:
+    return "DeepSeek-V3.2-a"
+
+def openai_model_name() -> str:
+    return os.getenv("AI_MODEL", "gpt-4o")
+
+def _read_gemini_stream(resp: requests.Response, buffer: StreamBuffer) -> str:
+    """逐条解析 SSE 事件 (data: {...})，分片到达即写入缓冲区"""
+    resp.encoding = "utf-8"
+    with buffer.watch(resp.close):
+        # urllib3 的 read(n) 会凑满 n 字节才返回，分片小时必须逐字节读取才能及时拿到事件
+        for line in resp.iter_lines(chunk_size=1, decode_unicode=True):
+            if not line or not line.startswith("data:"): continue
+            payload = json.loads(line[5:].strip())
+            if payload.get("usageMetadata"): _record_gemini_usage(payload["usageMetadata"])
+            for cand in (payload.get("candidates") or [])[:1]:
+                for part in (cand.get("content") or {}).get("parts", []):
+                    buffer.feed(part.get("text", ""))
+    if not buffer.text:
+        raise ValueError("Invalid response: empty stream")
+    return buffer.text
+
+def _record_gemini_usage(usage: dict):
+    """把 Gemini 返回的 token 用量记到当前 span (未返回时由 _invoke_provider 估算)"""
+    sp = tracing.current()
+    if "promptTokenCount" in usage: sp.set(prompt_tokens=usage["promptTokenCount"])
+    if "candidatesTokenCount" in usage: sp.set(completion_tokens=usage["candidatesTokenCount"])
+
+def gemini_base_url() -> str:
+    return os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+
+_GEMINI_CONTEXTS = {}
+_GEMINI_CONTEXT_LOCK = threading.Lock()
+
+def _gemini_context_cache(model_name: str, api_key: str, prompt: str) -> Optional[tuple[str, str]]:
+    """
+    GEMINI_CONTEXT_CACHE=1 时把批量模式的公共模板前缀上传为 cachedContent，
+    之后的批量请求只发送各标的数据段。返回 (资源名, 前缀)；单只请求或前缀不足
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS (服务端缓存下限) 时不创建；创建失败则本次运行不再尝试。
+    """
+    if os.getenv("GEMINI_CONTEXT_CACHE", "0") != "1" or not _load_prompt_template(): return None
+    prefix = _shared_template()
+    if not prompt.startswith(prefix): return None
+    if estimate_tokens(prefix) < int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024")): return None
+    key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+    with _GEMINI_CONTEXT_LOCK:
+        if key in _GEMINI_CONTEXTS: return _GEMINI_CONTEXTS[key] or None
+        ttl = int(os.getenv("GEMINI_CONTEXT_TTL_S", "3600"))
+        body = {
+            "model": f"models/{model_name}",
+            "systemInstruction": {"parts": [{"text": "You are Richard D. Wyckoff."}]},
+            "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+            "ttl": f"{ttl}s",
+        }
+        try:
+            resp = get_http_session("gemini").post(f"{gemini_base_url()}/v1beta/cachedContents?key={api_key}", json=body, timeout=30)
+            if resp.status_code != 200: raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            _GEMINI_CONTEXTS[key] = (resp.json()["name"], prefix)
+            print(f"   🗄️ Gemini 上下文缓存已创建: {_GEMINI_CONTEXTS[key][0]} (TTL {ttl}s)", flush=True)
+        except Exception:
+            _GEMINI_CONTEXTS[key] = False
+        return _GEMINI_CONTEXTS[key] or None
+
+def _drop_gemini_context(name: str):
+    """服务端缓存已过期 / 被删除时作废，之后按完整 prompt 发送"""
+    with _GEMINI_CONTEXT_LOCK:
+        for key, ctx in _GEMINI_CONTEXTS.items():
+            if ctx and ctx[0] == name: _GEMINI_CONTEXTS[key] = False
+
+def call_gemini_http(prompt: str, stream_buffer: Optional[StreamBuffer] = None) -> str:
+    """第一优先级：Google 官方 API (传入 stream_buffer 时使用 streamGenerateContent)"""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key: raise ValueError("GEMINI_API_KEY missing")
 
-    model_name = os.getenv("GEMINI_MODEL") or "gemini-1.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+    model_name = gemini_model_name()
+    stream = stream_buffer is not None
+    method = "streamGenerateContent?alt=sse&" if stream else "generateContent?"
+    url = f"{gemini_base_url()}/v1beta/models/{model_name}:{method}key={api_key}"
 
-    session = requests.Session()
+    # 进程内共享的连接池：keep-alive 复用 TCP/TLS 连接，避免每次调用重新握手
+    session = get_http_session("gemini")
     
     headers = {
         "Content-Type": "application/json",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Connection": "close"
     }
 
     safety_settings = [
@@ -83,10 +175,18 @@ def call_gemini_http(prompt: str) -> str:
     data = {
         "contents": [{"parts": [{"text": prompt}]}],
         "system_instruction": {"parts": [{"text": "You are Richard D. Wyckoff."}]},
-        "generationConfig": {"temperature": 0.2},
+        "generationConfig": {"temperature": LLM_TEMPERATURE},
         "safetySettings": safety_settings,
     }
 
+    # 批量请求的公共模板已在服务端缓存时，只发送其后的各标的数据段
+    full_data = data
+    context = _gemini_context_cache(model_name, api_key, prompt)
+    if context:
+        data = {k: v for k, v in full_data.items() if k != "system_instruction"}
+        data["cachedContent"] = context[0]
+        data["contents"] = [{"role": "user", "parts": [{"text": prompt[len(context[1]):]}]}]
+
     # ⚠️ 默认重试次数
     max_retries = int(os.getenv("GEMINI_MAX_RETRIES", "1"))
     base_sleep = float(os.getenv("GEMINI_BASE_SLEEP", "3.0"))
@@ -96,10 +196,20 @@ def call_gemini_http(prompt: str) -> str:
 
     for attempt in range(1, max_retries + 1):
         try:
-            resp = session.post(url, headers=headers, json=data, timeout=timeout_s)
+            tracing.current().add("wait_s", get_limiter("gemini").acquire())
+            if stream: stream_buffer.reset()
+            resp = session.post(url, headers=headers, json=data, timeout=timeout_s, stream=stream)
+            if data is not full_data and resp.status_code in (400, 403, 404):
+                # 缓存失效 (过期 / 被删除)：不算失败，作废后立即按完整 prompt 重发
+                _drop_gemini_context(data["cachedContent"])
+                data = full_data
+                resp = session.post(url, headers=headers, json=data, timeout=timeout_s, stream=stream)
 
             if resp.status_code == 200:
+                if stream:
+                    return _read_gemini_stream(resp, stream_buffer)
                 result = resp.json()
+                if result.get("usageMetadata"): _record_gemini_usage(result["usageMetadata"])
                 try:
                     return result["candidates"][0]["content"]["parts"][0]["text"]
                 except:
@@ -120,12 +230,17 @@ def call_gemini_http(prompt: str) -> str:
                     raise GeminiRateLimited(resp.text[:200])
 
                 print(f"   ⚠️ Gemini 429限流，等待 {retry_s}s ({attempt}/{max_retries})", flush=True)
+                tracing.current().add("retries")
                 time.sleep(retry_s)
                 continue
 
             if resp.status_code == 503:
+                # 最后一次尝试不再等待：直接交给降级链，避免白白多睡一个退避周期
+                if attempt == max_retries:
+                    raise Exception(f"HTTP 503: {resp.text[:200]}")
                 retry_s = int(base_sleep * (2 ** (attempt - 1)) + random.random())
                 print(f"   ⚠️ Gemini 503过载，等待 {retry_s}s ({attempt}/{max_retries})", flush=True)
+                tracing.current().add("retries")
                 time.sleep(retry_s)
                 continue
 
@@ -138,6 +253,7 @@ def call_gemini_http(prompt: str) -> str:
             if attempt == max_retries: raise
             retry_s = int(base_sleep * (2 ** (attempt - 1)) + random.random())
             print(f"   ⚠️ Gemini 异常: {str(e)[:100]}... 等待 {retry_s}s ({attempt}/{max_retries})", flush=True)
+            tracing.current().add("retries")
             time.sleep(retry_s)
 
     raise last_err or Exception("Gemini Unknown Failure")
@@ -153,6 +269,9 @@ def _get_baostock_code(symbol: str) -> str:
     if symbol.startswith("8") or symbol.startswith("4"): return f"bj.{symbol}"
     return f"sz.{symbol}"
 
+# 双源比对成交量单位所需的最少重叠 K 线数
+_MIN_VOLUME_OVERLAP = 10
+
 def _detect_and_fix_volume_units(df_bs: pd.DataFrame, df_ak: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     智能修正 AkShare 的成交量单位（手 vs 股）。
@@ -206,7 +325,10 @@ def _detect_and_fix_volume_units(df_bs: pd.DataFrame, df_ak: pd.DataFrame) -> tu
     m = a.merge(b, on="date", how="inner", suffixes=("_bs", "_ak"))
     m = m[(m["volume_bs"] > 0) & (m["volume_ak"] > 0)]
 
-    if len(m) < 10: 
+    if len(m) < _MIN_VOLUME_OVERLAP:
+        # 重叠太少无法比对：按单源整百率判断 AkShare 单位，绝不原样合并 (可能是"手")
+        print(f"   ⚖️ [双源] 重叠仅 {len(m)} 根，改用单源判断", flush=True)
+        _, df_ak = _detect_and_fix_volume_units(pd.DataFrame(), df_ak)
         return df_bs, df_ak
 
     m = m.tail(200) # 只看最近
@@ -236,6 +358,92 @@ def _detect_and_fix_volume_units(df_bs: pd.DataFrame, df_ak: pd.DataFrame) -> tu
         
     return df_bs, df_ak
 
+def _fetch_baostock(symbol_code: str, tf_min: int, start_date_str: str) -> pd.DataFrame:
+    """span 的 bytes_in 为解码后的 DataFrame 大小 (数据源 SDK 不暴露原始响应体)"""
+    with tracing.span("fetch.baostock", symbol_code) as sp:
+        df_bs = _query_baostock(symbol_code, tf_min, start_date_str)
+        sp.set(rows=len(df_bs), bytes_in=int(df_bs.memory_usage(index=False).sum()))
+    return df_bs
+
+def _query_baostock(symbol_code: str, tf_min: int, start_date_str: str) -> pd.DataFrame:
+    """通过整次运行共享的 BaoStock 会话查询（登录一次、串行访问、断线自动重连）"""
+    df_bs = pd.DataFrame()
+    try:
+        from baostock_session import get_session as get_baostock_session
+        bs_code = _get_baostock_code(symbol_code)
+        tracing.current().add("wait_s", get_limiter("baostock").acquire())
+        if os.getenv("MARKET_DATA_URL"):
+            df_bs = _query_market_data_url("baostock", symbol=bs_code, start_date=start_date_str, frequency=tf_min)
+        else:
+            df_bs = get_baostock_session().query_history_k(
+                bs_code, "date,time,open,high,low,close,volume",
+                start_date=start_date_str, end_date=datetime.now().strftime("%Y-%m-%d"),
+                frequency=str(tf_min), adjustflag="2"  # 前复权，与 AkShare (adjust="qfq") 及本地仓库一致
+            )
+        if not df_bs.empty:
+            df_bs["date"] = pd.to_datetime(df_bs["time"], format="%Y%m%d%H%M%S000", errors="coerce")
+            cols = ["open", "high", "low", "close", "volume"]
+            df_bs[cols] = df_bs[cols].apply(pd.to_numeric, errors="coerce")
+            df_bs = df_bs.dropna(subset=["date", "close"])
+            df_bs = df_bs[["date", "open", "high", "low", "close", "volume"]]
+    except Exception as e:
+        print(f"   [BaoStock] 异常: {e}", flush=True)
+    return df_bs
+
+def _fetch_akshare(symbol_code: str, tf_min: int, start_date_ak_str: str) -> pd.DataFrame:
+    with tracing.span("fetch.akshare", symbol_code) as sp:
+        df_ak = _query_akshare(symbol_code, tf_min, start_date_ak_str)
+        sp.set(rows=len(df_ak), bytes_in=int(df_ak.memory_usage(index=False).sum()))
+    return df_ak
+
+def _query_akshare(symbol_code: str, tf_min: int, start_date_ak_str: str) -> pd.DataFrame:
+    df_ak = pd.DataFrame()
+    try:
+        import akshare as ak
+        tracing.current().add("wait_s", get_limiter("akshare").acquire())
+        if os.getenv("MARKET_DATA_URL"):
+            df_ak = _query_market_data_url("akshare", symbol=symbol_code, start_date=start_date_ak_str, period=tf_min)
+        else:
+            df_ak = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=start_date_ak_str, adjust="qfq")
+        if not df_ak.empty:
+            rename_map = {
+                "时间": "date", "开盘": "open", "最高": "high", "最低": "low", 
+                "收盘": "close", "成交量": "volume"
+            }
+            df_ak = df_ak.rename(columns={k: v for k, v in rename_map.items() if k in df_ak.columns})
+            df_ak["date"] = pd.to_datetime(df_ak["date"], errors="coerce")
+            
+            cols = ["open", "high", "low", "close", "volume"]
+            for c in cols: df_ak[c] = pd.to_numeric(df_ak[c], errors="coerce")
+            
+            df_ak["open"] = df_ak["open"].replace(0, np.nan)
+            df_ak["open"] = df_ak["open"].fillna(df_ak["close"].shift(1)).fillna(df_ak["close"])
+            df_ak = df_ak.dropna(subset=["date", "close"])
+            df_ak = df_ak[["date", "open", "high", "low", "close", "volume"]]
+            
+    except Exception as e:
+        print(f"   [AkShare] 异常: {e}", flush=True)
+    return df_ak
+
+def _query_market_data_url(source: str, **params) -> pd.DataFrame:
+    """
+    MARKET_DATA_URL 指向行情替身 (stub_servers.MarketDataStubServer) 时，两个数据源都改走 HTTP，
+    返回与原接口相同列名的字符串表，后续清洗逻辑不变。压测 / 离线联调用。
+    """
+    resp = get_http_session("market_data").get(f"{os.getenv('MARKET_DATA_URL').rstrip('/')}/{source}", params=params, timeout=30)
+    if resp.status_code != 200:
+        raise Exception(f"HTTP {resp.status_code}: {resp.text[:100]}")
+    return pd.read_csv(io.StringIO(resp.text), dtype=str)
+
+_BAR_STORE = None
+
+def _get_bar_store() -> Optional[BarStore]:
+    """本地 K 线仓库 (USE_BAR_STORE=0 可关闭，回退为每次全量下载)"""
+    global _BAR_STORE
+    if os.getenv("USE_BAR_STORE", "1") == "0": return None
+    if _BAR_STORE is None: _BAR_STORE = BarStore(adjust="qfq")
+    return _BAR_STORE
+
 def fetch_stock_data_dynamic(symbol: str, timeframe_str: str, bar_count_str: str) -> dict:
     clean_digits = ''.join(filter(str.isdigit, str(symbol)))
     symbol_code = clean_digits.zfill(6)
@@ -249,86 +457,135 @@ def fetch_stock_data_dynamic(symbol: str, timeframe_str: str, bar_count_str: str
     if tf_min not in [1, 5, 15, 30, 60]:
         print(f"   ⚠️ 周期 {tf_min} 非标准(支持1/5/15/30/60)，调整为 60", flush=True)
         tf_min = 60
-    
+
+    if tf_min > 1 and os.getenv("DERIVE_FROM_1M", "0") == "1":
+        df_final = _derive_bars_from_1m(symbol_code, tf_min, limit)
+    else:
+        df_final = _fetch_bars(symbol_code, tf_min, limit)
+    return {"df": df_final, "period": f"{tf_min}m"}
+
+_ADJUST_TOLERANCE = 0.002  # 重叠区间收盘价比值偏离 1 超过此值视为复权价已变化
+
+def _adjusted_prices_changed(df_stored: pd.DataFrame, df_new: pd.DataFrame) -> bool:
+    """
+    重叠区间内已走完的 K 线收盘价是否整体偏离本地仓库 (本地最后一根当时可能尚未走完，不参与比较)。
+    除权除息会让之前所有前复权价按同一比例变化，取比值中位数，个别 K 线的一个价位误差不算。
+    """
+    if df_stored.empty or df_new.empty: return False
+    done = df_stored[df_stored["date"] < df_stored["date"].iloc[-1]]
+    m = done[["date", "close"]].merge(df_new[["date", "close"]], on="date", suffixes=("_old", "_new")).dropna()
+    m = m[m["close_old"] > 0]
+    if m.empty: return False
+    return abs(float((m["close_new"] / m["close_old"]).median()) - 1) > _ADJUST_TOLERANCE
+
+def _fetch_bars(symbol_code: str, tf_min: int, limit: int) -> pd.DataFrame:
+    """按原生周期获取最近 limit 根 K 线 (本地仓库 + 增量下载)"""
     total_minutes = limit * tf_min
     days_back = int((total_minutes / 240) * 2.5) + 10 
     
     start_date_dt = datetime.now() - timedelta(days=days_back)
+
+    # === 0. 本地仓库：已存够 limit 根时，只向数据源请求最后一根所在交易日之后的数据 ===
+    store = _get_bar_store()
+    df_stored = store.load(symbol_code, tf_min, tail=limit) if store else pd.DataFrame()
+    # 1 分钟数据源只保留最近几个交易日，全量下载也拿不到更早的历史：仓库里有数据就增量获取
+    incremental = len(df_stored) >= (min(limit, _MIN_VOLUME_OVERLAP) if tf_min == 1 else limit)
+    if incremental:
+        # 从倒数第 _MIN_VOLUME_OVERLAP 根所在日期起拉取：与本地至少重叠这么多根，
+        # 单位比对才有效 (60m 一天只有 4 根)，同时修正未走完的 K 线
+        overlap_start = df_stored["date"].iloc[-min(len(df_stored), _MIN_VOLUME_OVERLAP)]
+        start_date_dt = overlap_start.to_pydatetime().replace(hour=0, minute=0, second=0)
+
     start_date_str = start_date_dt.strftime("%Y-%m-%d")
     start_date_ak_str = start_date_dt.strftime("%Y%m%d")
     
     source_msg = "AkShare Only" if tf_min == 1 else "BaoStock+AkShare"
     print(f"   🔍 获取 {symbol_code}: 周期={tf_min}m, 目标={limit}根 ({source_msg})", flush=True)
+    if incremental:
+        print(f"   📦 本地仓库已有 {len(df_stored)} 根，增量获取 {start_date_str} 起的数据", flush=True)
 
     # === A. BaoStock 历史 ===
-    df_bs = pd.DataFrame()
-    if tf_min >= 5:
-        try:
-            bs_code = _get_baostock_code(symbol_code)
-            lg = bs.login()
-            if lg.error_code == '0':
-                rs = bs.query_history_k_data_plus(
-                    bs_code, "date,time,open,high,low,close,volume",
-                    start_date=start_date_str, end_date=datetime.now().strftime("%Y-%m-%d"),
-                    frequency=str(tf_min), adjustflag="3"
-                )
-                if rs.error_code == '0':
-                    data_list = []
-                    while rs.next(): data_list.append(rs.get_row_data())
-                    df_bs = pd.DataFrame(data_list, columns=rs.fields)
-                    
-                    if not df_bs.empty:
-                        df_bs["date"] = pd.to_datetime(df_bs["time"], format="%Y%m%d%H%M%S000", errors="coerce")
-                        df_bs = df_bs.drop(columns=["time"], errors="ignore")
-                        cols = ["open", "high", "low", "close", "volume"]
-                        for c in cols: df_bs[c] = pd.to_numeric(df_bs[c], errors="coerce")
-                        df_bs = df_bs.dropna(subset=["date", "close"])
-                        df_bs = df_bs[["date", "open", "high", "low", "close", "volume"]]
-            bs.logout()
-        except Exception as e:
-            print(f"   [BaoStock] 异常: {e}", flush=True)
+    # 增量模式下 AkShare 近 20 天窗口已能覆盖缺口时，无需再请求 BaoStock
+    ak_window_start = datetime.now() - timedelta(days=20)
+    need_bs = tf_min >= 5 and (not incremental or start_date_dt < ak_window_start)
+    df_bs = _fetch_baostock(symbol_code, tf_min, start_date_str) if need_bs else pd.DataFrame()
 
     # === B. AkShare 数据 ===
-    ak_fetch_start = start_date_ak_str if tf_min == 1 else (datetime.now() - timedelta(days=20)).strftime("%Y%m%d")
-    
-    df_ak = pd.DataFrame()
-    try:
-        df_ak = ak.stock_zh_a_hist_min_em(symbol=symbol_code, period=str(tf_min), start_date=ak_fetch_start, adjust="qfq")
-        if not df_ak.empty:
-            rename_map = {
-                "时间": "date", "开盘": "open", "最高": "high", "最低": "low", 
-                "收盘": "close", "成交量": "volume"
-            }
-            df_ak = df_ak.rename(columns={k: v for k, v in rename_map.items() if k in df_ak.columns})
-            df_ak["date"] = pd.to_datetime(df_ak["date"], errors="coerce")
-            
-            cols = ["open", "high", "low", "close", "volume"]
-            for c in cols: df_ak[c] = pd.to_numeric(df_ak[c], errors="coerce")
-            
-            df_ak["open"] = df_ak["open"].replace(0, np.nan)
-            df_ak["open"] = df_ak["open"].fillna(df_ak["close"].shift(1)).fillna(df_ak["close"])
-            df_ak = df_ak.dropna(subset=["date", "close"])
-            df_ak = df_ak[["date", "open", "high", "low", "close", "volume"]]
-            
-    except Exception as e:
-        print(f"   [AkShare] 异常: {e}", flush=True)
+    if tf_min == 1 or incremental:
+        ak_fetch_start = start_date_ak_str
+    else:
+        ak_fetch_start = ak_window_start.strftime("%Y%m%d")
+    df_ak = _fetch_akshare(symbol_code, tf_min, ak_fetch_start)
 
     # === C. 合并与单位修正 ===
     if df_bs.empty and df_ak.empty:
-        return {"df": pd.DataFrame(), "period": f"{tf_min}m"}
+        if incremental:
+            print(f"   📦 数据源无返回，使用本地仓库数据", flush=True)
+            return df_stored.reset_index(drop=True)
+        return pd.DataFrame()
     
-    # 调用智能修正函数
-    df_bs, df_ak = _detect_and_fix_volume_units(df_bs, df_ak)
+    # 调用智能修正函数（增量模式没有 BaoStock 时，用本地已修正的数据做参照）
+    if df_bs.empty and incremental:
+        _, df_ak = _detect_and_fix_volume_units(df_stored, df_ak)
+    else:
+        df_bs, df_ak = _detect_and_fix_volume_units(df_bs, df_ak)
+
+    df_new = pd.concat([df_bs, df_ak], axis=0, ignore_index=True)
+    df_new = df_new[["date", "open", "high", "low", "close", "volume"]]
+    df_new = df_new.drop_duplicates(subset=['date'], keep='last')
 
-    df_final = pd.concat([df_bs, df_ak], axis=0, ignore_index=True)
-    df_final = df_final[["date", "open", "high", "low", "close", "volume"]]
+    if incremental and _adjusted_prices_changed(df_stored, df_new):
+        # 除权除息后前复权价整体改变：本地历史已过时，清空后全量重取，避免新旧价格混在一起
+        print(f"   📦 [{symbol_code}] 重叠区间复权价与本地仓库不一致，重建 {tf_min}m 仓库", flush=True)
+        store.clear(symbol_code, tf_min)
+        return _fetch_bars(symbol_code, tf_min, limit)
+
+    if store:
+        try:
+            store.upsert(symbol_code, tf_min, df_new)
+        except Exception as e:
+            print(f"   [BarStore] 写入失败: {e}", flush=True)
+
+    df_final = pd.concat([df_stored, df_new], axis=0, ignore_index=True) if incremental else df_new
     df_final = df_final.drop_duplicates(subset=['date'], keep='last')
     df_final = df_final.sort_values(by='date').reset_index(drop=True)
     
     if len(df_final) > limit:
         df_final = df_final.tail(limit).reset_index(drop=True)
 
-    return {"df": df_final, "period": f"{tf_min}m"}
+    return df_final
+
+def _derive_bars_from_1m(symbol_code: str, tf_min: int, limit: int) -> pd.DataFrame:
+    """
+    由 1 分钟 K 线在本地合成 tf_min 周期 (DERIVE_FROM_1M=1)：
+    1 分钟数据经本地仓库增量获取，只覆盖最近几个交易日，
+    更早的部分优先用本地仓库里的同周期数据补齐，仍不够时才按原生周期下载。
+    """
+    df_1m = _fetch_bars(symbol_code, 1, limit * tf_min)
+    derived = resample_a_share(df_1m, tf_min)
+    print(f"   🧮 由 {len(df_1m)} 根 1m 合成 {len(derived)} 根 {tf_min}m", flush=True)
+    if derived.empty:
+        return _fetch_bars(symbol_code, tf_min, limit)
+
+    store = _get_bar_store()
+    if store:
+        # 合成结果写回同周期仓库，使原生周期数据也保持最新
+        try: store.upsert(symbol_code, tf_min, derived)
+        except Exception as e: print(f"   [BarStore] 写入失败: {e}", flush=True)
+
+    if len(derived) >= limit:
+        return derived.tail(limit).reset_index(drop=True)
+
+    first = derived["date"].iloc[0]
+    older = store.load(symbol_code, tf_min, tail=limit) if store else pd.DataFrame()
+    older = older[older["date"] < first] if not older.empty else older
+    if len(older) + len(derived) < limit:
+        native = _fetch_bars(symbol_code, tf_min, limit)
+        older = native[native["date"] < first] if not native.empty else native
+
+    df_final = pd.concat([older, derived], axis=0, ignore_index=True)
+    df_final = df_final.sort_values(by='date').reset_index(drop=True)
+    return df_final.tail(limit).reset_index(drop=True)
 
 def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
@@ -342,22 +599,22 @@ def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
 # 2. 绘图模块
 # ==========================================
 
-def generate_local_chart(symbol: str, df: pd.DataFrame, save_path: str, period: str):
-    if df.empty: return
-    plot_df = df.copy()
-    if "date" in plot_df.columns: plot_df.set_index("date", inplace=True)
-
-    mc = mpf.make_marketcolors(up='#ff3333', down='#00b060', edge='inherit', wick='inherit', volume={'up': '#ff3333', 'down': '#00b060'}, inherit=True)
-    s = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mc, gridstyle=':', y_on_right=True)
-    apds = []
-    if 'ma50' in plot_df.columns: apds.append(mpf.make_addplot(plot_df['ma50'], color='#ff9900', width=1.5))
-    if 'ma200' in plot_df.columns: apds.append(mpf.make_addplot(plot_df['ma200'], color='#2196f3', width=2.0))
+# matplotlib 的全局状态不是线程安全的，进程内绘图需串行 (复用同一个 Figure)
+_CHART_LOCK = threading.Lock()
 
+def generate_local_chart(symbol: str, df: pd.DataFrame, save_path: str, period: str,
+                         scale: float = 1.0, colors: int = None):
+    """CHART_PROCESSES > 0 时交给进程池并行绘制，否则在本进程内复用 Figure 串行绘制"""
+    if df.empty: return
+    from chart_renderer import get_pool as get_chart_pool, render_chart
     try:
-        mpf.plot(plot_df, type='candle', style=s, addplot=apds, volume=True, 
-                 title=f"Wyckoff: {symbol} ({period} | {len(plot_df)} bars)", 
-                 savefig=dict(fname=save_path, dpi=150, bbox_inches='tight'), 
-                 warn_too_much_data=2000)
+        pool = get_chart_pool()
+        if pool:
+            pool.submit(render_chart, symbol, df, save_path, period, scale, colors).result()
+        else:
+            with _CHART_LOCK:
+                render_chart(symbol, df, save_path, period, scale, colors)
+        tracing.current().set(bytes_out=os.path.getsize(save_path))
     except Exception as e:
         print(f"   [Error] 绘图失败: {e}", flush=True)
 
@@ -368,7 +625,7 @@ def generate_local_chart(symbol: str, df: pd.DataFrame, save_path: str, period:
 
 _PROMPT_CACHE = None
 
-def get_prompt_content(symbol, df, position_info):
+def _load_prompt_template():
     global _PROMPT_CACHE
     if _PROMPT_CACHE is None:
         prompt_template = os.getenv("WYCKOFF_PROMPT_TEMPLATE")
@@ -377,21 +634,41 @@ def get_prompt_content(symbol, df, position_info):
                 with open("prompt_secret.txt", "r", encoding="utf-8") as f: prompt_template = f.read()
             except: prompt_template = None
         _PROMPT_CACHE = prompt_template
+    return _PROMPT_CACHE
 
-    if not _PROMPT_CACHE: return None
+def get_prompt_content(symbol, df, position_info, model: str = None):
+    """
+    组装最终 prompt。默认使用紧凑行情编码 (PROMPT_DATA_FORMAT=csv 可回退原始 CSV)，
+    并按模型的 token 预算丢弃最早的 K 线。
+    """
+    if not _load_prompt_template(): return None
 
-    csv_data = df.to_csv(index=False)
-    latest = df.iloc[-1]
-    
+    budget = token_budget(model)
+    prompt, used = fit_to_budget(lambda d: _build_prompt(symbol, d, position_info), df, budget)
+    if used < len(df):
+        print(f"   ✂️ [{symbol}] prompt 超出 {model or '默认'} 预算 ({budget} tokens)，保留最近 {used}/{len(df)} 根", flush=True)
+    return prompt
+
+def _data_section(symbol, df, period_str) -> tuple[str, str]:
+    """行情数据段 + 最新价 (紧凑编码或原始 CSV)"""
+    if os.getenv("PROMPT_DATA_FORMAT", "compact") == "csv":
+        return df.to_csv(index=False), str(df.iloc[-1]["close"])
+    return encode_bars(df, symbol, period_str), f"{df.iloc[-1]['close']:.{price_decimals(symbol)}f}"
+
+def _build_prompt(symbol, df, position_info):
     period_str = position_info.get('timeframe', '5') + "m"
+    csv_data, latest_price = _data_section(symbol, df, period_str)
+    latest = df.iloc[-1]
     
     base_prompt = (_PROMPT_CACHE
         .replace("{symbol}", symbol)
         .replace("{latest_time}", str(latest["date"]))
-        .replace("{latest_price}", str(latest["close"]))
+        .replace("{latest_price}", latest_price)
         .replace("{csv_data}", csv_data)
     )
+    return base_prompt + _position_text(symbol, position_info, period_str)
 
+def _position_text(symbol, position_info, period_str) -> str:
     def safe_get(key):
         val = position_info.get(key)
         return 'N/A' if val is None or str(val).lower() == 'nan' or str(val).strip() == '' else val
@@ -409,22 +686,148 @@ def get_prompt_content(symbol, df, position_info):
         f"Quantity: {qty}\n"
         f"(Note: Please analyze the current trend based on this position data and timeframe.)"
     )
-    return base_prompt + position_text
+    return position_text
+
+# ---------- 批量模式：多只股票共用一份模板，按 JSON 结构拆回单只报告 ----------
+
+_BATCH_HEADER = "[SYMBOL DATA: {symbol}]"
+_BATCH_SCHEMA = (
+    "\n\n[OUTPUT FORMAT]\n"
+    "The sections above contain {n} independent symbols: {symbols}. Apply the full instructions to each one separately.\n"
+    "Return ONLY a JSON object, no other text: "
+    '{{"reports": [{{"symbol": "<6-digit code>", "report": "<complete markdown report>"}}]}} '
+    "with exactly one entry per symbol, in the same order."
+)
+
+def _shared_template() -> str:
+    """批量公共前缀：模板中的单标的占位符改为指向下方各数据段 (也是 Gemini 上下文缓存的内容)"""
+    return (_PROMPT_CACHE
+        .replace("{symbol}", "each symbol listed below")
+        .replace("{latest_time}", "see each [SYMBOL DATA] section")
+        .replace("{latest_price}", "see each [SYMBOL DATA] section")
+        .replace("{csv_data}", "(market data for each symbol is provided in the [SYMBOL DATA] sections below)")
+    )
+
+def _symbol_block(symbol, df, position_info) -> str:
+    period_str = position_info.get('timeframe', '5') + "m"
+    csv_data, latest_price = _data_section(symbol, df, period_str)
+    return (
+        f"\n\n{_BATCH_HEADER.format(symbol=symbol)}\n"
+        f"Latest Time: {df.iloc[-1]['date']}\n"
+        f"Latest Price: {latest_price}\n"
+        f"{csv_data}"
+        + _position_text(symbol, position_info, period_str)
+    )
 
-def call_openai_official(prompt: str) -> str:
-    """第三优先级：OpenAI / DeepSeek (原版)"""
+def build_batch_prompt(items: list, budget: int) -> str:
+    """items: [(symbol, df, position_info)]；token 预算在各标的之间均分"""
+    symbols = [symbol for symbol, _, _ in items]
+    head = _shared_template()
+    tail = _BATCH_SCHEMA.format(n=len(items), symbols=", ".join(symbols))
+    per_symbol = max(1, (budget - estimate_tokens(head + tail)) // len(items))
+    blocks = []
+    for symbol, df, info in items:
+        block, used = fit_to_budget(lambda d: _symbol_block(symbol, d, info), df, per_symbol)
+        if used < len(df):
+            print(f"   ✂️ [{symbol}] 批量 prompt 预算 {per_symbol} tokens，保留最近 {used}/{len(df)} 根", flush=True)
+        blocks.append(block)
+    return head + "".join(blocks) + tail
+
+def parse_batch_response(text: str, symbols: list) -> dict:
+    """从模型输出中取出 {symbol: report}；容忍 ```json 代码块包裹，解析失败返回空字典"""
+    match = re.search(r"[\[{].*[\]}]", text or "", re.S)
+    if not match: return {}
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    items = data.get("reports", []) if isinstance(data, dict) else data
+    reports = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict): continue
+        symbol = ''.join(filter(str.isdigit, str(item.get("symbol", "")))).zfill(6)
+        report = item.get("report")
+        if symbol in symbols and isinstance(report, str) and report.strip():
+            reports[symbol] = report
+    return reports
+
+_BATCH_STATS = {"batches": 0, "symbols": 0, "split": 0}
+_BATCH_LOCK = threading.Lock()
+
+def ai_analyze_batch(items: list) -> dict:
+    """
+    一次请求分析多只股票，返回 {symbol: report}。
+    缺失 (模型漏答 / 解析失败 / 全部提供方失败) 的股票不在结果中，由调用方单独补跑。
+    """
+    if not _load_prompt_template(): return {}
+    symbols = [symbol for symbol, _, _ in items]
+    budget = min(token_budget(model_fn()) for _, _, model_fn, _ in _LLM_PROVIDERS)
+    prompt = build_batch_prompt(items, budget)
+    label = f"batch_{symbols[0]}x{len(symbols)}"
+
+    cache = _get_llm_cache()
+    keys = {name: LLMCache.make_key(prompt, model_fn(), LLM_TEMPERATURE) for _, name, model_fn, _ in _LLM_PROVIDERS}
+    hit = cache.lookup(keys.values()) if cache else None
+    if hit:
+        print(f"   💾 [{label}] 命中 LLM 缓存 ({hit.get('provider', '?')})，跳过请求", flush=True)
+        tracing.current().setdefault("provider", "cache")
+        entry, text = None, hit["text"]
+    else:
+        print(f"   🧺 批量分析 {len(symbols)} 只: {', '.join(symbols)}", flush=True)
+        try:
+            entry, text = _call_chain(label, {name: prompt for name in keys})
+            tracing.current().setdefault("provider", entry[1])
+        except Exception as e:
+            print(f"   ⚠️ [{label}] 批量请求失败，逐只补跑: {str(e)[:100]}", flush=True)
+            return {}
+
+    reports = parse_batch_response(text, symbols)
+    if cache and entry and reports:
+        cache.put(keys[entry[1]], text, provider=entry[1], model=entry[2](), symbol=label)
+    missing = [s for s in symbols if s not in reports]
+    if missing:
+        print(f"   ⚠️ [{label}] 输出缺少 {', '.join(missing)}，逐只补跑", flush=True)
+    with _BATCH_LOCK:
+        _BATCH_STATS["batches"] += 1
+        _BATCH_STATS["symbols"] += len(symbols)
+        _BATCH_STATS["split"] += len(reports)
+    return reports
+
+def batch_summary() -> str:
+    st = _BATCH_STATS
+    if not st["batches"]: return ""
+    return f"   🧺 {st['batches']} 次批量请求覆盖 {st['symbols']} 只股票，成功拆分 {st['split']} 份报告"
+
+def _openai_chat(client, model_name: str, prompt: str, stream_buffer: Optional[StreamBuffer] = None) -> str:
+    """OpenAI 兼容接口；传入 stream_buffer 时以 stream=True 逐片写入缓冲区"""
+    messages = [{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}]
+    if stream_buffer is None:
+        resp = client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=LLM_TEMPERATURE
+        )
+        if resp.usage:
+            tracing.current().set(prompt_tokens=resp.usage.prompt_tokens, completion_tokens=resp.usage.completion_tokens)
+        return resp.choices[0].message.content
+
+    stream = client.chat.completions.create(model=model_name, messages=messages, temperature=LLM_TEMPERATURE, stream=True)
+    with stream_buffer.watch(stream.close):
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                stream_buffer.feed(chunk.choices[0].delta.content)
+    return stream_buffer.text
+
+def call_openai_official(prompt: str, stream_buffer: Optional[StreamBuffer] = None) -> str:
+    """第三优先级：OpenAI / DeepSeek (原版；OPENAI_BASE_URL 由 SDK 自动读取)"""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key: raise ValueError("OPENAI_API_KEY missing")
-    model_name = os.getenv("AI_MODEL", "gpt-4o")
-    client = OpenAI(api_key=api_key)
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
-        temperature=0.2
-    )
-    return resp.choices[0].message.content
+    model_name = openai_model_name()
+    client = get_openai_client("openai", api_key)
+    tracing.current().add("wait_s", get_limiter("openai").acquire())
+    return _openai_chat(client, model_name, prompt, stream_buffer)
 
-def call_custom_api(prompt: str) -> str:
+def call_custom_api(prompt: str, stream_buffer: Optional[StreamBuffer] = None) -> str:
     """第二优先级：Qiandao Custom API"""
     # 这里的 KEY 需要在 Github Secrets 里配置，例如 CUSTOM_API_KEY
     # 如果没有配置，这里会报错，然后自动切到 OpenAI
@@ -432,248 +835,336 @@ def call_custom_api(prompt: str) -> str:
     if not api_key: 
         raise ValueError("CUSTOM_API_KEY missing, skipping custom API")
     
-    base_url = "https://api2.qiandao.mom/v1"
-    model_name = "DeepSeek-V3.2-a"
+    base_url = os.getenv("CUSTOM_API_BASE_URL", "https://api2.qiandao.mom/v1")
+    model_name = custom_model_name()
     
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_openai_client("custom", api_key, base_url)
     
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "system", "content": "You are Richard D. Wyckoff."}, {"role": "user", "content": prompt}],
-        temperature=0.2
-    )
-    return resp.choices[0].message.content
+    tracing.current().add("wait_s", get_limiter("custom").acquire())
+    return _openai_chat(client, model_name, prompt, stream_buffer)
+
+# 三级兜底顺序: (显示名, 缓存/限流名, 模型名, 调用函数)
+_LLM_PROVIDERS = [
+    ("Gemini Official", "gemini", gemini_model_name, call_gemini_http),
+    ("Custom API", "custom", custom_model_name, call_custom_api),
+    ("OpenAI", "openai", openai_model_name, call_openai_official),
+]
+
+_LLM_CACHE = None
+
+def _get_llm_cache() -> Optional[LLMCache]:
+    """LLM 结果缓存 (LLM_CACHE=0 可关闭)"""
+    global _LLM_CACHE
+    if os.getenv("LLM_CACHE", "1") == "0": return None
+    if _LLM_CACHE is None: _LLM_CACHE = LLMCache()
+    return _LLM_CACHE
+
+_BREAKERS = None
+
+def _get_breakers() -> BreakerRegistry:
+    global _BREAKERS
+    if _BREAKERS is None: _BREAKERS = BreakerRegistry()
+    return _BREAKERS
+
+def _classify_llm_error(name: str, e: Exception) -> tuple[str, Optional[float]]:
+    """失败分类 -> (熔断类型, 配额类熔断的到期时间)"""
+    if isinstance(e, GeminiQuotaExceeded):
+        return FAILURE_QUOTA, next_gemini_quota_reset()
+    if isinstance(e, GeminiFatalError):
+        return FAILURE_FATAL, None
+    openai = sys.modules.get("openai")  # 未导入 openai 时异常不可能来自它，不必为分类而导入
+    if openai and isinstance(e, openai.RateLimitError) and "insufficient_quota" in str(e):
+        return FAILURE_QUOTA, time.time() + float(os.getenv("CB_QUOTA_COOLDOWN_S", "3600"))
+    if openai and isinstance(e, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return FAILURE_FATAL, None
+    if isinstance(e, ValueError) and "missing" in str(e):
+        return FAILURE_FATAL, None
+    return FAILURE_ERROR, None
 
 def ai_analyze(symbol, df, position_info):
-    prompt = get_prompt_content(symbol, df, position_info)
-    if not prompt: return "Error: No Prompt"
+    # 各模型 token 预算可能不同，按预算分别组装 prompt (相同预算共用一份)
+    prompts, by_budget = {}, {}
+    for _, name, model_fn, _ in _LLM_PROVIDERS:
+        budget = token_budget(model_fn())
+        if budget not in by_budget:
+            by_budget[budget] = get_prompt_content(symbol, df, position_info, model=model_fn())
+        prompts[name] = by_budget[budget]
+    if not any(prompts.values()): return "Error: No Prompt"
+
+    # === Level 0: 本地缓存 (相同 prompt + 模型 + 温度 直接复用，不消耗 Token) ===
+    cache = _get_llm_cache()
+    keys = {name: LLMCache.make_key(prompts[name], model_fn(), LLM_TEMPERATURE) for _, name, model_fn, _ in _LLM_PROVIDERS}
+    if cache:
+        hit = cache.lookup(keys.values())
+        if hit:
+            print(f"   💾 [{symbol}] 命中 LLM 缓存 ({hit.get('provider', '?')})，跳过请求", flush=True)
+            tracing.current().setdefault("provider", "cache")
+            return hit["text"]
 
-    # === Level 1: Google Official Gemini ===
     try:
-        return call_gemini_http(prompt)
-    except Exception as e1:
-        print(f"   ⚠️ Gemini Official 失败: {str(e1)[:100]} -> 切 Custom API", flush=True)
-        
-        # === Level 2: Custom API (Qiandao) ===
-        try:
-            return call_custom_api(prompt)
-        except Exception as e2:
-            print(f"   ⚠️ Custom API 失败: {str(e2)[:100]} -> 切 OpenAI", flush=True)
-            
-            # === Level 3: OpenAI / DeepSeek ===
-            try:
-                return call_openai_official(prompt)
-            except Exception as e3:
-                return f"Analysis Failed. All APIs down. Error: {e3}"
-
-
-# ==========================================
-# 4. PDF 生成模块 (优化版：CSS控制CJK换行 + 清晰段落间距)
-# ==========================================
+        entry, text = _call_chain(symbol, prompts)
+    except Exception as e:
+        return f"Analysis Failed. All APIs down. Error: {e}"
+    tracing.current().setdefault("provider", entry[1])
+    if cache:
+        cache.put(keys[entry[1]], text, provider=entry[1], model=entry[2](), symbol=symbol)
+    return text
 
-def insert_soft_breaks(text: str) -> str:
+def _call_chain(symbol: str, prompts: dict):
     """
-    轻量化断行预处理：
-    仅处理 URL、路径、长串数字等容易造成溢出的非中文内容。
-    中文换行完全交给 xhtml2pdf 的 CSS (-pdf-word-wrap: CJK) 处理。
+    Level 1~3 兜底链 (默认 Gemini -> Custom API -> OpenAI，按历史成功率/延迟排序；已熔断的直接跳过)。
+    返回 (胜出的提供方, 文本)；全部失败时抛出最后一个异常。
     """
-    if not text:
-        return ""
-
-    zwsp = chr(0x200B)
-
-    # 1) 统一换行符，防止不同平台的 \r\n 干扰 Markdown 解析
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-
-    # 2) 常见分隔符后插入 ZWSP (帮助 URL/路径/代码 换行)
-    #    只在 [/ _ - . = : ? & # %] 后面加，不碰普通内容
-    text = re.sub(r'([\/\_\-\.\=\:\?\&\#\%])', r'\1' + zwsp, text)
+    chain = _ranked_providers()
+    hedge = os.getenv("LLM_HEDGE", "0") == "1"
+    breakers = _get_breakers()
+    tried = set()
+    last_err = None
+    for i, entry in enumerate(chain):
+        label, name, model_fn, _ = entry
+        if name in tried: continue
+        breaker = breakers.get(name)
+        if not breaker.allow():
+            print(f"   ⏭️ {label} 已熔断 [{breaker.describe()}]，跳过", flush=True)
+            last_err = last_err or Exception(f"{label} circuit open: {breaker.reason}")
+            continue
+
+        # 对冲候选：链中下一个未熔断的提供方
+        backup = None
+        if hedge:
+            backup = next((e for e in chain[i + 1:] if e[1] not in tried and breakers.get(e[1]).state == CLOSED), None)
+        try:
+            if backup:
+                entry, text = _call_hedged(entry, backup, prompts, tried, symbol)
+            else:
+                tried.add(name)
+                text = _invoke_provider(entry, prompts[name], _new_stream_buffer(symbol, name), symbol)
+        except Exception as e:
+            last_err = e
+            remaining = [e2[0] for e2 in chain[i + 1:] if e2[1] not in tried]
+            if remaining:
+                tracing.current().add("fallbacks")
+                print(f"   ⚠️ {label} 失败: {str(e)[:100]} -> 切 {remaining[0]}", flush=True)
+            continue
+        return entry, text
+
+    raise last_err or Exception("no LLM provider available")
+
+def _new_stream_buffer(symbol: str, name: str) -> Optional[StreamBuffer]:
+    """LLM_STREAM=1 时为每次调用创建流式缓冲区"""
+    if os.getenv("LLM_STREAM", "0") != "1": return None
+    return StreamBuffer(label=f"{symbol}_{name}")
+
+def _invoke_provider(entry, prompt: str, buffer: Optional[StreamBuffer] = None, symbol: str = None) -> str:
+    """调用单个提供方 (llm.{name} span)，并记录延迟/成功率、首 token 时间、token 用量与熔断状态"""
+    label, name, model_fn, call = entry
+    with tracing.span(f"llm.{name}", symbol, provider=name, model=model_fn(), bytes_out=len(prompt.encode("utf-8"))) as sp:
+        text = _invoke_provider_call(entry, prompt, buffer)
+        sp.set(bytes_in=len(text.encode("utf-8")))
+        # 接口未返回用量 (流式 / 中转服务) 时按字符数估算
+        if sp.setdefault("prompt_tokens", None) is None:
+            sp.set(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text), tokens_estimated=True)
+    return text
 
-    # 3) 超长连续英文数字串：每 30 字符强制打断
-    def _break_long_token(m: re.Match) -> str:
-        s = m.group(0)
-        step = 30
-        return zwsp.join(s[i:i + step] for i in range(0, len(s), step))
+def _invoke_provider_call(entry, prompt: str, buffer: Optional[StreamBuffer] = None) -> str:
+    label, name, model_fn, call = entry
+    breakers = _get_breakers()
+    t0 = time.perf_counter()
+    try:
+        text = call(prompt, stream_buffer=buffer) if buffer is not None else call(prompt)
+    except Exception as e:
+        _get_provider_stats().record(name, time.perf_counter() - t0, False)
+        if buffer is not None and buffer.cancelled:
+            # 对冲落败被主动取消，不计成败；但要归还半开探测名额，否则熔断器一直卡在半开
+            breakers.get(name).release_probe()
+            raise
+        kind, until = _classify_llm_error(name, e)
+        breakers.get(name).record_failure(kind, str(e), until)
+        if kind == FAILURE_QUOTA: breakers.save()
+        raise
+    finally:
+        if buffer is not None: buffer.close()
+    _get_provider_stats().record(name, time.perf_counter() - t0, True)
+    breakers.get(name).record_success()
+    if buffer is not None and buffer.ttft_s is not None:
+        _get_provider_stats().record_ttft(name, buffer.ttft_s)
+        print(f"   ⚡ {label} 首 token {buffer.ttft_s:.1f}s, 共 {buffer.chunks} 片, 总耗时 {time.perf_counter() - t0:.1f}s", flush=True)
+    return text
 
-    text = re.sub(r'[A-Za-z0-9]{50,}', _break_long_token, text)
+def _call_hedged(primary, backup, prompts: dict, tried: set, symbol: str = ""):
+    """
+    对冲请求：主提供方超过其历史 p90 延迟仍未返回时，向备份提供方再发一份请求，
+    先成功返回者胜出。流式模式下落败的请求会被立即断开；
+    非流式的阻塞 HTTP 调用无法强行中断，其结果直接丢弃。
+    返回 (胜出的提供方, 文本)；全部失败时抛出最后一个异常。
+    """
+    pool = _get_hedge_pool()
+    delay = _get_provider_stats().percentile(primary[1], 90)
+    if delay is None:
+        delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "30"))
+
+    tried.add(primary[1])
+    buffers = {primary[1]: _new_stream_buffer(symbol, primary[1])}
+    futures = {pool.submit(_invoke_provider, primary, prompts[primary[1]], buffers[primary[1]], symbol): primary}
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        print(f"   🏁 {primary[0]} 超过 p90 ({delay:.1f}s) 未返回，对冲请求 {backup[0]}", flush=True)
+        tried.add(backup[1])
+        buffers[backup[1]] = _new_stream_buffer(symbol, backup[1])
+        futures[pool.submit(_invoke_provider, backup, prompts[backup[1]], buffers[backup[1]], symbol)] = backup
+
+    last_err = None
+    for fut in as_completed(futures):
+        try:
+            text = fut.result()
+        except Exception as e:
+            last_err = e
+            continue
+        for other, entry in futures.items():
+            if other is fut: continue
+            if not other.cancel() and buffers.get(entry[1]) is not None:
+                buffers[entry[1]].cancel()
+        return futures[fut], text
+    raise last_err
+
+_PROVIDER_STATS = None
+_HEDGE_POOL = None
+
+def _get_provider_stats() -> ProviderStats:
+    global _PROVIDER_STATS
+    if _PROVIDER_STATS is None: _PROVIDER_STATS = ProviderStats()
+    return _PROVIDER_STATS
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _HEDGE_POOL
+    if _HEDGE_POOL is None:
+        _HEDGE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_POOL_SIZE", "8")), thread_name_prefix="hedge")
+    return _HEDGE_POOL
+
+def _ranked_providers() -> list:
+    """按滚动窗口内的成功率与延迟给兜底链排序 (LLM_PROVIDER_RANKING=0 保持固定顺序)"""
+    if os.getenv("LLM_PROVIDER_RANKING", "1") == "0": return list(_LLM_PROVIDERS)
+    by_name = {entry[1]: entry for entry in _LLM_PROVIDERS}
+    return [by_name[n] for n in _get_provider_stats().rank(list(by_name))]
 
-    return text
 
+# ==========================================
+# 4. PDF 生成模块 (优化版：CSS控制CJK换行 + 清晰段落间距)
+# ==========================================
 
 def generate_pdf_report(symbol: str, chart_path: str, report_text: str, pdf_path: str) -> bool:
-    # 1. 简单预处理
-    formatted_text = insert_soft_breaks(report_text)
-
-    # 2. Markdown -> HTML
-    #    使用 extra 支持更多语法，nl2br 处理换行
-    html_content = markdown.markdown(
-        formatted_text,
-        extensions=["extra", "sane_lists", "nl2br"]
-    )
-
-    abs_chart_path = os.path.abspath(chart_path)
-
-    # 字体路径检测
-    font_path = "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc"
-    if not os.path.exists(font_path):
-        font_path = "msyh.ttc"
-
-    full_html = f"""
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <style>
-            @font-face {{
-                font-family: "MyChineseFont";
-                src: url("{font_path}");
-            }}
-
-            @page {{
-                size: A4;
-                margin-top: 1.5cm;
-                margin-bottom: 1.5cm;
-                margin-left: 2cm;
-                margin-right: 2cm;
-
-                @frame footer_frame {{
-                    -pdf-frame-content: footerContent;
-                    bottom: 0cm;
-                    margin-left: 1cm;
-                    margin-right: 1cm;
-                    height: 1cm;
-                }}
-            }}
-
-            body {{
-                font-family: "MyChineseFont", sans-serif;
-                font-size: 11px;
-                line-height: 1.6;  /* 关键：增加行高，提升阅读舒适度 */
-                color: #2c3e50;
-                text-align: justify;
-
-                /* 关键：启用 xhtml2pdf 的中文自动换行引擎 */
-                -pdf-word-wrap: CJK;
-            }}
-
-            /* 关键：显式设置段落间距，防止文字粘连 */
-            p {{
-                margin-top: 0px;
-                margin-bottom: 10px;
-                text-indent: 0;
-            }}
-
-            /* 列表优化 */
-            ul, ol {{
-                margin-top: 5px;
-                margin-bottom: 10px;
-                padding-left: 20px;
-            }}
-            li {{
-                margin-bottom: 5px;
-                line-height: 1.5;
-            }}
-
-            /* 标题样式 */
-            h1 {{ 
-                font-size: 16px; 
-                margin-top: 20px; 
-                margin-bottom: 10px; 
-                color: #e74c3c; 
-                border-bottom: 1px solid #eee; 
-                padding-bottom: 5px; 
-            }}
-            h2 {{ 
-                font-size: 14px; 
-                margin-top: 15px; 
-                margin-bottom: 8px; 
-                color: #2980b9; 
-                border-left: 4px solid #2980b9; 
-                padding-left: 8px; 
-            }}
-            h3 {{ 
-                font-size: 12px; 
-                margin-top: 10px; 
-                margin-bottom: 6px; 
-                font-weight: bold; 
-                background-color: #f2f2f2; 
-                padding: 4px; 
-            }}
-
-            /* 图片样式 */
-            img {{
-                zoom: 55%;
-                margin: 15px auto;
-                display: block;
-                border: 1px solid #ddd;
-                padding: 4px;
-            }}
-
-            /* 页眉样式 */
-            .header {{
-                text-align: center;
-                margin-bottom: 20px;
-                color: #95a5a6;
-                font-size: 10px;
-                border-bottom: 1px solid #eee;
-                padding-bottom: 8px;
-            }}
-
-            /* 引用块样式 */
-            blockquote {{
-                background: #f9f9f9;
-                border-left: 4px solid #ccc;
-                margin: 10px 0;
-                padding: 8px 12px;
-                color: #666;
-                font-size: 10px;
-            }}
-
-            /* 代码块样式 */
-            pre, code {{
-                background-color: #f4f4f4;
-                font-family: Helvetica, sans-serif;
-                font-size: 10px;
-                white-space: pre-wrap;
-                -pdf-word-wrap: CJK; /* 确保代码块里的中文也能换行 */
-                word-wrap: break-word;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">Wyckoff Quantitative Analysis Report | {symbol}</div>
-
-        <div style="text-align: center;">
-            <img src="{abs_chart_path}" />
-        </div>
-
-        <hr style="border: 0; border-top: 1px solid #eee; margin: 15px 0;"/>
-
-        <div style="width: 100%;">
-            {html_content}
-        </div>
-
-        <div id="footerContent" style="text-align:center; font-size: 9px; color: gray;">
-            Page <pdf:pagenumber>
-        </div>
-    </body>
-    </html>
     """
-
+    HTML 外壳与 CSS 预先组装、中文字体每个进程只注册一次 (子集嵌入)。
+    PDF_PROCESSES > 0 时交给进程池并行生成。
+    """
+    from pdf_renderer import get_pool as get_pdf_pool, render_pdf
     try:
-        with open(pdf_path, "wb") as pdf_file:
-            pisa.CreatePDF(full_html, dest=pdf_file)
-        return True
+        pool = get_pdf_pool()
+        if pool:
+            ms, size = pool.submit(render_pdf, symbol, chart_path, report_text, pdf_path).result()
+        else:
+            ms, size = render_pdf(symbol, chart_path, report_text, pdf_path)
     except Exception as e:
         print(f"   ❌ PDF 生成失败: {e}", flush=True)
         return False
+    print(f"   📄 [{symbol}] PDF {ms:.0f}ms, {size / 1024:.0f} KB", flush=True)
+    tracing.current().set(bytes_out=size)
+    return True
         
 # ==========================================
-# 5. 主程序 (串行 + 30s 休息)
+# 5. 主程序 (分阶段流水线 + 令牌桶限流)
 # ==========================================
 
-def process_one_stock(symbol: str, position_info: dict):
-    if position_info is None: position_info = {}
-    clean_digits = ''.join(filter(str.isdigit, str(symbol)))
+_RUN_JOURNAL = None
+_PUSH_LIST_LOCK = threading.Lock()
+
+def _get_run_journal() -> Optional[RunJournal]:
+    """运行日志 (RUN_JOURNAL=0 可关闭)：被取消 / 中断的运行重启后跳过已完成的阶段"""
+    global _RUN_JOURNAL
+    if os.getenv("RUN_JOURNAL", "1") == "0": return None
+    if _RUN_JOURNAL is None: _RUN_JOURNAL = RunJournal()
+    return _RUN_JOURNAL
+
+def _journal(job: dict, stage: str, **artifacts):
+    journal = _get_run_journal()
+    if journal: journal.record(job["symbol"], job["journal_key"], stage, **artifacts)
+
+def _resumed(job: dict, stage: str, path_key: str = None) -> Optional[dict]:
+    """上次运行已完成该阶段 (且产物文件仍在) 时返回其产物"""
+    artifacts = job.get("resumed", {}).get(stage)
+    if artifacts is None or (path_key and not os.path.exists(artifacts.get(path_key, ""))): return None
+    _get_run_journal().count_reused()
+    tracing.current().set(resumed=True)
+    return artifacts
+
+_LAST_REPORTS = None
+_UNCHANGED: dict[str, int] = {"precheck": 0, "fetch": 0}
+_REUSED_PDFS: dict[int, str] = {}  # {任务序号: 沿用的上一份报告}
+_UNCHANGED_LOCK = threading.Lock()
+
+def _get_last_reports() -> LastReports:
+    global _LAST_REPORTS
+    if _LAST_REPORTS is None: _LAST_REPORTS = LastReports()
+    return _LAST_REPORTS
+
+def _change_detection() -> str:
+    """CHANGE_DETECTION: skip (默认，没有新 K 线的股票不出报告) | reuse (同时把上一份报告再推送一次) | off"""
+    mode = os.getenv("CHANGE_DETECTION", "skip").lower()
+    return mode if mode in ("skip", "reuse", "off") else "skip"
+
+def _job_key(info: dict) -> str:
+    return f"{info.get('timeframe', '5')}m x {info.get('bars', '500')}"
+
+def _analysis_failed(text: str) -> bool:
+    return text.startswith(("Analysis Failed", "Error:"))
+
+def _beijing_now() -> pd.Timestamp:
+    return pd.Timestamp(datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None))
+
+def _completed_last_bar(df: pd.DataFrame, period: str, now: pd.Timestamp) -> str:
+    """
+    数据中最后一根已走完的 K 线：AkShare 会返回仍在形成中的当前 K 线，
+    以它为准会把"基于半根 K 线的报告"记成已覆盖该 K 线，收盘后重跑反被当作无变化跳过。
+    """
+    return str(min(pd.Timestamp(df["date"].iloc[-1]), latest_bar_end(now, int(period.rstrip("m")))))
+
+def _mark_unchanged(index: int, symbol: str, last: dict, where: str):
+    with _UNCHANGED_LOCK:
+        _UNCHANGED[where] += 1
+        if index is not None and _change_detection() == "reuse" and os.path.exists(last["pdf"]):
+            _REUSED_PDFS[index] = last["pdf"]
+    tracing.current().set(unchanged=where)
+
+def _precheck_unchanged(items: list) -> list:
+    """
+    流水线之前的预检，不发任何请求：按交易时段推算各周期此刻最新一根已走完的 K 线，
+    上一份报告已包含它 (收盘后 / 周末 / 同一时段重复运行) 的股票不进入流水线。
+    items: [(序号, 代码, 配置)]，返回仍需处理的部分。
+    """
+    if _change_detection() == "off": return items
+    now = _beijing_now()
+    kept = []
+    for index, symbol, info in items:
+        clean_symbol = ''.join(filter(str.isdigit, str(symbol))).zfill(6)
+        last = _get_last_reports().get(clean_symbol, _job_key(info))
+        if last and pd.Timestamp(last["last_bar"]) >= latest_bar_end(now, int(last["period"].rstrip("m"))):
+            print(f"   ⏭️ [{clean_symbol}] 上次报告已含最新 K 线 ({last['last_bar']})，跳过", flush=True)
+            _mark_unchanged(index, clean_symbol, last, "precheck")
+            continue
+        kept.append((index, symbol, info))
+    return kept
+
+def _append_push_list(pdf_path: str):
+    """每生成一份报告就追加到推送清单，运行中途被取消时已完成的报告不会丢失"""
+    with _PUSH_LIST_LOCK:
+        with open("push_list.txt", "a", encoding="utf-8") as f:
+            f.write(f"{pdf_path}\n")
+
+@tracing.traced("stage.fetch")
+def stage_fetch(job: dict) -> Optional[dict]:
+    """阶段 1: 拉取数据 + 指标 + CSV 快照"""
+    position_info = job.get("info") or {}
+    clean_digits = ''.join(filter(str.isdigit, str(job["symbol"])))
     clean_symbol = clean_digits.zfill(6)
 
     tf_str = position_info.get("timeframe", "5")
@@ -681,41 +1172,182 @@ def process_one_stock(symbol: str, position_info: dict):
 
     print(f"🚀 [{clean_symbol}] 开始分析 (TF:{tf_str}m, Bars:{bars_str})...", flush=True)
 
-    data_res = fetch_stock_data_dynamic(clean_symbol, tf_str, bars_str)
-    
-    df = data_res["df"]
-    period = data_res["period"]
-
-    if df.empty:
-        print(f"   ⚠️ [{clean_symbol}] 数据为空，跳过", flush=True)
+    journal = _get_run_journal()
+    job.update({"symbol": clean_symbol, "journal_key": _job_key(position_info)})
+    job["resumed"] = journal.completed(clean_symbol, job["journal_key"]) if journal else {}
+
+    fetched = _resumed(job, "fetched", "csv")
+    if fetched:
+        # 续跑：沿用上次运行保存的快照 (已含指标) 与产物路径，不重新取数
+        print(f"   ♻️ [{clean_symbol}] 续跑，已完成: {', '.join(job['resumed'])}", flush=True)
+        df = pd.read_csv(fetched["csv"], encoding="utf-8-sig", parse_dates=["date"])
+        period, chart_path, pdf_path = fetched["period"], fetched["chart_path"], fetched["pdf_path"]
+        last_bar = fetched.get("last_bar") or str(df["date"].iloc[-1])
+        tracing.current().set(rows=len(df))
+    else:
+        data_res = fetch_stock_data_dynamic(clean_symbol, tf_str, bars_str)
+
+        df = data_res["df"]
+        period = data_res["period"]
+
+        tracing.current().set(rows=len(df))
+        if df.empty:
+            print(f"   ⚠️ [{clean_symbol}] 数据为空，跳过", flush=True)
+            return None
+
+        # 预检按交易日历推算，遇节假日 / 停牌会放行；取数后再比对一次最后一根已走完的 K 线
+        last_bar = _completed_last_bar(df, period, _beijing_now())
+        last = _get_last_reports().get(clean_symbol, job["journal_key"]) if _change_detection() != "off" else None
+        if last and pd.Timestamp(last_bar) <= pd.Timestamp(last["last_bar"]):
+            print(f"   ⏭️ [{clean_symbol}] 没有新 K 线 (最后一根 {last['last_bar']})，跳过", flush=True)
+            _mark_unchanged(job.get("index"), clean_symbol, last, "fetch")
+            tracing.current().set(skipped="unchanged")
+            return None
+
+        df = add_indicators(df)
+        from chart_renderer import chart_extension
+
+        beijing_tz = timezone(timedelta(hours=8))
+        ts = datetime.now(beijing_tz).strftime("%Y%m%d_%H%M%S")
+
+        csv_path = f"data/{clean_symbol}_{period}_{ts}.csv"
+        df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+        chart_path = f"reports/{clean_symbol}_chart_{ts}.{chart_extension()}"
+        pdf_path = f"reports/{clean_symbol}_report_{period}_{ts}.pdf"
+        _journal(job, "fetched", csv=csv_path, period=period, chart_path=chart_path, pdf_path=pdf_path, last_bar=last_bar)
+
+    # 可选降采样：绘图与 prompt 的成本与请求的历史长度脱钩 (快照仍保存全量数据)
+    df, ds_stats = downsample_bars(df)
+    if ds_stats["bars_out"] < ds_stats["bars_in"]:
+        ratio = 1 - ds_stats["bars_out"] / ds_stats["bars_in"]
+        print(f"   📉 [{clean_symbol}] 降采样({ds_stats['mode']}): {ds_stats['bars_in']} -> {ds_stats['bars_out']} 根 "
+              f"(-{ratio:.0%}, 保留关键K线 {ds_stats['anchors']} 根)", flush=True)
+
+    job.update({
+        "info": position_info, "df": df, "period": period, "downsample": ds_stats, "last_bar": last_bar,
+        "chart_path": chart_path, "pdf_path": pdf_path,
+    })
+    return job
+
+@tracing.traced("stage.chart")
+def stage_chart(job: dict) -> dict:
+    """阶段 2: 本地绘图 (CPU)"""
+    if _resumed(job, "charted", "chart"): return job
+    generate_local_chart(job["symbol"], job["df"], job["chart_path"], job["period"])
+    _journal(job, "charted", chart=job["chart_path"])
+    return job
+
+def _resume_report(job: dict) -> bool:
+    analysed = _resumed(job, "analysed")
+    if analysed: job["report_text"] = analysed["report"]
+    return bool(analysed)
+
+def _journal_report(job: dict):
+    # 全部提供方失败的占位文本不记入日志，续跑时重新请求
+    if not _analysis_failed(job["report_text"]):
+        _journal(job, "analysed", report=job["report_text"])
+
+@tracing.traced("stage.analyze")
+def stage_analyze(job: dict) -> dict:
+    """阶段 3: LLM 分析 (网络)"""
+    if _resume_report(job): return job
+    job["report_text"] = ai_analyze(job["symbol"], job["df"], job["info"])
+    _journal_report(job)
+    return job
+
+@tracing.traced("stage.pdf")
+def stage_pdf(job: dict) -> Optional[dict]:
+    """阶段 4: 生成 PDF (CPU)"""
+    if _resumed(job, "pdf", "pdf"):
+        print(f"♻️ [{job['symbol']}] 沿用上次运行生成的报告", flush=True)
+    elif generate_pdf_report(job["symbol"], job["chart_path"], job["report_text"], job["pdf_path"]):
+        _enforce_report_size(job)
+        _journal(job, "pdf", pdf=job["pdf_path"])
+        print(f"✅ [{job['symbol']}] 报告生成完毕", flush=True)
+    else:
         return None
+    if not _analysis_failed(job["report_text"]):
+        _get_last_reports().record(job["symbol"], job["journal_key"], job["last_bar"], job["period"], job["pdf_path"])
+    _append_push_list(job["pdf_path"])
+    return job
+
+# 超出体积上限时依次尝试的 (图表分辨率倍数, 调色板颜色数)
+_SHRINK_STEPS = [(0.75, 64), (0.5, 32)]
+
+def _enforce_report_size(job: dict):
+    """REPORT_MAX_BYTES > 0 时，PDF 超限则降低图表分辨率 / 颜色数后重新生成"""
+    cap = int(os.getenv("REPORT_MAX_BYTES", "0"))
+    if cap <= 0: return
+    from chart_renderer import chart_format
+    symbol = job["symbol"]
+    for scale, colors in _SHRINK_STEPS:
+        size = os.path.getsize(job["pdf_path"])
+        if size <= cap: return
+        if chart_format() == "svg": break
+        print(f"   🗜️ [{symbol}] PDF {size / 1024:.0f} KB 超过上限 {cap / 1024:.0f} KB，图表降至 x{scale} / {colors} 色重新生成", flush=True)
+        generate_local_chart(symbol, job["df"], job["chart_path"], job["period"], scale=scale, colors=colors)
+        if not generate_pdf_report(symbol, job["chart_path"], job["report_text"], job["pdf_path"]): return
+    size = os.path.getsize(job["pdf_path"])
+    if size > cap:
+        print(f"   ⚠️ [{symbol}] PDF 仍为 {size / 1024:.0f} KB，超过上限 {cap / 1024:.0f} KB", flush=True)
+
+@tracing.traced("stage.analyze_batch")
+def stage_analyze_batch(jobs: list) -> list:
+    """阶段 3 (批量模式): 一次请求分析一批股票，缺失的逐只补跑"""
+    pending = [job for job in jobs if not _resume_report(job)]
+    if len(pending) == 1: stage_analyze(pending[0])
+    if len(pending) <= 1: return jobs
+    reports = ai_analyze_batch([(job["symbol"], job["df"], job["info"]) for job in pending])
+    for job in pending:
+        job["report_text"] = reports.get(job["symbol"]) or ai_analyze(job["symbol"], job["df"], job["info"])
+        _journal_report(job)
+    return jobs
+
+PIPELINE_STAGES = [stage_fetch, stage_chart, stage_analyze, stage_pdf]
 
-    df = add_indicators(df)
-
-    beijing_tz = timezone(timedelta(hours=8))
-    ts = datetime.now(beijing_tz).strftime("%Y%m%d_%H%M%S")
-
-    csv_path = f"data/{clean_symbol}_{period}_{ts}.csv"
-    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-
-    chart_path = f"reports/{clean_symbol}_chart_{ts}.png"
-    pdf_path = f"reports/{clean_symbol}_report_{period}_{ts}.pdf"
-
-    generate_local_chart(clean_symbol, df, chart_path, period)
-    report_text = ai_analyze(clean_symbol, df, position_info)
+def process_one_stock(symbol: str, position_info: dict):
+    """单只股票顺序执行全部阶段"""
+    job = {"symbol": symbol, "info": position_info or {}}
+    for stage_func in PIPELINE_STAGES:
+        job = stage_func(job)
+        if job is None: return None
+    return job["pdf_path"]
+
+def build_pipeline() -> StagedPipeline:
+    """
+    每个阶段独立线程池 + 有界队列：
+    网络型阶段 (fetch / llm) 多线程，CPU 型阶段 (chart / pdf) 默认单线程。
+    LLM_BATCH_SIZE > 1 时 llm 阶段按批请求，每批最多等待 LLM_BATCH_WAIT_S 秒凑满。
+    """
+    # 在主线程中先导入绘图 / PDF 模块，避免各阶段工作线程首次使用时同时触发导入
+    from chart_renderer import chart_processes, get_pool as get_chart_pool
+    from pdf_renderer import pdf_processes, get_pool as get_pdf_pool
+    get_chart_pool()  # 进程池也在任何阶段线程启动之前创建
+    get_pdf_pool()
+    queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+    llm_workers = os.getenv("LLM_WORKERS") or os.getenv("MAX_WORKERS", "4")
+    batch_size = int(os.getenv("LLM_BATCH_SIZE", "1"))
+    stages = [
+        Stage("fetch", stage_fetch, workers=int(os.getenv("FETCH_WORKERS", "2")), queue_size=queue_size),
+        Stage("chart", stage_chart, workers=int(os.getenv("CHART_WORKERS") or max(1, chart_processes())), queue_size=queue_size),
+        Stage("llm", stage_analyze_batch if batch_size > 1 else stage_analyze, workers=int(llm_workers),
+              queue_size=max(queue_size, batch_size), batch_size=batch_size,
+              batch_wait_s=float(os.getenv("LLM_BATCH_WAIT_S", "5"))),
+        Stage("pdf", stage_pdf, workers=int(os.getenv("PDF_WORKERS") or max(1, pdf_processes())), queue_size=queue_size),
+    ]
 
-    if generate_pdf_report(clean_symbol, chart_path, report_text, pdf_path):
-        print(f"✅ [{clean_symbol}] 报告生成完毕", flush=True)
-        return pdf_path
+    def on_error(stage, job, e):
+        print(f"❌ [{job.get('symbol')}] {stage.name} 阶段异常: {e}", flush=True)
 
-    return None
+    return StagedPipeline(stages, on_error=on_error)
 
-def main():
+def main(dry_run: bool = False):
     os.makedirs("data", exist_ok=True)
     os.makedirs("reports", exist_ok=True)
 
     print("☁️ 正在连接 Google Sheets...", flush=True)
     try:
+        from sheet_manager import SheetManager
         sm = SheetManager()
         stocks_dict = sm.get_all_stocks()
         print(f"📋 获取 {len(stocks_dict)} 个任务", flush=True)
@@ -723,23 +1355,79 @@ def main():
         print(f"❌ Sheet 连接失败: {e}", flush=True)
         return
 
-    generated_pdfs = []
     items = list(stocks_dict.items())
+    if dry_run:
+        # 试运行：只列出任务，不取数、不调用 LLM、不加载绘图 / PDF 依赖
+        for symbol, info in items:
+            print(f"   🔎 {symbol}: {info.get('timeframe', '5')}m x {info.get('bars', '500')} 根", flush=True)
+        print("🧪 试运行结束 (--dry-run)", flush=True)
+        return
 
-    for i, (symbol, info) in enumerate(items):
+    journal = _get_run_journal()
+    if journal and journal.resumed_from:
+        print(f"♻️ 上次运行 {journal.resumed_from} 未完成，从运行日志续跑", flush=True)
+    # 推送清单随每份报告追加，先清空上次运行留下的
+    open("push_list.txt", "w", encoding="utf-8").close()
+
+    # 先做变化预检：全部没有新 K 线时不必构建流水线，也就不导入绘图 / PDF 模块
+    pending = _precheck_unchanged([(i, symbol, info) for i, (symbol, info) in enumerate(items)])
+    for pdf in _REUSED_PDFS.values(): _append_push_list(pdf)
+
+    pipeline, done = None, []
+    if pending:
+        pipeline = build_pipeline()
+        print("🧵 流水线: " + " -> ".join(f"{st.name}x{st.workers}" for st in pipeline.stages) + " (各数据源/模型按令牌桶限流)", flush=True)
+        jobs = ({"index": i, "symbol": symbol, "info": info} for i, symbol, info in pending)
+        done = pipeline.run(jobs)
+
+    # 按表格顺序输出，保证推送顺序稳定 (含无新 K 线时沿用的上一份报告)
+    ordered = {job["index"]: job["pdf_path"] for job in done}
+    ordered.update(_REUSED_PDFS)
+    generated_pdfs = [ordered[i] for i in sorted(ordered)]
+
+    if pipeline:
+        print(f"\n📊 流水线统计:\n{pipeline.report()}", flush=True)
+    summary = limiter_summary()
+    if summary:
+        print(f"\n📈 限流统计:\n{summary}", flush=True)
+    if _get_llm_cache():
+        print(_get_llm_cache().summary(), flush=True)
+    if batch_summary():
+        print(batch_summary(), flush=True)
+    http_summary = reuse_summary()
+    if http_summary:
+        print(f"\n🔗 连接复用:\n{http_summary}", flush=True)
+    stats_summary = _get_provider_stats().summary()
+    if stats_summary:
+        print(f"\n📶 提供方延迟:\n{stats_summary}", flush=True)
+    _get_provider_stats().save()
+    breaker_summary = _get_breakers().summary()
+    if breaker_summary:
+        print(f"\n🔌 熔断状态:\n{breaker_summary}", flush=True)
+    _get_breakers().save()
+    _get_last_reports().save()
+
+    skipped = sum(_UNCHANGED.values())
+    if skipped:
+        reused = f"，沿用上一份报告 {len(_REUSED_PDFS)} 份" if _REUSED_PDFS else ""
+        print(f"\n⏭️ 无新 K 线跳过 {skipped}/{len(items)} 只 (预检 {_UNCHANGED['precheck']}, 取数后 {_UNCHANGED['fetch']}){reused}", flush=True)
+
+    tracer = tracing.get_tracer()
+    if tracer and tracer.table():
+        print(f"\n⏱️ 阶段耗时 (run {tracer.run_id}):\n{tracer.table()}", flush=True)
         try:
-            pdf_path = process_one_stock(symbol, info)
-            if pdf_path:
-                generated_pdfs.append(pdf_path)
-        except Exception as e:
-            print(f"❌ [{symbol}] 处理发生异常: {e}", flush=True)
+            tracer.write_jsonl()
+            tracer.write_prometheus()
+            print(f"   -> {tracer.jsonl_path}, {tracer.prom_path}", flush=True)
+        except OSError as e:
+            print(f"   ⚠️ 写入追踪结果失败: {e}", flush=True)
 
-        # ⚠️ 强制冷却 30 秒
-        if i < len(items) - 1:
-            print("⏳ 强制冷却 30秒...", flush=True)
-            time.sleep(30)
+    if journal:
+        if journal.summary(): print(journal.summary(), flush=True)
+        journal.finish()
 
     if generated_pdfs:
+        # 运行中按完成顺序追加；正常结束时按表格顺序重写，保证推送顺序稳定
         print(f"\n📝 生成推送清单 ({len(generated_pdfs)}):", flush=True)
         with open("push_list.txt", "w", encoding="utf-8") as f:
             for pdf in generated_pdfs:
@@ -749,13 +1437,7 @@ def main():
         print("\n⚠️ 无报告生成", flush=True)
 
 if __name__ == "__main__":
-    main()
-
-
-
-
-
-
-
-
-
+    import argparse
+    parser = argparse.ArgumentParser(description="威科夫 AI 报告")
+    parser.add_argument("--dry-run", action="store_true", help="只读取表格并列出任务，不取数、不调用 LLM")
+    main(parser.parse_args().dry_run)
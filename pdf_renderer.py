@@ -0,0 +1,274 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+from typing import Optional
+
+import markdown
+from reportlab.lib.fonts import addMapping
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from xhtml2pdf import default as pisa_default
+from xhtml2pdf import pisa
+
+FONT_NAME = "MyChineseFont"
+
+# 静态 CSS 与 HTML 外壳只组装一次 (文本)；字体不再通过 @font-face 引用 (见 register_font)。
+# xhtml2pdf 的样式表绑定在单个文档的上下文上，CSS 本身仍随每份文档解析一次。
+_CSS = """
+    @page {
+        size: A4;
+        margin-top: 1.5cm;
+        margin-bottom: 1.5cm;
+        margin-left: 2cm;
+        margin-right: 2cm;
+
+        @frame footer_frame {
+            -pdf-frame-content: footerContent;
+            bottom: 0cm;
+            margin-left: 1cm;
+            margin-right: 1cm;
+            height: 1cm;
+        }
+    }
+
+    body {
+        font-family: "MyChineseFont", sans-serif;
+        font-size: 11px;
+        line-height: 1.6;  /* 关键：增加行高，提升阅读舒适度 */
+        color: #2c3e50;
+        text-align: justify;
+
+        /* 关键：启用 xhtml2pdf 的中文自动换行引擎 */
+        -pdf-word-wrap: CJK;
+    }
+
+    /* 关键：显式设置段落间距，防止文字粘连 */
+    p {
+        margin-top: 0px;
+        margin-bottom: 10px;
+        text-indent: 0;
+    }
+
+    /* 列表优化 */
+    ul, ol {
+        margin-top: 5px;
+        margin-bottom: 10px;
+        padding-left: 20px;
+    }
+    li {
+        margin-bottom: 5px;
+        line-height: 1.5;
+    }
+
+    /* 标题样式 */
+    h1 {
+        font-size: 16px;
+        margin-top: 20px;
+        margin-bottom: 10px;
+        color: #e74c3c;
+        border-bottom: 1px solid #eee;
+        padding-bottom: 5px;
+    }
+    h2 {
+        font-size: 14px;
+        margin-top: 15px;
+        margin-bottom: 8px;
+        color: #2980b9;
+        border-left: 4px solid #2980b9;
+        padding-left: 8px;
+    }
+    h3 {
+        font-size: 12px;
+        margin-top: 10px;
+        margin-bottom: 6px;
+        font-weight: bold;
+        background-color: #f2f2f2;
+        padding: 4px;
+    }
+
+    /* 图片样式 */
+    img {
+        margin: 15px auto;
+        display: block;
+        border: 1px solid #ddd;
+        padding: 4px;
+    }
+
+    /* 页眉样式 */
+    .header {
+        text-align: center;
+        margin-bottom: 20px;
+        color: #95a5a6;
+        font-size: 10px;
+        border-bottom: 1px solid #eee;
+        padding-bottom: 8px;
+    }
+
+    /* 引用块样式 */
+    blockquote {
+        background: #f9f9f9;
+        border-left: 4px solid #ccc;
+        margin: 10px 0;
+        padding: 8px 12px;
+        color: #666;
+        font-size: 10px;
+    }
+
+    /* 代码块样式 */
+    pre, code {
+        background-color: #f4f4f4;
+        font-family: Helvetica, sans-serif;
+        font-size: 10px;
+        white-space: pre-wrap;
+        -pdf-word-wrap: CJK; /* 确保代码块里的中文也能换行 */
+        word-wrap: break-word;
+    }
+"""
+
+_TEMPLATE = Template("""
+<html>
+<head>
+    <meta charset="utf-8">
+    <style>""" + _CSS.replace("$", "$$") + """</style>
+</head>
+<body>
+    <div class="header">Wyckoff Quantitative Analysis Report | $symbol</div>
+
+    <div style="text-align: center;">
+        <img src="$chart_path" style="width: ${width}cm;" />
+    </div>
+
+    <hr style="border: 0; border-top: 1px solid #eee; margin: 15px 0;"/>
+
+    <div style="width: 100%;">
+        $body
+    </div>
+
+    <div id="footerContent" style="text-align:center; font-size: 9px; color: gray;">
+        Page <pdf:pagenumber>
+    </div>
+</body>
+</html>
+""")
+
+_MARKDOWN = markdown.Markdown(extensions=["extra", "sane_lists", "nl2br"])
+_MARKDOWN_LOCK = threading.Lock()
+
+
+def insert_soft_breaks(text: str) -> str:
+    """
+    轻量化断行预处理：
+    仅处理 URL、路径、长串数字等容易造成溢出的非中文内容。
+    中文换行完全交给 xhtml2pdf 的 CSS (-pdf-word-wrap: CJK) 处理。
+    """
+    if not text:
+        return ""
+
+    zwsp = chr(0x200B)
+
+    # 1) 统一换行符，防止不同平台的 \r\n 干扰 Markdown 解析
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    # 2) 常见分隔符后插入 ZWSP (帮助 URL/路径/代码 换行)
+    #    只在 [/ _ - . = : ? & # %] 后面加，不碰普通内容
+    text = re.sub(r'([\/\_\-\.\=\:\?\&\#\%])', r'\1' + zwsp, text)
+
+    # 3) 超长连续英文数字串：每 30 字符强制打断
+    def _break_long_token(m: re.Match) -> str:
+        s = m.group(0)
+        step = 30
+        return zwsp.join(s[i:i + step] for i in range(0, len(s), step))
+
+    text = re.sub(r'[A-Za-z0-9]{50,}', _break_long_token, text)
+
+    return text
+
+
+def font_path() -> Optional[str]:
+    """PDF_FONT_PATH，缺省为文泉驿微米黑；文件不存在时返回 None"""
+    path = os.getenv("PDF_FONT_PATH", "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc")
+    return path if os.path.isfile(path) else None
+
+
+_FONT_LOCK = threading.Lock()
+_FONT_READY = False
+
+
+def register_font():
+    """
+    每个进程只解析一次中文字体，并登记到 xhtml2pdf 的默认字体表。
+    reportlab 的 TTFont 只嵌入文档实际用到的字形 (子集)，不会整体嵌入 .ttc。
+    """
+    global _FONT_READY
+    with _FONT_LOCK:
+        if _FONT_READY: return
+        path = font_path()
+        if path is None:
+            # 缺字体时仍出报告 (中文显示为方框)，而不是整份报告失败
+            print(f"   ⚠️ 未找到中文字体 {os.getenv('PDF_FONT_PATH', 'wqy-microhei.ttc')}，改用默认字体 Helvetica", flush=True)
+            pisa_default.DEFAULT_FONT[FONT_NAME.lower()] = "Helvetica"
+            _FONT_READY = True
+            return
+        pdfmetrics.registerFont(TTFont(FONT_NAME, path, subfontIndex=0))
+        for bold in (0, 1):
+            for italic in (0, 1):
+                addMapping(FONT_NAME, bold, italic, FONT_NAME)
+        pisa_default.DEFAULT_FONT[FONT_NAME.lower()] = FONT_NAME
+        _FONT_READY = True
+
+
+def build_html(symbol: str, chart_path: str, report_text: str) -> str:
+    with _MARKDOWN_LOCK:
+        body = _MARKDOWN.reset().convert(insert_soft_breaks(report_text))
+    return _TEMPLATE.substitute(symbol=symbol, chart_path=os.path.abspath(chart_path), body=body,
+                                width=os.getenv("CHART_DISPLAY_WIDTH_CM", "15"))
+
+
+def render_pdf(symbol: str, chart_path: str, report_text: str, pdf_path: str) -> tuple[float, int]:
+    """生成一份 PDF，返回 (耗时毫秒, 文件字节数)；失败时抛出异常。也是进程池任务入口"""
+    t0 = time.perf_counter()
+    register_font()
+    html = build_html(symbol, chart_path, report_text)
+    with open(pdf_path, "wb") as pdf_file:
+        status = pisa.CreatePDF(html, dest=pdf_file)
+    if status.err:
+        raise RuntimeError(f"xhtml2pdf reported {status.err} error(s)")
+    return (time.perf_counter() - t0) * 1000, os.path.getsize(pdf_path)
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def pdf_processes() -> int:
+    """PDF_PROCESSES: 0 关闭进程池 (默认)，-1 使用全部 CPU 核"""
+    n = int(os.getenv("PDF_PROCESSES", "0"))
+    return (os.cpu_count() or 1) if n < 0 else n
+
+
+def _pool_context():
+    """与绘图进程池相同：不 fork 持有其他线程锁的流水线进程 (不导入 chart_renderer，免得拉起 matplotlib)"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _POOL
+    workers = pdf_processes()
+    if workers <= 0: return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=workers, initializer=register_font, mp_context=_pool_context())
+        return _POOL
+
+
+def render_many(jobs: list, workers: int = None) -> list:
+    """jobs: [(symbol, chart_path, report_text, pdf_path)]；多进程并行生成，返回 [(耗时毫秒, 字节数)]"""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=register_font) as pool:
+        futures = [pool.submit(render_pdf, *job) for job in jobs]
+        return [f.result() for f in futures]
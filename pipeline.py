@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+_STOP = object()
+
+
+class Stage:
+    """
+    流水线中的一个阶段：独立的工作线程池 + 有界输入队列。
+    func(job) 返回处理后的 job 交给下一阶段；返回 None 表示该任务到此结束。
+    batch_size > 1 时为批处理阶段：func(jobs) 接收一批任务并返回同样长度的列表，
+    每批最多等待 batch_wait_s 秒凑满；同一时刻只有一个线程在凑批，避免任务被摊薄到各线程。
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, queue_size: int = 4,
+                 batch_size: int = 1, batch_wait_s: float = 5.0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait_s = batch_wait_s
+        self._gather_lock = threading.Lock()
+
+        # 统计
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_s = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self._lock = threading.Lock()
+        self._alive = self.workers
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_sum += depth
+            self._depth_samples += 1
+
+    @property
+    def avg_depth(self) -> float:
+        return self._depth_sum / self._depth_samples if self._depth_samples else 0.0
+
+
+class StagedPipeline:
+    """
+    生产者/消费者流水线：各阶段并行运行，第 N+1 个任务可以在第 N 个任务
+    等待 LLM 时完成抓取和绘图。队列有界，上游过快时会被自然地反压。
+    """
+
+    def __init__(self, stages: list[Stage], on_error: Callable[[Stage, dict, Exception], None] = None):
+        self.stages = stages
+        self.on_error = on_error
+        self.results: list[dict] = []
+        self.wall_s = 0.0
+        self._results_lock = threading.Lock()
+
+    @staticmethod
+    def _take(stage: Stage) -> tuple[list, bool]:
+        """取一批任务，返回 (任务列表, 是否收到结束信号)"""
+        if stage.batch_size == 1:
+            job = stage.queue.get()
+            return ([], True) if job is _STOP else ([job], False)
+
+        with stage._gather_lock:
+            job = stage.queue.get()
+            if job is _STOP: return [], True
+            jobs = [job]
+            deadline = time.monotonic() + stage.batch_wait_s
+            while len(jobs) < stage.batch_size:
+                try:
+                    job = stage.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is _STOP: return jobs, True
+                jobs.append(job)
+            return jobs, False
+
+    def _worker(self, idx: int):
+        stage = self.stages[idx]
+        next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            jobs, stop = self._take(stage)
+            if jobs: self._process(stage, next_stage, jobs)
+            if stop:
+                with stage._lock:
+                    stage._alive -= 1
+                    last = stage._alive == 0
+                # 本阶段最后一个线程退出时，通知下游所有线程收尾
+                if last and next_stage:
+                    for _ in range(next_stage.workers): next_stage.put(_STOP)
+                return
+
+    def _process(self, stage: Stage, next_stage: Optional[Stage], jobs: list):
+        t0 = time.perf_counter()
+        try:
+            outs = stage.func(jobs) if stage.batch_size > 1 else [stage.func(jobs[0])]
+        except Exception as e:
+            with stage._lock: stage.failed += len(jobs)
+            if self.on_error:
+                for job in jobs: self.on_error(stage, job, e)
+            return
+        finally:
+            with stage._lock:
+                stage.busy_s += time.perf_counter() - t0
+                stage.processed += len(jobs)
+
+        for out in outs:
+            if out is None:
+                with stage._lock: stage.dropped += 1
+                continue
+            if next_stage:
+                next_stage.put(out)
+            else:
+                with self._results_lock: self.results.append(out)
+
+    def run(self, jobs: Iterable[dict]) -> list[dict]:
+        t0 = time.perf_counter()
+        threads = []
+        for idx, stage in enumerate(self.stages):
+            for w in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(idx,), name=f"{stage.name}-{w}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        first = self.stages[0]
+        for job in jobs: first.put(job)
+        for _ in range(first.workers): first.put(_STOP)
+
+        for t in threads: t.join()
+        self.wall_s = time.perf_counter() - t0
+        return self.results
+
+    def report(self) -> str:
+        """各阶段的队列深度与利用率 (busy / (workers * 总耗时))"""
+        lines = [f"   {'stage':<8}{'workers':>8}{'done':>6}{'drop':>6}{'fail':>6}{'avg_q':>8}{'max_q':>8}{'util':>8}"]
+        for s in self.stages:
+            util = s.busy_s / (s.workers * self.wall_s) if self.wall_s > 0 else 0.0
+            lines.append(
+                f"   {s.name:<8}{s.workers:>8}{s.processed:>6}{s.dropped:>6}{s.failed:>6}"
+                f"{s.avg_depth:>8.1f}{s.max_depth:>8}{util:>8.0%}"
+            )
+        lines.append(f"   总耗时 {self.wall_s:.1f}s")
+        return "\n".join(lines)
@@ -0,0 +1,113 @@
+import math
+import os
+import re
+import pandas as pd
+
+# 场内基金 (ETF/LOF) 最小变动价位 0.001，其余 A 股 0.01
+_FUND_PREFIXES = ("15", "16", "18", "50", "51", "52", "56", "58")
+_CJK_RE = re.compile(r"[　-〿一-鿿＀-￯]")
+
+DEFAULT_TOKEN_BUDGET = 30000
+MIN_BARS = 60
+
+
+def tick_size(symbol: str) -> float:
+    return 0.001 if str(symbol).startswith(_FUND_PREFIXES) else 0.01
+
+
+def price_decimals(symbol: str) -> int:
+    return max(0, -int(math.floor(math.log10(tick_size(symbol)))))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中文约 1 字 1 token，数字/标点/英文约 3 字符 1 token。
+    偏保守，只用于预算控制，不追求与具体模型分词器一致。
+    """
+    if not text: return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 3)
+
+
+def token_budget(model: str = None) -> int:
+    """
+    按模型取 prompt 预算：PROMPT_TOKEN_BUDGETS="gemini=60000,gpt-4o=25000" (按前缀匹配)，
+    未匹配时使用 PROMPT_TOKEN_BUDGET。
+    """
+    default = int(os.getenv("PROMPT_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+    spec = os.getenv("PROMPT_TOKEN_BUDGETS", "")
+    if model and spec:
+        for item in spec.split(","):
+            prefix, _, value = item.partition("=")
+            if prefix.strip() and model.startswith(prefix.strip()):
+                try: return int(value)
+                except ValueError: pass
+    return default
+
+
+def _fmt(series: pd.Series, decimals: int) -> pd.Series:
+    """定点格式化并去掉小数部分多余的 0 (整数不动，150000 股 -> "1500" 手)，NaN 输出为空串"""
+    def fmt(x):
+        if pd.isna(x): return ""
+        if decimals <= 0: return f"{x:.0f}"
+        return f"{x:.{decimals}f}".rstrip("0").rstrip(".")
+    return series.round(decimals).map(fmt).astype(str)
+
+
+def encode_bars(df: pd.DataFrame, symbol: str, period: str = "") -> str:
+    """
+    紧凑行情编码（替代 df.to_csv）：
+    - 时间：每个交易日一行 "@YYYY-MM-DD" 日期头，K 线行内只写 HHMM；
+    - 价格：按最小变动价位保留小数位并去掉尾随 0；
+    - 成交量：换算为 "手" (100 股) 取整；
+    - 整列为空的指标列 (如 K 线不足 200 根时的 ma200) 直接删除。
+    """
+    if df.empty: return ""
+    decimals = price_decimals(symbol)
+
+    price_cols = [c for c in ["open", "high", "low", "close"] if c in df.columns]
+    extra_cols = [c for c in df.columns if c not in ["date", "volume"] + price_cols and df[c].notna().any()]
+
+    dates = pd.to_datetime(df["date"])
+    cols = {"t": dates.dt.strftime("%H%M")}
+    short = {"open": "o", "high": "h", "low": "l", "close": "c"}
+    for c in price_cols: cols[short[c]] = _fmt(df[c], decimals)
+    if "volume" in df.columns:
+        cols["v"] = _fmt(df["volume"] / 100, 0)
+    for c in extra_cols: cols[c] = _fmt(df[c], decimals)
+
+    names = list(cols)
+    rows = cols[names[0]].str.cat([cols[n] for n in names[1:]], sep=",")
+
+    days = dates.dt.strftime("%Y-%m-%d")
+    new_day = days.ne(days.shift())
+    lines = [
+        f"# {len(df)} bars{' ' + period if period else ''}; time=HHMM under '@date' lines; "
+        f"price decimals={decimals}; v=volume in lots (100 shares); blank=N/A",
+        ",".join(names),
+    ]
+    for day, is_new, row in zip(days, new_day, rows):
+        if is_new: lines.append(f"@{day}")
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def fit_to_budget(build, df: pd.DataFrame, budget: int) -> tuple[str, int]:
+    """
+    build(df) -> prompt。超出预算时丢弃最早的 K 线 (二分查找可保留的最大根数)。
+    返回 (prompt, 实际使用的 K 线根数)。
+    """
+    prompt = build(df)
+    if estimate_tokens(prompt) <= budget or len(df) <= MIN_BARS:
+        return prompt, len(df)
+
+    lo, hi = MIN_BARS, len(df) - 1
+    best = build(df.tail(lo))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = build(df.tail(mid))
+        if estimate_tokens(candidate) <= budget:
+            lo, best = mid, candidate
+        else:
+            hi = mid - 1
+    return best, lo
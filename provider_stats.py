@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class ProviderStats:
+    """
+    每个 LLM 提供方最近 N 次调用的 (耗时, 是否成功) 滚动窗口，落盘跨运行保留。
+    用于：按成功率 + 延迟给兜底链排序；为对冲请求提供 p90 触发阈值。
+    """
+
+    def __init__(self, path: str = None, window: int = None, min_samples: int = None):
+        self.path = path or os.getenv("PROVIDER_STATS_FILE", "data/provider_stats.json")
+        self.window = window or int(os.getenv("PROVIDER_STATS_WINDOW", "50"))
+        self.min_samples = min_samples or int(os.getenv("PROVIDER_STATS_MIN_SAMPLES", "5"))
+        self._samples: dict[str, deque] = {}
+        self._ttft: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, items in saved.items():
+            self._samples[name] = deque(((float(lat), bool(ok)) for lat, ok in items), maxlen=self.window)
+
+    def save(self):
+        with self._lock:
+            data = {name: [[round(lat, 3), ok] for lat, ok in q] for name, q in self._samples.items()}
+        if not data: return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def record(self, name: str, latency_s: float, ok: bool):
+        with self._lock:
+            q = self._samples.setdefault(name, deque(maxlen=self.window))
+            q.append((latency_s, ok))
+
+    def record_ttft(self, name: str, ttft_s: float):
+        """流式调用的首 token 时间 (仅本次运行内统计)"""
+        with self._lock:
+            self._ttft.setdefault(name, deque(maxlen=self.window)).append(ttft_s)
+
+    def _latencies(self, name: str) -> list[float]:
+        with self._lock:
+            return [lat for lat, ok in self._samples.get(name, ()) if ok]
+
+    def percentile(self, name: str, q: float):
+        """成功调用的延迟分位数；样本不足时返回 None"""
+        lat = self._latencies(name)
+        if len(lat) < self.min_samples: return None
+        return float(np.percentile(lat, q))
+
+    def success_rate(self, name: str):
+        with self._lock:
+            items = list(self._samples.get(name, ()))
+        if len(items) < self.min_samples: return None
+        return sum(ok for _, ok in items) / len(items)
+
+    def rank(self, names: list[str]) -> list[str]:
+        """
+        按 (成功率降序, p50 延迟升序) 排序；样本不足的提供方保持原有相对位置、
+        排在有数据且成功率不低于 0.5 的提供方之后。
+        """
+        def key(item):
+            pos, name = item
+            rate = self.success_rate(name)
+            p50 = self.percentile(name, 50)
+            if rate is None or p50 is None: return (1, 0.0, 0.0, pos)
+            if rate < 0.5: return (2, -rate, p50, pos)
+            return (0, -round(rate, 1), p50, pos)
+        return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def summary(self) -> str:
+        lines = []
+        for name in sorted(self._samples):
+            rate = self.success_rate(name)
+            p50, p90 = self.percentile(name, 50), self.percentile(name, 90)
+            if rate is None: continue
+            ttft = list(self._ttft.get(name, ()))
+            ttft_str = f", 首 token p50 {float(np.percentile(ttft, 50)):.1f}s" if ttft else ""
+            lines.append(f"   📶 {name}: 成功率 {rate:.0%}, p50 {p50 or 0:.1f}s, p90 {p90 or 0:.1f}s{ttft_str} (最近 {len(self._samples[name])} 次)")
+        return "\n".join(lines)
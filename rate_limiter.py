@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+# 各外部依赖的默认配额，格式 "次数/单位[,突发容量]"，单位 s/m/h
+# 可通过环境变量 RATE_LIMIT_<NAME> 覆盖，例如 RATE_LIMIT_GEMINI="10/m,2"
+DEFAULT_LIMITS = {
+    "baostock": "5/s",
+    "akshare": "2/s",
+    "gemini": "5/m",
+    "custom": "20/m",
+    "openai": "60/m",
+}
+
+_UNIT_SECONDS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_rate(spec: str) -> tuple[float, float]:
+    """解析 "10/m,2" -> (每秒令牌数, 桶容量)"""
+    spec = spec.strip().lower()
+    burst = None
+    if "," in spec:
+        spec, burst_str = spec.split(",", 1)
+        burst = float(burst_str)
+    count_str, _, unit = spec.partition("/")
+    count = float(count_str)
+    seconds = _UNIT_SECONDS.get(unit.strip() or "s")
+    if seconds is None or count <= 0:
+        raise ValueError(f"invalid rate spec: {spec!r}")
+    # 未指定突发容量时：按秒计的配额允许一秒内用满，按分钟/小时计的配额不允许突发
+    if not burst:
+        burst = count if seconds == 1.0 else 1.0
+    return count / seconds, burst
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：按 rate 匀速补充令牌，最多积攒 capacity 个。
+    acquire() 在令牌不足时阻塞到补足为止，替代固定的 sleep 冷却。
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+        self.acquired = 0
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """取出令牌，返回本次等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.acquired += 1
+                    self.waited_s += waited
+                    return waited
+                wait_s = (tokens - self._tokens) / self.rate
+            time.sleep(wait_s)
+            waited += wait_s
+
+
+_LIMITERS: dict[str, TokenBucket] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_limiter(name: str) -> TokenBucket:
+    """按名称获取进程内共享的限流器（首次调用时按环境变量创建）"""
+    with _REGISTRY_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            spec = os.getenv(f"RATE_LIMIT_{name.upper()}") or DEFAULT_LIMITS.get(name, "1/s")
+            rate, capacity = parse_rate(spec)
+            limiter = _LIMITERS[name] = TokenBucket(name, rate, capacity)
+        return limiter
+
+
+def limiter_summary() -> str:
+    lines = []
+    for name, lim in sorted(_LIMITERS.items()):
+        lines.append(f"   ⏱️ {name}: {lim.acquired} 次请求, 限流等待 {lim.waited_s:.1f}s")
+    return "\n".join(lines)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# A 股连续竞价时段 (分钟数自 00:00 起)：上午 09:30-11:30，下午 13:00-15:00，各 120 分钟
+_AM_OPEN, _AM_CLOSE = 9 * 60 + 30, 11 * 60 + 30
+_PM_OPEN, _PM_CLOSE = 13 * 60, 15 * 60
+
+
+def session_index(dates: pd.Series) -> np.ndarray:
+    """
+    1 分钟 K 线（按结束时刻标注）在交易日内的序号：09:31 -> 1 ... 11:30 -> 120，
+    13:01 -> 121 ... 15:00 -> 240。09:30 集合竞价归入第 1 分钟，13:00 归入 121。
+    非交易时段返回 -1。
+    """
+    minute = (dates.dt.hour * 60 + dates.dt.minute).to_numpy()
+    idx = np.full(len(minute), -1, dtype=np.int64)
+
+    am = (minute >= _AM_OPEN) & (minute <= _AM_CLOSE)
+    idx[am] = np.maximum(minute[am] - _AM_OPEN, 1)
+    pm = (minute >= _PM_OPEN) & (minute <= _PM_CLOSE)
+    idx[pm] = np.maximum(minute[pm] - _PM_OPEN, 1) + 120
+    return idx
+
+
+def _label_minutes(bucket_end: np.ndarray) -> np.ndarray:
+    """交易日内序号 -> 时钟分钟数 (120 -> 11:30，121 之后接 13:00)"""
+    return np.where(bucket_end <= 120, _AM_OPEN + bucket_end, _PM_OPEN + bucket_end - 120)
+
+
+def resample_a_share(df_1m: pd.DataFrame, tf_min: int) -> pd.DataFrame:
+    """
+    由 1 分钟 K 线合成 tf_min 分钟 K 线，遵循 A 股交易时段：
+    - 午休不跨桶：60m 为 10:30 / 11:30 / 14:00 / 15:00 四根；
+    - 按 K 线结束时刻标注，与 BaoStock / AkShare 返回一致 (5m 首根为 09:35)；
+    - open 取首根、close 取末根、high/low 取极值、volume 求和。
+    """
+    if df_1m.empty or tf_min <= 1:
+        return df_1m.copy()
+    if 120 % tf_min != 0:
+        raise ValueError(f"unsupported timeframe for A-share session: {tf_min}")
+
+    df = df_1m.sort_values("date")
+    dates = pd.to_datetime(df["date"])
+    idx = session_index(dates)
+    mask = idx > 0
+    df, dates, idx = df[mask], dates[mask], idx[mask]
+    if df.empty:
+        return pd.DataFrame(columns=["date", "open", "high", "low", "close", "volume"])
+
+    bucket_end = ((idx - 1) // tf_min + 1) * tf_min
+    day = dates.dt.normalize()
+    label = day + pd.to_timedelta(_label_minutes(bucket_end), unit="m")
+
+    grouped = df.assign(date=label.to_numpy()).groupby("date", sort=True)
+    out = grouped.agg(open=("open", "first"), high=("high", "max"), low=("low", "min"),
+                      close=("close", "last"), volume=("volume", "sum"))
+    return out.reset_index()[["date", "open", "high", "low", "close", "volume"]]
+
+
+def latest_bar_end(now: pd.Timestamp, tf_min: int) -> pd.Timestamp:
+    """
+    截至 now (北京时间，无时区) 最近一根已走完的 tf_min 分钟 K 线的标注时刻。
+    只按交易时段与周一至周五推算，不识别节假日 / 停牌 (此时会偏晚，调用方按"可能有新 K 线"处理)。
+    """
+    tf = max(1, int(tf_min))
+    day = now.normalize()
+    minute = now.hour * 60 + now.minute
+    if now.weekday() < 5 and minute >= _AM_OPEN + tf:
+        if minute <= _AM_CLOSE: elapsed = minute - _AM_OPEN
+        elif minute < _PM_OPEN: elapsed = 120
+        else: elapsed = min(240, 120 + minute - _PM_OPEN)
+        bucket_end = elapsed // tf * tf
+        return day + pd.Timedelta(minutes=int(_label_minutes(np.array([bucket_end]))[0]))
+    # 今日第一根尚未走完：上一个工作日收盘
+    day -= pd.Timedelta(days=1)
+    while day.weekday() >= 5: day -= pd.Timedelta(days=1)
+    return day + pd.Timedelta(minutes=_PM_CLOSE)
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+# 每只股票依次完成的阶段
+STAGES = ("fetched", "charted", "analysed", "pdf")
+
+
+class RunJournal:
+    """
+    运行日志 (JSON Lines，逐条追加并立即落盘)：记录每只股票完成了哪些阶段及其产物 (快照 / 图表 / 分析文本 / PDF)。
+    上一次运行没有正常结束 (被取消 / 中断)、且开始于 RUN_JOURNAL_MAX_AGE_H 小时 (默认 2) 以内时，
+    本次运行接着写同一份日志，已完成的阶段直接复用产物；否则清空重来，避免复用上一个时段的行情。
+    """
+
+    def __init__(self, path: str = None, max_age_h: float = None):
+        self.path = path or os.getenv("RUN_JOURNAL_FILE", "data/run_journal.jsonl")
+        max_age_h = float(os.getenv("RUN_JOURNAL_MAX_AGE_H", "2")) if max_age_h is None else max_age_h
+        self.run_id = time.strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:6]
+        self.records: dict[str, dict] = {}  # {代码: {"key": 周期与根数, 阶段: 产物}}
+        self.resumed_from = None
+        self.reused = 0
+        self._lock = threading.Lock()
+
+        started, finished, run_id, records = self._read()
+        if started is not None and not finished and time.time() - started <= max_age_h * 3600:
+            self.resumed_from = run_id
+            self.records = records
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a" if self.resumed_from else "w", encoding="utf-8")
+        self._write({"event": "start", "run": self.run_id, "ts": round(time.time(), 3), "resumed_from": self.resumed_from})
+
+    def _read(self) -> tuple:
+        """返回 (最早一次开始的时刻, 是否已正常结束, 最早的 run_id, 各股票记录)；续跑多次时仍以第一次开始计时"""
+        started = run_id = None
+        finished = False
+        records: dict[str, dict] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return started, finished, run_id, records
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # 中断时可能只写了半行
+            event = entry.get("event")
+            if event == "start":
+                if started is None: started, run_id = entry.get("ts"), entry.get("run")
+            elif event == "finish":
+                finished = True
+            elif entry.get("stage") in STAGES and entry.get("symbol"):
+                rec = records.get(entry["symbol"])
+                if rec is None or rec["key"] != entry.get("key"):
+                    rec = records[entry["symbol"]] = {"key": entry.get("key")}
+                rec[entry["stage"]] = entry.get("artifacts", {})
+        return started, finished, run_id, records
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def completed(self, symbol: str, key: str) -> dict:
+        """该股票在同一配置 (周期 / 根数) 下已完成的阶段 -> 产物；配置变了则视为未完成"""
+        with self._lock:
+            rec = self.records.get(symbol)
+            if not rec or rec["key"] != key: return {}
+            return {stage: rec[stage] for stage in STAGES if stage in rec}
+
+    def record(self, symbol: str, key: str, stage: str, **artifacts):
+        with self._lock:
+            rec = self.records.get(symbol)
+            if rec is None or rec["key"] != key:
+                rec = self.records[symbol] = {"key": key}
+            rec[stage] = artifacts
+        self._write({"symbol": symbol, "key": key, "stage": stage, "artifacts": artifacts, "ts": round(time.time(), 3)})
+
+    def count_reused(self, n: int = 1):
+        with self._lock:
+            self.reused += n
+
+    def finish(self):
+        """整次运行正常结束：下次运行从头开始"""
+        self._write({"event": "finish", "run": self.run_id, "ts": round(time.time(), 3)})
+        self._file.close()
+
+    def summary(self) -> str:
+        if not self.resumed_from: return ""
+        return f"   ♻️ 续跑 {self.resumed_from}: 复用 {self.reused} 个已完成的阶段"
@@ -1,10 +1,40 @@
 import os
 import json
+import re
+from bisect import bisect_left
 import gspread
+import requests
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 
+_SHEETS_API = "https://sheets.googleapis.com"
+
+def _clean_symbol(raw):
+    return ''.join(filter(str.isdigit, str(raw))).zfill(6)
+
+
+class _RebasedSession(requests.Session):
+    """把 gspread 发往 Google Sheets 的请求改写到 SHEETS_API_BASE (本地替身 / 压测用，免认证)"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(_SHEETS_API): url = self.base_url + url[len(_SHEETS_API):]
+        return super().request(method, url, *args, **kwargs)
+
+
 class SheetManager:
     def __init__(self):
+        stub_base = os.getenv("SHEETS_API_BASE")
+        if stub_base:
+            print(f"   >>> [System] 连接 Sheets 替身: {stub_base}")
+            self.client = gspread.Client(None, session=_RebasedSession(stub_base))
+            self.sh = self.client.open_by_key(os.getenv("SHEET_NAME") or "stub")
+            self._init_sheet()
+            return
+
         # 1. 获取凭证
         raw_key = os.getenv("GCP_SA_KEY")
         if not raw_key:
@@ -44,34 +74,107 @@ class SheetManager:
             print(f"   ❌ 找不到名为 '{sheet_name_or_id}' 的表格。")
             raise
 
+        self._init_sheet()
+
+    def _init_sheet(self):
         self.sheet = self.sh.sheet1
 
+        # 本地模型：首次使用时整表读取一次，之后的查询与修改都在内存中完成，flush() 时批量写回
+        self.invalidate()
+
+    # ---------- 本地模型 ----------
+
+    def invalidate(self):
+        """丢弃本地模型与暂存的修改 (如写回失败后)，下次使用时重新读取整张表"""
+        self._records = None      # {代码: {"row": 表格行号 (待追加为 None), "values": [整行]}}
+        self._cell_updates = {}   # {(行, 列): 值}
+        self._appends = []        # 待追加的代码 (按加入顺序)
+        self._deletes = set()     # 待删除的表格行号
+
+    def _ensure_loaded(self):
+        if self._records is None:
+            self.reload()
+
+    def reload(self):
+        """
+        重新读取整张表 (丢弃尚未 flush 的修改)。
+        同一代码出现在多行时以最后一行为准 (与逐行读取覆盖的旧行为一致)，后续修改也写到该行。
+        """
+        all_values = self.sheet.get_all_values()
+        self._records = {}
+        for row_no, row in enumerate(all_values[1:], start=2):
+            if not row or not row[0].strip(): continue
+            symbol = _clean_symbol(row[0].strip())
+            values = [str(v) for v in row] + [""] * max(0, 6 - len(row))
+            self._records[symbol] = {"row": row_no, "values": values}
+        self._cell_updates = {}
+        self._appends = []
+        self._deletes = set()
+
+    @property
+    def has_pending(self):
+        return bool(self._cell_updates or self._appends or self._deletes)
+
+    def flush(self):
+        """
+        把暂存的修改写回表格：单元格改动一次 batch_update，删行一次 deleteDimension 批量请求，
+        新增一次 append_rows。返回本次写入的 API 调用次数。
+        """
+        if not self.has_pending: return 0
+        calls = 0
+
+        if self._cell_updates:
+            data = [{"range": rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in sorted(self._cell_updates.items())]
+            self.sheet.batch_update(data, raw=False)  # 与 update_cell 一致按 USER_ENTERED 写入
+            self._cell_updates = {}
+            calls += 1
+
+        if self._deletes:
+            deleted = sorted(self._deletes)
+            requests = [
+                {"deleteDimension": {"range": {"sheetId": self.sheet.id, "dimension": "ROWS", "startIndex": r - 1, "endIndex": r}}}
+                for r in reversed(deleted)  # 自下而上删除，行号互不影响
+            ]
+            self.sh.batch_update({"requests": requests})
+            self._deletes = set()
+            calls += 1
+            # 被删行下方的行整体上移
+            for rec in self._records.values():
+                if rec["row"]: rec["row"] -= bisect_left(deleted, rec["row"])
+
+        if self._appends:
+            symbols = [s for s in self._appends if s in self._records]
+            resp = self.sheet.append_rows([self._records[s]["values"][:6] for s in symbols], table_range="A1")
+            self._appends = []
+            calls += 1
+            match = re.search(r"![A-Z]+(\d+)", (resp or {}).get("updates", {}).get("updatedRange", ""))
+            if match:
+                for i, s in enumerate(symbols): self._records[s]["row"] = int(match.group(1)) + i
+            else:
+                self.reload()  # 无法得知新行的行号时重新读取，保证后续修改定位正确
+
+        print(f"   💾 表格已同步 ({calls} 次写入)")
+        return calls
+
     def get_all_stocks(self):
         """
-        获取所有股票配置
+        获取所有股票配置 (来自本地模型，含尚未 flush 的修改)
         New Format: Code, Date, Price, Qty, Timeframe(Col5), Bars(Col6)
         """
-        all_values = self.sheet.get_all_values()
-        if not all_values: return {}
-        
-        data_rows = all_values[1:]
+        self._ensure_loaded()
         stocks = {}
-        for row in data_rows:
-            if not row or not row[0].strip(): continue
-            
-            raw_symbol = row[0].strip()
-            digits = ''.join(filter(str.isdigit, raw_symbol))
-            symbol = digits.zfill(6)
+        for symbol, rec in self._records.items():
+            row = rec["values"]
             
             # 安全获取各项配置
-            buy_date = row[1].strip() if len(row) > 1 else ""
-            price = row[2].strip() if len(row) > 2 else ""
-            qty = row[3].strip() if len(row) > 3 else ""
+            buy_date = row[1].strip()
+            price = row[2].strip()
+            qty = row[3].strip()
             
             # === 新增自定义列 ===
             # 如果表格里没填，默认给 None，交给 main.py 处理默认值
-            timeframe = row[4].strip() if len(row) > 4 else "5"
-            bars = row[5].strip() if len(row) > 5 else "500"
+            timeframe = row[4].strip()
+            bars = row[5].strip()
             
             # 简单的清洗，确保不为空
             if not timeframe: timeframe = "5"
@@ -87,51 +190,44 @@ class SheetManager:
         return stocks
 
     def add_or_update_stock(self, symbol, date='', price='', qty=''):
-        """添加或更新 (保持原样，新增列需手动在表格调整或后续升级指令)"""
-        clean_symbol = ''.join(filter(str.isdigit, str(symbol))).zfill(6)
-        print(f"   🔍 正在查找股票: {clean_symbol}")
-        
-        try:
-            cell = self.sheet.find(clean_symbol)
-            action_type = ""
-            
-            if cell:
-                print(f"   Found at Row {cell.row}. Updating...")
-                row = cell.row
-                if date: self.sheet.update_cell(row, 2, str(date))
-                if price: self.sheet.update_cell(row, 3, str(price))
-                if qty: self.sheet.update_cell(row, 4, str(qty))
-                action_type = "✅ 已更新"
-            else:
-                print(f"   Not found. Appending new row...")
-                # 默认追加时，周期和根数留空(使用默认)
-                self.sheet.append_row([clean_symbol, str(date), str(price), str(qty), "5", "500"])
-                action_type = "🆕 新增关注"
-
-            show_date = date if date else "-"
-            show_price = price if price else "-"
-            show_qty = qty if qty else "-"
-
-            return (
-                f"{action_type} {clean_symbol}\n"
-                f"本次变动: {show_date} | {show_price} | {show_qty}"
-            )
-                
-        except Exception as e:
-            print(f"   ❌ 操作表格失败: {e}")
-            raise e
+        """添加或更新：只修改本地模型并暂存，调用 flush() 后写回表格"""
+        clean_symbol = _clean_symbol(symbol)
+        self._ensure_loaded()
+
+        rec = self._records.get(clean_symbol)
+        if rec:
+            for col, value in ((2, date), (3, price), (4, qty)):
+                if not value: continue
+                rec["values"][col - 1] = str(value)
+                if rec["row"]: self._cell_updates[(rec["row"], col)] = str(value)
+            action_type = "✅ 已更新"
+        else:
+            # 默认追加时，周期和根数使用默认值
+            self._records[clean_symbol] = {"row": None, "values": [clean_symbol, str(date), str(price), str(qty), "5", "500"]}
+            self._appends.append(clean_symbol)
+            action_type = "🆕 新增关注"
+
+        show_date = date if date else "-"
+        show_price = price if price else "-"
+        show_qty = qty if qty else "-"
+
+        return (
+            f"{action_type} {clean_symbol}\n"
+            f"本次变动: {show_date} | {show_price} | {show_qty}"
+        )
 
     def remove_stock(self, symbol):
-        clean_symbol = ''.join(filter(str.isdigit, str(symbol))).zfill(6)
-        try:
-            cell = self.sheet.find(clean_symbol)
-            if cell:
-                self.sheet.delete_rows(cell.row)
-                return f"🗑️ 已移除 {clean_symbol}"
-            else:
-                return f"⚠️ 未找到 {clean_symbol}"
-        except Exception as e:
-            return f"❌ 删除失败: {e}"
+        clean_symbol = _clean_symbol(symbol)
+        self._ensure_loaded()
+        rec = self._records.pop(clean_symbol, None)
+        if not rec:
+            return f"⚠️ 未找到 {clean_symbol}"
+        if rec["row"]:
+            self._deletes.add(rec["row"])
+            self._cell_updates = {k: v for k, v in self._cell_updates.items() if k[0] != rec["row"]}
+        else:
+            self._appends.remove(clean_symbol)
+        return f"🗑️ 已移除 {clean_symbol}"
 
     def get_portfolio_summary(self):
         stocks = self.get_all_stocks()
@@ -0,0 +1,583 @@
+import argparse
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+# 与 main.py 的批量 prompt 约定一致：每只股票的数据段以此开头
+_SYMBOL_RE = re.compile(r"\[SYMBOL DATA: (\d{6})\]")
+
+
+def fake_report(symbol: str) -> str:
+    return f"# {symbol} 威科夫分析 (stub)\n\n- 阶段: Phase B\n- 结论: 观察\n"
+
+
+def fake_answer(prompt: str, omit=()) -> str:
+    """批量 prompt 返回 JSON 结构 (omit 中的股票故意漏答)，单只 prompt 返回一份 Markdown"""
+    symbols = _SYMBOL_RE.findall(prompt)
+    if symbols:
+        reports = [{"symbol": s, "report": fake_report(s)} for s in symbols if s not in omit]
+        return json.dumps({"reports": reports}, ensure_ascii=False)
+    match = re.search(r"Symbol: (\d{6})", prompt)
+    return fake_report(match.group(1) if match else "000000")
+
+
+def parse_latency(spec) -> callable:
+    """
+    延迟分布 (秒)：数字为固定值；uniform:最小,最大；lognormal:中位数,sigma；exp:均值。
+    返回无参采样函数。
+    """
+    if spec is None or spec == "": return lambda: 0.0
+    if isinstance(spec, (int, float)): return lambda: float(spec)
+    kind, _, args = str(spec).partition(":")
+    if not args: return lambda: float(kind)
+    a = [float(x) for x in args.split(",")]
+    rng = random.Random(hash(spec) & 0xFFFF)
+    lock = threading.Lock()
+    def sample(draw):
+        with lock: return max(0.0, draw())
+    if kind == "uniform": return lambda: sample(lambda: rng.uniform(a[0], a[1]))
+    if kind == "lognormal": return lambda: sample(lambda: rng.lognormvariate(math.log(a[0]), a[1]))
+    if kind == "exp": return lambda: sample(lambda: rng.expovariate(1 / a[0]))
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def parse_faults(spec: str) -> dict:
+    """
+    故障注入概率："429=0.05,503=0.02,400=0.001,quota=0.001" -> {"*": {"429": 0.05, ...}}
+    可加提供方前缀只作用于某个提供方，如 "gemini:quota=0.01" (LLM 替身按模型名区分 OpenAI 兼容提供方)
+    """
+    faults = {}
+    for item in (spec or "").split(","):
+        if not item.strip(): continue
+        kind, _, prob = item.partition("=")
+        provider, _, kind = kind.strip().rpartition(":")
+        faults.setdefault(provider or "*", {})[kind] = float(prob)
+    return faults
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, handler, host: str, port: int, latency_s=0.0, faults: str = "",
+                 retry_after: int = 1, seed: int = 0):
+        super().__init__((host, port), handler)
+        self.latency_s = latency_s
+        self._latency = parse_latency(latency_s)
+        self.faults = parse_faults(faults)
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._faulted: dict = {}        # {请求指纹: (故障时刻, 要求等待的秒数, 是否不可重试)}
+        self._seen: set = set()         # 出现过的请求指纹
+        self.blocked: dict = {}         # {提供方: 返回致命错误 / 配额耗尽的时刻}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, kind: str, n: int = 1) -> int:
+        """累加计数并返回累加后的值"""
+        with self._lock:
+            self.requests[kind] += n
+            return self.requests[kind]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name=type(self).__name__).start()
+        return self
+
+    def delay(self):
+        seconds = self._latency()
+        if seconds: time.sleep(seconds)
+
+    def inject(self, provider: str = "*") -> Optional[str]:
+        """按配置的概率抽取本次请求要注入的故障类型 (None 为正常返回)；提供方有单独配置时优先使用"""
+        faults = self.faults.get(provider) or self.faults.get("*")
+        if not faults: return None
+        with self._lock:
+            roll = self._rng.random()
+        for kind, prob in faults.items():
+            if roll < prob: return kind
+            roll -= prob
+        return None
+
+    def observe(self, provider: str, fingerprint: str, fault: Optional[str], blocks: bool = False,
+                repeatable: bool = False):
+        """
+        记录同一请求 (同一提供方 + 同一请求体) 的重试行为，用于校验客户端逻辑：
+        - {provider}_calls / {provider}_retry: 新请求数 / 重发次数
+        - retry_ok / retry_early: 429 之后的重发间隔是否满足返回的 Retry-After
+        - retry_fatal: 返回不可重试的错误 (blocks=True) 后仍重发了同一请求
+        - after_block: 提供方已返回致命错误 / 配额耗尽 1 秒后，仍收到新的 (非重发) 请求
+        repeatable=True 用于读接口：同一请求只有在上次失败后再次出现才算重发
+        """
+        key = (provider, fingerprint)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._seen and (not repeatable or key in self._faulted):
+                self.requests[f"{provider}_retry"] += 1
+                last = self._faulted.pop(key, None)
+                if last and last[2]:
+                    self.requests["retry_fatal"] += 1
+                elif last and last[1]:
+                    self.requests["retry_ok" if now - last[0] >= last[1] * 0.95 else "retry_early"] += 1
+            else:
+                self._seen.add(key)
+                self.requests[f"{provider}_calls"] += 1
+                blocked_at = self.blocked.get(provider)
+                if blocked_at is not None and now - blocked_at > 1.0:
+                    self.requests["after_block"] += 1
+            if fault:
+                self.requests[f"{provider}_fault_{fault}"] += 1
+                self._faulted[key] = (now, self.retry_after if fault == "429" else 0, blocks)
+                if blocks: self.blocked.setdefault(provider, now)
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, code: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _text(self, code: int, text: str, content_type: str = "text/plain; charset=utf-8"):
+        data = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+
+class LLMStubServer(_StubServer):
+    """
+    本地假 LLM 服务，同时模拟：
+    - Gemini: /v1beta/models/{model}:generateContent | :streamGenerateContent, /v1beta/cachedContents
+    - OpenAI 兼容: /v1/chat/completions (含 stream=True)
+    通过 GEMINI_BASE_URL / CUSTOM_API_BASE_URL / OPENAI_BASE_URL 指向本服务即可离线跑完整流程。
+    faults 可注入 429 (带 Retry-After) / 503 / 400 / quota (配额耗尽的 429)。
+    omit 中的股票在批量回答里被漏掉，用于验证逐只补跑。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s=0.0, faults: str = "",
+                 retry_after: int = 1, seed: int = 0, omit=()):
+        super().__init__(_LLMHandler, host, port, latency_s, faults, retry_after, seed)
+        self.cached: dict[str, str] = {}
+        self.omit = set(omit)
+
+    def env(self) -> dict:
+        """指向本服务的环境变量"""
+        return {
+            "GEMINI_BASE_URL": self.base_url,
+            "CUSTOM_API_BASE_URL": f"{self.base_url}/v1",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+        }
+
+
+# 与真实服务一致的错误体：main.py 据此区分限流 / 配额耗尽 / 致命错误
+_GEMINI_FAULTS = {
+    "429": (429, "Resource has been exhausted (e.g. check quota).", "RESOURCE_EXHAUSTED"),
+    "quota": (429, "You exceeded your current quota. Quota exceeded for metric: "
+                   "generativelanguage.googleapis.com/generate_content_free_tier_requests, limit: 250", "RESOURCE_EXHAUSTED"),
+    "503": (503, "The model is overloaded. Please try again later.", "UNAVAILABLE"),
+    "400": (400, "API key not valid. Please pass a valid API key.", "INVALID_ARGUMENT"),
+}
+_OPENAI_FAULTS = {
+    "429": (429, "Rate limit reached for requests", "rate_limit_exceeded"),
+    "quota": (429, "You exceeded your current quota, please check your plan and billing details.", "insufficient_quota"),
+    "503": (503, "The server is overloaded or not ready yet.", "server_error"),
+    "400": (400, "Invalid request: messages is malformed", "invalid_request_error"),
+}
+
+
+class _LLMHandler(_JSONHandler):
+
+    def _sse(self, events: list):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for event in events:
+            self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/stats":
+            return self._json(200, dict(self.server.requests))
+        self._json(404, {"error": "not found"})
+
+    def _fault(self, provider: str, raw: bytes, table: dict, openai_style: bool) -> bool:
+        """按概率注入故障；注入时已写出响应，返回 True"""
+        fault = self.server.inject(provider)
+        # Gemini 的 400 / 配额耗尽与 OpenAI 的 insufficient_quota 会让客户端熔断，之后不应再有新请求
+        blocks = fault == "quota" or (fault == "400" and not openai_style)
+        self.server.observe(provider, hashlib.sha1(raw).hexdigest(), fault, blocks)
+        if not fault: return False
+        code, message, status = table[fault]
+        headers = {"Retry-After": self.server.retry_after} if fault == "429" else None
+        if openai_style:
+            body = {"error": {"message": message, "type": status, "code": status}}
+        else:
+            body = {"error": {"code": code, "message": message, "status": status}}
+        self._json(code, body, headers)
+        return True
+
+    def do_POST(self):
+        raw = self._body()
+        body = json.loads(raw or b"{}")
+        path = urlparse(self.path).path
+        self.server.delay()
+
+        if path.endswith("/cachedContents"):
+            self.server.count("gemini_cache_create")
+            name = f"cachedContents/stub-{len(self.server.cached) + 1}"
+            self.server.cached[name] = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+            return self._json(200, {"name": name, "model": body.get("model")})
+
+        if ":generateContent" in path or ":streamGenerateContent" in path:
+            stream = ":streamGenerateContent" in path
+            self.server.count("gemini_stream" if stream else "gemini")
+            if _SYMBOL_RE.search(raw.decode("utf-8", "replace")): self.server.count("gemini_batch")
+            if self._fault("gemini", raw, _GEMINI_FAULTS, openai_style=False): return
+            prompt = self.server.cached.get(body.get("cachedContent"), "")
+            prompt += "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+            text = fake_answer(prompt, self.server.omit)
+            usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4}
+            if not stream:
+                return self._json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage})
+            chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+            events = [{"candidates": [{"content": {"parts": [{"text": c}]}}]} for c in chunks]
+            events[-1]["usageMetadata"] = usage
+            return self._sse([json.dumps(e) for e in events])
+
+        if path.endswith("/chat/completions"):
+            stream = bool(body.get("stream"))
+            self.server.count("chat_stream" if stream else "chat")
+            if _SYMBOL_RE.search(raw.decode("utf-8", "replace")): self.server.count("chat_batch")
+            if self._fault(body.get("model", "chat"), raw, _OPENAI_FAULTS, openai_style=True): return
+            prompt = "".join(m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user")
+            text = fake_answer(prompt, self.server.omit)
+            base = {"id": "stub", "created": int(time.time()), "model": body.get("model", "stub")}
+            if not stream:
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                         "total_tokens": (len(prompt) + len(text)) // 4}
+                return self._json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]))
+            chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+            events = [json.dumps(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"content": c}, "finish_reason": None}])) for c in chunks]
+            return self._sse(events + ["[DONE]"])
+
+        self._json(404, {"error": f"unknown path {path}"})
+
+
+class TelegramStubServer(_StubServer):
+    """
+    本地 Bot API 替身：/bot{token}/{method}，支持 getUpdates (长轮询) / sendMessage / sendDocument / sendMediaGroup。
+    rate_limit_every=N 时每第 N 个请求返回 429 + retry_after，用于验证退避逻辑；
+    faults 可按概率注入 429 / 503 / 400 (getUpdates 不注入)。
+    通过 TG_API_BASE 指向本服务。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s=0.0,
+                 rate_limit_every: int = 0, retry_after: int = 1, faults: str = "", seed: int = 0):
+        super().__init__(_TelegramHandler, host, port, latency_s, faults, retry_after, seed)
+        self.rate_limit_every = rate_limit_every
+        self.updates: list[dict] = []
+        self.messages: list[dict] = []
+        self.documents: list[str] = []
+        self._arrived = threading.Condition(self._lock)
+
+    def env(self) -> dict:
+        return {"TG_API_BASE": self.base_url}
+
+    def push_update(self, text: str, chat_id: int = 1) -> int:
+        """模拟用户发来一条消息，返回 update_id"""
+        with self._lock:
+            update_id = len(self.updates) + 1
+            self.updates.append({"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": text}})
+            self._arrived.notify_all()
+            return update_id
+
+    def wait_updates(self, offset: int, timeout: float) -> list:
+        """getUpdates 长轮询：无新消息时挂起至多 timeout 秒"""
+        with self._arrived:
+            self._arrived.wait_for(lambda: any(u["update_id"] >= offset for u in self.updates), timeout)
+            return [u for u in self.updates if u["update_id"] >= offset]
+
+
+_TELEGRAM_FAULTS = {
+    "429": (429, "Too Many Requests: retry later"),
+    "503": (503, "Service Unavailable"),
+    "400": (400, "Bad Request: chat not found"),
+}
+
+
+class _TelegramHandler(_JSONHandler):
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        method = parsed.path.rsplit("/", 1)[-1]
+        raw = self._body()
+        server.delay()
+
+        total = server.count("total")
+        if server.rate_limit_every and total % server.rate_limit_every == 0:
+            server.count("429")
+            return self._json(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                                    "parameters": {"retry_after": server.retry_after}})
+        if method != "getUpdates":
+            # multipart 的 boundary 每次不同，按方法 + 文件名 / 正文识别同一请求的重发
+            names = re.findall(rb'filename="([^"]+)"', raw)
+            fingerprint = hashlib.sha1(method.encode() + b"|".join(names) + (b"" if names else raw)).hexdigest()
+            fault = server.inject()
+            server.observe("telegram", fingerprint, fault, blocks=fault == "400")
+            if fault:
+                code, description = _TELEGRAM_FAULTS[fault]
+                body = {"ok": False, "error_code": code, "description": description}
+                if fault == "429": body["parameters"] = {"retry_after": server.retry_after}
+                return self._json(code, body)
+        server.count(method)
+
+        if method == "getUpdates":
+            params = dict(p.split("=", 1) for p in parsed.query.split("&") if "=" in p)
+            offset = int(params.get("offset", 0))
+            timeout = min(float(params.get("timeout", 0)), 60)
+            return self._json(200, {"ok": True, "result": server.wait_updates(offset, timeout)})
+        if method == "sendMessage":
+            server.messages.append(json.loads(raw or b"{}"))
+            return self._json(200, {"ok": True, "result": {"message_id": len(server.messages)}})
+        if method in ("sendDocument", "sendMediaGroup"):
+            names = re.findall(rb'filename="([^"]+)"', raw)
+            server.documents.extend(n.decode("utf-8", "replace") for n in names)
+            server.count("documents", len(names))
+            return self._json(200, {"ok": True, "result": [{"message_id": i} for i in range(len(names))]})
+        self._json(404, {"ok": False, "description": f"unknown method {method}"})
+
+
+class SheetsStubServer(_StubServer):
+    """
+    Google Sheets v4 替身 (gspread 实际用到的接口)：读取元数据 / 取值、values:batchUpdate、
+    :batchUpdate (deleteDimension)、values:append。SHEETS_API_BASE 指向本服务时 SheetManager 免认证直连。
+    """
+
+    HEADER = ["Code", "Date", "Price", "Qty", "Timeframe", "Bars"]
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s=0.0, faults: str = "",
+                 retry_after: int = 1, seed: int = 0, rows: list = None):
+        super().__init__(_SheetsHandler, host, port, latency_s, faults, retry_after, seed)
+        self.rows: list[list[str]] = [list(self.HEADER)] + [list(map(str, r)) for r in rows or []]
+
+    def env(self) -> dict:
+        return {"SHEETS_API_BASE": self.base_url, "SHEET_NAME": "stub-watchlist-spreadsheet-id"}
+
+    def set_cell(self, a1: str, value: str):
+        match = re.match(r"(?:.*!)?([A-Z]+)(\d+)", a1)
+        col = 0
+        for ch in match.group(1): col = col * 26 + ord(ch) - 64
+        row = int(match.group(2))
+        with self._lock:
+            while len(self.rows) < row: self.rows.append([])
+            cells = self.rows[row - 1]
+            cells.extend([""] * (col - len(cells)))
+            cells[col - 1] = value
+
+
+class _SheetsHandler(_JSONHandler):
+
+    def _maybe_fault(self) -> bool:
+        fault = self.server.inject()
+        self.server.observe("sheets", self.command + self.path, fault, repeatable=True)
+        if not fault: return False
+        code = {"429": 429, "503": 503, "400": 400, "quota": 429}[fault]
+        message = "Quota exceeded for quota metric 'Read requests'" if code == 429 else f"stub fault {fault}"
+        self._json(code, {"error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED" if code == 429 else "UNAVAILABLE"}})
+        return True
+
+    def do_GET(self):
+        server = self.server
+        path = unquote(urlparse(self.path).path)
+        server.delay()
+        if self._maybe_fault(): return
+        match = re.match(r"/v4/spreadsheets/([^/]+)(/values/(.+))?$", path)
+        if not match: return self._json(404, {"error": {"code": 404, "message": path}})
+        if match.group(3):
+            server.count("values_get")
+            with server._lock:
+                values = [list(r) for r in server.rows]
+            return self._json(200, {"range": f"Sheet1!A1:F{len(values)}", "majorDimension": "ROWS", "values": values})
+        server.count("metadata")
+        return self._json(200, {"spreadsheetId": match.group(1), "properties": {"title": "stub"}, "sheets": [
+            {"properties": {"sheetId": 0, "title": "Sheet1", "index": 0,
+                            "gridProperties": {"rowCount": 1000, "columnCount": 26}}}]})
+
+    def do_POST(self):
+        server = self.server
+        path = unquote(urlparse(self.path).path)
+        body = json.loads(self._body() or b"{}")
+        server.delay()
+        if self._maybe_fault(): return
+        if path.endswith("/values:batchUpdate"):
+            server.count("batch_update_values")
+            for item in body.get("data", []):
+                server.set_cell(item["range"], str(item["values"][0][0]))
+            return self._json(200, {"totalUpdatedCells": len(body.get("data", []))})
+        if path.endswith(":batchUpdate"):
+            server.count("batch_update")
+            with server._lock:
+                for req in body.get("requests", []):
+                    rng = req.get("deleteDimension", {}).get("range", {})
+                    del server.rows[rng.get("startIndex", 0):rng.get("endIndex", 0)]
+            return self._json(200, {"replies": [{} for _ in body.get("requests", [])]})
+        if path.endswith(":append"):
+            server.count("append")
+            with server._lock:
+                start = len(server.rows) + 1
+                server.rows.extend([list(map(str, r)) for r in body.get("values", [])])
+                end = len(server.rows)
+            return self._json(200, {"updates": {"updatedRange": f"Sheet1!A{start}:F{end}", "updatedRows": end - start + 1}})
+        self._json(404, {"error": {"code": 404, "message": path}})
+
+
+def _trading_times(day: date, period: int) -> list:
+    """A 股交易时段内按周期结束时刻标注的 K 线时间 (与 BaoStock / AkShare 一致)"""
+    times = []
+    for start, end in ((datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=30), 120),
+                       (datetime.combine(day, datetime.min.time()) + timedelta(hours=13), 120)):
+        times += [start + timedelta(minutes=m) for m in range(period, end + 1, period)]
+    return times
+
+
+def stub_bars(symbol: str, period: int, start: date, end: date) -> list:
+    """
+    确定性行情：每个 (代码, 周期, 交易日) 用固定种子生成，两个数据源在重叠区间给出同一组 K 线。
+    返回 [(时间, 开, 高, 低, 收, 成交量(股))]
+    """
+    bars = []
+    day = start
+    base = 5 + int(symbol) % 50
+    now = datetime.now()
+    while day <= end:
+        if day.weekday() < 5:
+            rng = random.Random(f"{symbol}-{period}-{day.toordinal()}")
+            close = base * (1 + 0.2 * math.sin(day.toordinal() / 20 + int(symbol) % 7))
+            for ts in _trading_times(day, period):
+                if ts > now: break
+                open_ = close
+                close = max(0.5, open_ * (1 + rng.gauss(0, 0.004)))
+                high = max(open_, close) * (1 + abs(rng.gauss(0, 0.002)))
+                low = min(open_, close) * (1 - abs(rng.gauss(0, 0.002)))
+                bars.append((ts, round(open_, 2), round(high, 2), round(low, 2), round(close, 2), rng.randint(10, 5000) * 100))
+        day += timedelta(days=1)
+    return bars
+
+
+class MarketDataStubServer(_StubServer):
+    """
+    行情替身：/akshare (与 stock_zh_a_hist_min_em 相同的中文列，成交量单位为手) 与
+    /baostock (与 query_history_k 相同的列，成交量单位为股)，以 CSV 返回。MARKET_DATA_URL 指向本服务。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s=0.0, faults: str = "",
+                 retry_after: int = 1, seed: int = 0):
+        super().__init__(_MarketDataHandler, host, port, latency_s, faults, retry_after, seed)
+
+    def env(self) -> dict:
+        return {"MARKET_DATA_URL": self.base_url}
+
+
+class _MarketDataHandler(_JSONHandler):
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        server.delay()
+        fault = server.inject()
+        server.observe("market", parsed.path + parsed.query, fault, repeatable=True)
+        if fault:
+            return self._text({"429": 429, "503": 503, "400": 400, "quota": 429}[fault], f"stub fault {fault}")
+
+        source = parsed.path.strip("/")
+        period = int(params.get("period") or params.get("frequency") or 5)
+        symbol = re.sub(r"\D", "", params.get("symbol", "000001"))[-6:]
+        end = date.today()
+        if source == "akshare":
+            start = datetime.strptime(params.get("start_date", "")[:8] or end.strftime("%Y%m%d"), "%Y%m%d").date()
+        elif source == "baostock":
+            start = datetime.strptime(params.get("start_date") or end.isoformat(), "%Y-%m-%d").date()
+        else:
+            return self._text(404, f"unknown source {source}")
+        server.count(source)
+
+        out = io.StringIO()
+        if source == "akshare":
+            out.write("时间,开盘,收盘,最高,最低,成交量\n")
+            for ts, o, h, l, c, v in stub_bars(symbol, period, start, end):
+                out.write(f"{ts:%Y-%m-%d %H:%M:%S},{o},{c},{h},{l},{v // 100}\n")
+        else:
+            out.write("date,time,open,high,low,close,volume\n")
+            for ts, o, h, l, c, v in stub_bars(symbol, period, start, end):
+                out.write(f"{ts:%Y-%m-%d},{ts:%Y%m%d%H%M%S}000,{o},{h},{l},{c},{v}\n")
+        self._text(200, out.getvalue(), "text/csv; charset=utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身服务 (离线联调 / 压测用)")
+    parser.add_argument("--service", choices=["llm", "telegram", "sheets", "market"], default="llm")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="0", help="每个请求的模拟延迟 (秒)，或分布 uniform:a,b / lognormal:中位数,sigma / exp:均值")
+    parser.add_argument("--faults", default="", help="故障注入概率，如 429=0.05,503=0.02,400=0.001,quota=0.001 (可加前缀 gemini:429=0.1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="注入 429 时要求的等待秒数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="telegram: 每第 N 个请求返回 429")
+    args = parser.parse_args()
+
+    common = dict(port=args.port, latency_s=args.latency, faults=args.faults, retry_after=args.retry_after)
+    if args.service == "telegram":
+        server = TelegramStubServer(rate_limit_every=args.rate_limit_every, **common)
+    elif args.service == "sheets":
+        server = SheetsStubServer(**common)
+    elif args.service == "market":
+        server = MarketDataStubServer(**common)
+    else:
+        server = LLMStubServer(**common)
+    print(f"🧪 {args.service} stub 已启动: {server.base_url}", flush=True)
+    for key, value in server.env().items():
+        print(f"   export {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n📊 请求统计: {dict(server.requests)}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# 各模块都在仓库根目录，测试直接 import
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)
+
+from bench import BENCH_TEMPLATE
+from stub_servers import LLMStubServer, MarketDataStubServer, SheetsStubServer
+
+
+def sheet_rows(n: int, timeframe: str = "5", bars: str = "300") -> list:
+    return [[f"{i + 1:06d}", "", "", "", timeframe, bars] for i in range(n)]
+
+
+@pytest.fixture
+def run_main(tmp_path):
+    """
+    在临时目录里以子进程跑一遍 main.py，行情 / 表格 / LLM 全部指向本地替身。
+    返回 run(llm, rows, **env) -> (输出日志, 推送清单中的 PDF 路径)
+    """
+    servers = []
+
+    def run(llm: LLMStubServer, rows: list, **extra):
+        market = MarketDataStubServer().start()
+        sheets = SheetsStubServer(rows=rows).start()
+        servers.extend([market, sheets])
+        env = dict(os.environ, **llm.env(), **market.env(), **sheets.env(),
+                   GEMINI_API_KEY="stub", WYCKOFF_PROMPT_TEMPLATE=BENCH_TEMPLATE, LLM_CACHE="0",
+                   RATE_LIMIT_GEMINI="50/s", RATE_LIMIT_AKSHARE="50/s", RATE_LIMIT_BAOSTOCK="50/s")
+        env.update(extra)
+        out = subprocess.run([sys.executable, os.path.join(ROOT, "main.py")], cwd=tmp_path, env=env,
+                             capture_output=True, text=True, timeout=300)
+        log = out.stdout + out.stderr
+        with open(tmp_path / "push_list.txt", encoding="utf-8") as f:
+            pdfs = [tmp_path / line.strip() for line in f if line.strip()]
+        return log, pdfs
+
+    yield run
+    for server in servers:
+        server.shutdown()
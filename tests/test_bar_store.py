@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import main
+from bar_store import BarStore
+
+
+def _bars(start: str, n: int, close: float = 10.0) -> pd.DataFrame:
+    dates = pd.date_range(start, periods=n, freq="5min")
+    return pd.DataFrame({"date": dates, "open": close, "high": close + 0.1, "low": close - 0.1,
+                         "close": [close + i * 0.01 for i in range(n)], "volume": 1000.0})
+
+
+def test_append_and_overlap(tmp_path):
+    store = BarStore(str(tmp_path))
+    assert store.upsert("000001", 5, _bars("2026-01-05 09:35", 10)) == 10
+    # 与已有数据重叠 3 根 (含上次未走完的最后一根)：重叠部分以新数据为准，其余追加
+    newer = _bars("2026-01-05 10:10", 5, close=20.0)
+    store.upsert("000001", 5, newer)
+    df = store.load("000001", 5)
+    assert len(df) == 12 and df["date"].is_monotonic_increasing
+    assert df["close"].iloc[7:].tolist() == newer["close"].tolist()
+    assert df["close"].iloc[6] == pytest.approx(10.06)
+    assert store.load("000001", 5, tail=3)["date"].tolist() == df["date"].iloc[-3:].tolist()
+    assert store.last_timestamp("000001", 5) == df["date"].iloc[-1]
+
+
+def test_adjust_modes_are_separate(tmp_path):
+    qfq, raw = BarStore(str(tmp_path), adjust="qfq"), BarStore(str(tmp_path), adjust="none")
+    qfq.upsert("000001", 5, _bars("2026-01-05 09:35", 4))
+    assert raw.count("000001", 5) == 0
+    qfq.clear("000001", 5)
+    assert qfq.count("000001", 5) == 0 and qfq.load("000001", 5).empty
+
+
+def test_adjusted_price_change_detection():
+    stored = _bars("2026-01-05 09:35", 20)
+    same = stored.tail(12).copy()
+    same.loc[same.index[-1], "close"] += 0.5          # 上次未走完的最后一根变化不算
+    same.loc[same.index[0], "close"] += 0.01          # 个别一个价位的误差不算
+    assert not main._adjusted_prices_changed(stored, same)
+    exrights = stored.tail(12).assign(close=lambda d: d["close"] * 0.97)  # 除息后前复权价整体下移
+    assert main._adjusted_prices_changed(stored, exrights)
+
+
+def test_fetch_rebuilds_store_after_ex_rights(tmp_path, monkeypatch):
+    store = BarStore(str(tmp_path))
+    monkeypatch.setattr(main, "_BAR_STORE", store)
+    now = pd.Timestamp.now().normalize() + pd.Timedelta(hours=9, minutes=35)
+    history = _bars(str(now - pd.Timedelta(days=1)), 40)
+    store.upsert("000001", 5, history)
+
+    calls = []
+    def fake_akshare(code, tf, start):
+        calls.append(start)
+        # 全量重取时返回整段新复权价；增量时只返回重叠部分
+        df = history.assign(close=history["close"] * 0.95)
+        return df if len(calls) > 1 else df.tail(15)
+    monkeypatch.setattr(main, "_fetch_akshare", fake_akshare)
+    monkeypatch.setattr(main, "_fetch_baostock", lambda *a: pd.DataFrame())
+
+    df = main._fetch_bars("000001", 5, 30)
+    assert len(calls) == 2  # 增量发现复权价变化 -> 清空仓库后全量重取
+    assert df["close"].tolist() == pytest.approx((history["close"] * 0.95).tail(30).tolist())
+    assert store.load("000001", 5)["close"].tolist() == pytest.approx((history["close"] * 0.95).tolist())
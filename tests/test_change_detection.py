@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import main
+from last_reports import LastReports
+
+
+@pytest.fixture
+def reports(tmp_path, monkeypatch):
+    lr = LastReports(str(tmp_path / "last_reports.json"))
+    monkeypatch.setattr(main, "_LAST_REPORTS", lr)
+    monkeypatch.setattr(main, "_UNCHANGED", {"precheck": 0, "fetch": 0})
+    monkeypatch.setattr(main, "_REUSED_PDFS", {})
+    monkeypatch.delenv("CHANGE_DETECTION", raising=False)
+    return lr
+
+
+def _at(ts: str):
+    return lambda: pd.Timestamp(ts)
+
+
+def test_last_reports_roundtrip(tmp_path):
+    path = str(tmp_path / "last_reports.json")
+    lr = LastReports(path)
+    lr.record("000001", "5m x 300", "2026-01-27 13:15:00", "5m", "reports/a.pdf")
+    lr.save()
+    loaded = LastReports(path)
+    assert loaded.get("000001", "5m x 300")["last_bar"] == "2026-01-27 13:15:00"
+    assert loaded.get("000001", "15m x 300") is None  # 配置变了视为没有
+    assert loaded.get("000002", "5m x 300") is None
+
+
+def test_completed_last_bar_ignores_forming_bar():
+    # 13:19:37 取数，AkShare 已返回标注为 13:20 的未走完 K 线
+    df = pd.DataFrame({"date": pd.to_datetime(["2026-01-27 13:15", "2026-01-27 13:20"])})
+    assert main._completed_last_bar(df, "5m", pd.Timestamp("2026-01-27 13:19:37")) == "2026-01-27 13:15:00"
+    assert main._completed_last_bar(df, "5m", pd.Timestamp("2026-01-27 13:20:05")) == "2026-01-27 13:20:00"
+    # 收盘后 / 节假日：以数据为准
+    assert main._completed_last_bar(df, "5m", pd.Timestamp("2026-01-27 16:00")) == "2026-01-27 13:20:00"
+
+
+def test_precheck_skips_only_when_latest_bar_is_covered(reports, monkeypatch):
+    items = [(0, "000001", {"timeframe": "5", "bars": "300"}), (1, "000002", {"timeframe": "5", "bars": "300"})]
+    reports.record("000001", "5m x 300", "2026-01-27 13:15:00", "5m", "reports/a.pdf")
+
+    monkeypatch.setattr(main, "_beijing_now", _at("2026-01-27 13:19:37"))
+    assert main._precheck_unchanged(items) == items[1:]
+    assert main._UNCHANGED["precheck"] == 1
+
+    # 13:20 那根走完后重跑：不能当作无变化跳过
+    monkeypatch.setattr(main, "_beijing_now", _at("2026-01-27 13:21:00"))
+    assert main._precheck_unchanged(items) == items
+
+
+def test_precheck_off(reports, monkeypatch):
+    reports.record("000001", "5m x 300", "2026-01-27 15:00:00", "5m", "reports/a.pdf")
+    monkeypatch.setattr(main, "_beijing_now", _at("2026-01-27 16:00"))
+    items = [(0, "000001", {"timeframe": "5", "bars": "300"})]
+    assert main._precheck_unchanged(items) == []
+    monkeypatch.setenv("CHANGE_DETECTION", "off")
+    assert main._precheck_unchanged(items) == items
@@ -0,0 +1,26 @@
+import time
+
+from circuit_breaker import CLOSED, HALF_OPEN, CircuitBreaker
+
+
+def _half_open() -> CircuitBreaker:
+    b = CircuitBreaker("stub", failure_threshold=1, cooldown_s=0.01)
+    b.record_failure()
+    time.sleep(0.02)
+    return b
+
+
+def test_half_open_allows_single_probe():
+    b = _half_open()
+    assert b.allow() and not b.allow()
+    b.record_success()
+    assert b.state == CLOSED and b.allow()
+
+
+def test_release_probe_after_cancelled_call():
+    b = _half_open()
+    assert b.allow()
+    # 对冲落败被取消：既不算成功也不算失败，探测名额归还
+    b.release_probe()
+    assert b.state == HALF_OPEN
+    assert b.allow()
@@ -0,0 +1,12 @@
+import os
+
+from conftest import ROOT
+from import_profile import breakdown, measure
+
+
+def test_import_main_within_budget(monkeypatch):
+    """重依赖均为按阶段延迟导入；超出预算说明有人又在模块顶层导入了重依赖"""
+    monkeypatch.chdir(ROOT)
+    budget = float(os.getenv("COLD_START_BUDGET_S", "1.5"))
+    elapsed = measure("main")
+    assert elapsed <= budget, f"import main 耗时 {elapsed * 1000:.0f} ms，超出预算 {budget * 1000:.0f} ms:\n{breakdown('main')}"
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import sheet_rows
+from main import parse_batch_response
+from stub_servers import LLMStubServer
+
+
+def test_parse_batch_response_tolerates_code_fence():
+    text = '```json\n{"reports": [{"symbol": "1", "report": "A"}, {"symbol": "000002", "report": " "}]}\n```'
+    assert parse_batch_response(text, ["000001", "000002"]) == {"000001": "A"}
+    assert parse_batch_response("not json", ["000001"]) == {}
+
+
+def test_batch_splits_reports(run_main):
+    llm = LLMStubServer().start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), LLM_BATCH_SIZE="3", LLM_BATCH_WAIT_S="5")
+    finally:
+        llm.shutdown()
+    assert llm.requests["gemini_batch"] == 1, log
+    assert llm.requests["gemini"] == 1, log
+    assert len(pdfs) == 3 and all(p.stat().st_size > 0 for p in pdfs), log
+
+
+def test_batch_missing_symbol_falls_back_to_single(run_main):
+    llm = LLMStubServer(omit={"000002"}).start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), LLM_BATCH_SIZE="3", LLM_BATCH_WAIT_S="5")
+    finally:
+        llm.shutdown()
+    assert "输出缺少 000002" in log
+    # 一次批量 + 漏答的那只单独补跑一次
+    assert llm.requests["gemini_batch"] == 1 and llm.requests["gemini"] == 2, log
+    assert len(pdfs) == 3 and any("000002" in p.name for p in pdfs), log
+
+
+def test_batch_falls_back_to_next_provider(run_main):
+    llm = LLMStubServer(faults="gemini:503=1").start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), LLM_BATCH_SIZE="3", LLM_BATCH_WAIT_S="5",
+                             CUSTOM_API_KEY="stub", GEMINI_MAX_RETRIES="1", GEMINI_BASE_SLEEP="0")
+    finally:
+        llm.shutdown()
+    # Gemini 全部 503，整批交给下一级 (Custom API) 完成，不逐只补跑
+    assert llm.requests["chat_batch"] == 1 and llm.requests["chat"] == 1, log
+    assert "逐只补跑" not in log
+    assert len(pdfs) == 3, log
+
+
+def test_context_cache_only_for_batch_prompts(run_main):
+    llm = LLMStubServer().start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(2), GEMINI_CONTEXT_CACHE="1", GEMINI_CONTEXT_CACHE_MIN_TOKENS="0")
+    finally:
+        llm.shutdown()
+    # 单只请求不创建服务端缓存
+    assert llm.requests["gemini_cache_create"] == 0 and llm.requests["gemini"] == 2, log
+    assert len(pdfs) == 2, log
+
+
+@pytest.mark.parametrize("min_tokens, created", [("0", 1), ("1000000", 0)])
+def test_context_cache_for_batch(run_main, min_tokens, created):
+    llm = LLMStubServer().start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), LLM_BATCH_SIZE="3", LLM_BATCH_WAIT_S="5",
+                             GEMINI_CONTEXT_CACHE="1", GEMINI_CONTEXT_CACHE_MIN_TOKENS=min_tokens)
+    finally:
+        llm.shutdown()
+    # 模板低于缓存下限时不创建，直接完整发送
+    assert llm.requests["gemini_cache_create"] == created and llm.requests["gemini"] == 1, log
+    assert len(pdfs) == 3, log
@@ -0,0 +1,32 @@
+import chart_renderer
+import pdf_renderer
+from conftest import sheet_rows
+from stub_servers import LLMStubServer
+
+
+def test_chart_pool_does_not_fork():
+    assert chart_renderer.pool_context().get_start_method() in ("forkserver", "spawn")
+
+
+def test_pdf_pool_does_not_fork():
+    assert pdf_renderer._pool_context().get_start_method() in ("forkserver", "spawn")
+
+
+def test_pipeline_with_chart_processes(run_main):
+    llm = LLMStubServer().start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), CHART_PROCESSES="2", FETCH_WORKERS="3")
+    finally:
+        llm.shutdown()
+    assert "绘图失败" not in log
+    assert len(pdfs) == 3 and all(p.stat().st_size > 0 for p in pdfs), log
+
+
+def test_pipeline_with_pdf_processes(run_main):
+    llm = LLMStubServer().start()
+    try:
+        log, pdfs = run_main(llm, sheet_rows(3), PDF_PROCESSES="2", FETCH_WORKERS="3")
+    finally:
+        llm.shutdown()
+    assert "PDF 生成失败" not in log
+    assert len(pdfs) == 3 and all(p.stat().st_size > 0 for p in pdfs), log
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from prompt_encoder import _fmt, encode_bars, fit_to_budget, estimate_tokens
+
+
+def test_fmt_keeps_integer_zeros():
+    assert _fmt(pd.Series([1500.0, 20300.0, 10.0, 0.0, float("nan")]), 0).tolist() == ["1500", "20300", "10", "0", ""]
+
+
+def test_fmt_strips_fraction_zeros():
+    assert _fmt(pd.Series([10.50, 10.00, 3.456, 3.1004]), 2).tolist() == ["10.5", "10", "3.46", "3.1"]
+    assert _fmt(pd.Series([1.230]), 3).tolist() == ["1.23"]
+
+
+def _bars():
+    return pd.DataFrame({
+        "date": pd.to_datetime(["2026-01-05 14:55", "2026-01-05 15:00", "2026-01-06 09:35"]),
+        "open": [10.0, 10.1, 10.25], "high": [10.2, 10.3, 10.3], "low": [9.9, 10.0, 10.2],
+        "close": [10.1, 10.2, 10.3], "volume": [150000.0, 2030000.0, 10000.0],
+        "ma200": [None, None, None],
+    })
+
+
+def test_encode_bars_round_hundred_volume():
+    lines = encode_bars(_bars(), "000001", "5m").splitlines()
+    assert lines[1] == "t,o,h,l,c,v"  # 全空的 ma200 被删除
+    assert lines[2:] == ["@2026-01-05", "1455,10,10.2,9.9,10.1,1500", "1500,10.1,10.3,10,10.2,20300",
+                         "@2026-01-06", "0935,10.25,10.3,10.2,10.3,100"]
+
+
+def test_encode_bars_fund_uses_three_decimals():
+    df = _bars().assign(close=[1.2345, 1.2, 1.001])
+    rows = encode_bars(df, "510300").splitlines()
+    assert "price decimals=3" in rows[0]
+    assert [r.split(",")[4] for r in rows if r[0].isdigit()] == ["1.234", "1.2", "1.001"]
+
+
+def test_fit_to_budget_drops_oldest_bars():
+    df = pd.concat([_bars()] * 40, ignore_index=True)
+    df["date"] = pd.date_range("2026-01-05 09:35", periods=len(df), freq="5min")
+    prompt, used = fit_to_budget(lambda d: encode_bars(d, "000001"), df, 800)
+    assert 60 <= used < len(df) and estimate_tokens(prompt) <= 800
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+from stub_servers import TelegramStubServer
+
+
+def _push(tmp_path, tg: TelegramStubServer, names: list, **extra):
+    for name in names:
+        (tmp_path / "reports" / name).write_bytes(b"%PDF-1.4 stub\n")
+    (tmp_path / "push_list.txt").write_text("".join(f"reports/{n}\n" for n in names + ["missing.pdf"]), encoding="utf-8")
+    env = dict(os.environ, **tg.env(), TG_BOT_TOKEN="stub", TG_CHAT_ID="1", **extra)
+    t0 = time.monotonic()
+    out = subprocess.run([sys.executable, os.path.join(ROOT, "add_stock.py"), "--push", "push_list.txt"],
+                         cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    return out.stdout + out.stderr, time.monotonic() - t0
+
+
+def test_push_sends_every_report(tmp_path):
+    (tmp_path / "reports").mkdir()
+    names = [f"{i:06d}_report_5m.pdf" for i in range(1, 12)]
+    tg = TelegramStubServer().start()
+    try:
+        log, _ = _push(tmp_path, tg, names)
+    finally:
+        tg.shutdown()
+    # 11 份：一组 10 份 sendMediaGroup + 1 份 sendDocument；清单中不存在的文件跳过
+    assert sorted(tg.documents) == names, log
+    assert tg.requests["sendMediaGroup"] == 1 and tg.requests["sendDocument"] == 1, log
+    assert "文件不存在，跳过: reports/missing.pdf" in log
+    assert "推送完成: 11/11" in log
+
+
+def test_push_honours_retry_after(tmp_path):
+    (tmp_path / "reports").mkdir()
+    names = [f"{i:06d}_report_5m.pdf" for i in range(1, 12)]
+    # 单线程顺序上传：第 2 个请求 (sendDocument) 收到 429 + retry_after=2，等待后重发成功
+    tg = TelegramStubServer(rate_limit_every=2, retry_after=2).start()
+    try:
+        log, elapsed = _push(tmp_path, tg, names, TG_PUSH_WORKERS="1")
+    finally:
+        tg.shutdown()
+    assert tg.requests["429"] == 1 and tg.requests["total"] == 3, log
+    assert "按 retry_after 等待 2s" in log
+    assert elapsed >= 2, log
+    assert sorted(tg.documents) == names, log
+    assert "推送完成: 11/11" in log
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+import main
+from bar_store import BarStore
+from resample import latest_bar_end, resample_a_share, session_index
+from stub_servers import MarketDataStubServer
+
+
+def _one_minute_day(day: str = "2026-01-05") -> pd.DataFrame:
+    """一个交易日的 1 分钟 K 线 (09:30 集合竞价 + 09:31-11:30 + 13:00 + 13:01-15:00)，close 为序号"""
+    d = pd.Timestamp(day)
+    times = ([d + pd.Timedelta(hours=9, minutes=30)] + list(pd.date_range(d + pd.Timedelta(hours=9, minutes=31), periods=120, freq="1min"))
+             + [d + pd.Timedelta(hours=13)] + list(pd.date_range(d + pd.Timedelta(hours=13, minutes=1), periods=120, freq="1min")))
+    n = len(times)
+    return pd.DataFrame({"date": times, "open": range(n), "high": range(n), "low": range(n),
+                         "close": range(n), "volume": [100.0] * n})
+
+
+def test_session_index_boundaries():
+    dates = pd.Series(pd.to_datetime(["2026-01-05 09:30", "2026-01-05 09:31", "2026-01-05 11:30",
+                                      "2026-01-05 12:00", "2026-01-05 13:00", "2026-01-05 13:01", "2026-01-05 15:00"]))
+    assert session_index(dates).tolist() == [1, 1, 120, -1, 121, 121, 240]
+
+
+def test_resample_60m_does_not_cross_lunch_break():
+    out = resample_a_share(_one_minute_day(), 60)
+    assert out["date"].dt.strftime("%H:%M").tolist() == ["10:30", "11:30", "14:00", "15:00"]
+    # 09:30 集合竞价并入第一根，13:00 并入 14:00 那根；成交量求和
+    assert out["volume"].tolist() == [6100.0, 6000.0, 6100.0, 6000.0]
+    assert out["open"].tolist() == [0, 61, 121, 182]
+    assert out["close"].tolist() == [60, 120, 181, 241]
+
+
+def test_resample_30m_labels():
+    out = resample_a_share(_one_minute_day(), 30)
+    assert out["date"].dt.strftime("%H:%M").tolist() == ["10:00", "10:30", "11:00", "11:30",
+                                                         "13:30", "14:00", "14:30", "15:00"]
+
+
+@pytest.mark.parametrize("now, tf, expected", [
+    ("2026-01-05 11:29", 5, "2026-01-05 11:25"),
+    ("2026-01-05 11:45", 5, "2026-01-05 11:30"),
+    ("2026-01-05 13:00", 60, "2026-01-05 11:30"),
+    ("2026-01-05 13:05", 5, "2026-01-05 13:05"),
+    ("2026-01-05 14:10", 60, "2026-01-05 14:00"),
+    ("2026-01-05 09:33", 5, "2026-01-02 15:00"),  # 周一开盘第一根未走完：上周五收盘
+])
+def test_latest_bar_end(now, tf, expected):
+    assert latest_bar_end(pd.Timestamp(now), tf) == pd.Timestamp(expected)
+
+
+@pytest.fixture
+def market(tmp_path, monkeypatch):
+    server = MarketDataStubServer().start()
+    monkeypatch.setenv("MARKET_DATA_URL", server.base_url)
+    monkeypatch.setenv("RATE_LIMIT_AKSHARE", "100/s")
+    monkeypatch.setenv("RATE_LIMIT_BAOSTOCK", "100/s")
+    monkeypatch.setattr(main, "_BAR_STORE", BarStore(str(tmp_path / "store")))
+    starts = []
+    fetch = main._fetch_akshare
+    monkeypatch.setattr(main, "_fetch_akshare", lambda code, tf, start: starts.append((tf, start)) or fetch(code, tf, start))
+    yield starts
+    server.shutdown()
+
+
+def test_derive_matches_native_bars(market):
+    derived = main._derive_bars_from_1m("000001", 30, 40)
+    native = main._fetch_bars("000002", 30, 40)  # 另一只股票，避免读到合成写回的仓库
+    assert len(derived) == 40
+    assert derived["date"].dt.strftime("%H:%M").isin(["10:00", "10:30", "11:00", "11:30", "13:30", "14:00", "14:30", "15:00"]).all()
+    assert set(derived["date"].dt.strftime("%H:%M")) == set(native["date"].dt.strftime("%H:%M"))
+
+
+def test_one_minute_bars_are_fetched_incrementally(market):
+    main._derive_bars_from_1m("000001", 5, 100)
+    first_start = market[0][1]
+    main._derive_bars_from_1m("000001", 5, 100)
+    one_minute = [start for tf, start in market if tf == 1]
+    assert len(one_minute) == 2
+    # 第二次只从仓库最后几根所在交易日起请求，不再重新下载整段 1 分钟历史
+    assert one_minute[1] > first_start
@@ -0,0 +1,48 @@
+import pytest
+
+import add_stock
+from sheet_manager import SheetManager
+from stub_servers import SheetsStubServer, TelegramStubServer, parse_faults
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    server = SheetsStubServer(rows=[
+        ["000001", "", "10", "100", "5", "300"],
+        ["000002", "", "", "", "15", "200"],
+        ["1", "", "12", "200", "30", "400"],  # 重复代码 (000001)
+    ]).start()
+    for key, value in server.env().items(): monkeypatch.setenv(key, value)
+    yield server
+    server.shutdown()
+
+
+def test_duplicate_rows_last_wins(sheets):
+    sm = SheetManager()
+    stocks = sm.get_all_stocks()
+    assert list(stocks) == ["000001", "000002"]
+    assert stocks["000001"]["price"] == "12" and stocks["000001"]["timeframe"] == "30"
+    # 修改写到生效的那一行
+    sm.add_or_update_stock("000001", price="13")
+    sm.flush()
+    assert sheets.rows[3][2] == "13" and sheets.rows[1][2] == "10"
+
+
+def test_flush_failure_discards_pending_changes(sheets, monkeypatch):
+    tg = TelegramStubServer().start()
+    monkeypatch.setenv("TG_API_BASE", tg.base_url)
+    try:
+        sm = SheetManager()
+        sm.get_all_stocks()
+        sheets.faults = parse_faults("400=1")
+        update = {"update_id": 1, "message": {"chat": {"id": 1}, "text": "600000"}}
+        assert add_stock.process_updates(sm, "stub", [update]) == 1
+        assert "写回表格失败" in tg.messages[0]["text"]
+        assert not sm.has_pending
+
+        sheets.faults = {}
+        assert "600000" not in sm.get_all_stocks()  # 下次使用时重新读取整表
+        assert sheets.requests["values_get"] == 2
+        assert len(sheets.rows) == 4
+    finally:
+        tg.shutdown()
@@ -0,0 +1,42 @@
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def tracer(monkeypatch, tmp_path):
+    monkeypatch.setenv("TRACE", "1")
+    monkeypatch.setattr(tracing, "_TRACER", tracing.Tracer(jsonl_path=str(tmp_path / "t.jsonl"), prom_path=str(tmp_path / "m.prom")))
+    return tracing.get_tracer()
+
+
+def test_falsy_stage_result_is_error(tracer):
+    @tracing.traced("stage.pdf")
+    def stage(job):
+        return None
+
+    assert stage({"symbol": "000001"}) is None
+    (sp,) = tracer.spans
+    assert sp.status == "error" and sp.error == "returned None"
+
+
+def test_skipped_and_ok_results(tracer):
+    @tracing.traced("stage.fetch")
+    def stage(job):
+        if job["symbol"] == "000002":
+            tracing.current().set(skipped="unchanged")
+            return None
+        return job
+
+    stage({"symbol": "000001"})
+    stage({"symbol": "000002"})
+    assert [sp.status for sp in tracer.spans] == ["ok", "ok"]
+
+
+def test_empty_batch_is_error(tracer):
+    @tracing.traced("stage.analyze_batch")
+    def stage(jobs):
+        return []
+
+    stage([{"symbol": "000001"}, {"symbol": "000002"}])
+    assert tracer.spans[0].status == "error"
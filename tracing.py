@@ -0,0 +1,230 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+# span 上约定的计量字段：求和后写入汇总表与 Prometheus (wait_s 为令牌桶限流等待的秒数)
+COUNTERS = ("bytes_in", "bytes_out", "rows", "prompt_tokens", "completion_tokens", "retries", "fallbacks", "wait_s")
+
+
+class Span:
+    """一次计时区间：名称、所属股票、耗时、状态与任意属性 (字节数、token、重试次数、提供方...)"""
+
+    __slots__ = ("name", "symbol", "attrs", "start", "duration_s", "status", "error")
+
+    def __init__(self, name: str, symbol: str = None, **attrs):
+        self.name = name
+        self.symbol = symbol
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration_s = 0.0
+        self.status = "ok"
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, n: float = 1):
+        self.attrs[key] = self.attrs.get(key, 0) + n
+
+    def setdefault(self, key: str, value):
+        return self.attrs.setdefault(key, value)
+
+    def to_dict(self) -> dict:
+        d = {"name": self.name, "symbol": self.symbol, "start": round(self.start, 3),
+             "duration_s": round(self.duration_s, 4), "status": self.status}
+        if self.error: d["error"] = self.error
+        d.update(self.attrs)
+        return d
+
+
+class _NullSpan:
+    """没有活动 span (或关闭了追踪) 时的占位对象，调用方无需判空"""
+
+    def set(self, **attrs): pass
+
+    def add(self, key: str, n: float = 1): pass
+
+    def setdefault(self, key: str, value): return value
+
+
+_NULL = _NullSpan()
+_LOCAL = threading.local()
+
+
+def current():
+    """当前线程最内层的活动 span"""
+    stack = getattr(_LOCAL, "stack", None)
+    return stack[-1] if stack else _NULL
+
+
+class Tracer:
+    """
+    收集一次运行内的所有 span，结束时输出：
+    - JSON Lines，每次运行一个文件 (TRACE_DIR，默认 data/trace/{run_id}.jsonl)
+    - Prometheus textfile (TRACE_PROM，默认 data/metrics.prom，每次运行覆盖)
+    - 按 span 名称的 p50 / p95 汇总表
+    """
+
+    def __init__(self, jsonl_path: str = None, prom_path: str = None):
+        self.run_id = time.strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:6]
+        self.jsonl_path = jsonl_path or os.path.join(os.getenv("TRACE_DIR", "data/trace"), f"{self.run_id}.jsonl")
+        self.prom_path = prom_path or os.getenv("TRACE_PROM", "data/metrics.prom")
+        self.started = time.time()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, symbol: str = None, **attrs):
+        sp = Span(name, symbol, **attrs)
+        stack = getattr(_LOCAL, "stack", None)
+        if stack is None: stack = _LOCAL.stack = []
+        stack.append(sp)
+        t0 = time.perf_counter()
+        try:
+            yield sp
+        except BaseException as e:
+            sp.status = "error"
+            sp.error = f"{type(e).__name__}: {str(e)[:200]}"
+            raise
+        finally:
+            sp.duration_s = time.perf_counter() - t0
+            stack.pop()
+            with self._lock: self.spans.append(sp)
+
+    def _grouped(self) -> dict[str, list[Span]]:
+        with self._lock:
+            spans = list(self.spans)
+        groups: dict[str, list[Span]] = {}
+        for sp in spans:
+            groups.setdefault(sp.name, []).append(sp)
+        return groups
+
+    def table(self) -> str:
+        groups = self._grouped()
+        if not groups: return ""
+        lines = [f"   {'span':<22}{'count':>6}{'err':>5}{'p50':>9}{'p95':>9}{'total':>9}  计量"]
+        for name in sorted(groups):
+            spans = groups[name]
+            durations = [sp.duration_s for sp in spans]
+            errors = sum(sp.status != "ok" for sp in spans)
+            totals = []
+            for key in COUNTERS:
+                value = sum(sp.attrs.get(key, 0) for sp in spans)
+                if value: totals.append(f"{key}={_human(key, value)}")
+            lines.append(f"   {name:<22}{len(spans):>6}{errors:>5}{np.percentile(durations, 50):>8.2f}s"
+                         f"{np.percentile(durations, 95):>8.2f}s{sum(durations):>8.1f}s  {' '.join(totals)}")
+        return "\n".join(lines)
+
+    def write_jsonl(self):
+        with self._lock:
+            spans = list(self.spans)
+        if not spans: return
+        os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+        with open(self.jsonl_path, "w", encoding="utf-8") as f:
+            for sp in spans:
+                f.write(json.dumps(dict(sp.to_dict(), run_id=self.run_id), ensure_ascii=False, default=str) + "\n")
+
+    def prometheus(self) -> str:
+        groups = self._grouped()
+        lines = [
+            "# HELP wyckoff_span_duration_seconds Duration of traced stages and provider calls.",
+            "# TYPE wyckoff_span_duration_seconds summary",
+        ]
+        for name, spans in sorted(groups.items()):
+            durations = [sp.duration_s for sp in spans]
+            for q in (0.5, 0.95):
+                lines.append(f'wyckoff_span_duration_seconds{{span="{name}",quantile="{q}"}} {np.percentile(durations, q * 100):.6f}')
+            lines.append(f'wyckoff_span_duration_seconds_sum{{span="{name}"}} {sum(durations):.6f}')
+            lines.append(f'wyckoff_span_duration_seconds_count{{span="{name}"}} {len(durations)}')
+
+        lines += ["# HELP wyckoff_span_errors_total Spans that ended with an exception.",
+                  "# TYPE wyckoff_span_errors_total counter"]
+        for name, spans in sorted(groups.items()):
+            lines.append(f'wyckoff_span_errors_total{{span="{name}"}} {sum(sp.status != "ok" for sp in spans)}')
+
+        for key in COUNTERS:
+            metric = "wyckoff_rate_limit_wait_seconds_total" if key == "wait_s" else f"wyckoff_{key}_total"
+            lines += [f"# TYPE {metric} counter"]
+            for name, spans in sorted(groups.items()):
+                value = sum(sp.attrs.get(key, 0) for sp in spans)
+                if value: lines.append(f'{metric}{{span="{name}"}} {value:g}')
+
+        chosen: dict[str, int] = {}
+        for sp in groups.get("stage.analyze", []) + groups.get("stage.analyze_batch", []):
+            provider = sp.attrs.get("provider")
+            if provider: chosen[provider] = chosen.get(provider, 0) + 1
+        lines += ["# HELP wyckoff_llm_provider_chosen_total Analyses served by each provider (cache = local LLM cache).",
+                  "# TYPE wyckoff_llm_provider_chosen_total counter"]
+        lines += [f'wyckoff_llm_provider_chosen_total{{provider="{p}"}} {n}' for p, n in sorted(chosen.items())]
+
+        lines += ["# TYPE wyckoff_run_duration_seconds gauge", f"wyckoff_run_duration_seconds {time.time() - self.started:.3f}",
+                  "# TYPE wyckoff_run_timestamp_seconds gauge", f"wyckoff_run_timestamp_seconds {self.started:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """先写临时文件再改名，node_exporter 的 textfile collector 不会读到半个文件"""
+        os.makedirs(os.path.dirname(self.prom_path) or ".", exist_ok=True)
+        tmp = f"{self.prom_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, self.prom_path)
+
+
+def _human(key: str, value: float) -> str:
+    if key.startswith("bytes"):
+        if value >= 1024 * 1024: return f"{value / 1024 / 1024:.1f}MB"
+        return f"{value / 1024:.0f}KB" if value >= 1024 else f"{value:.0f}B"
+    if key == "wait_s": return f"{value:.1f}s"
+    return f"{value:g}"
+
+
+_TRACER: Optional[Tracer] = None
+_TRACER_LOCK = threading.Lock()
+
+
+def get_tracer() -> Optional[Tracer]:
+    """TRACE=0 时关闭追踪 (返回 None)"""
+    global _TRACER
+    if os.getenv("TRACE", "1") == "0": return None
+    with _TRACER_LOCK:
+        if _TRACER is None: _TRACER = Tracer()
+        return _TRACER
+
+
+@contextmanager
+def span(name: str, symbol: str = None, **attrs):
+    tracer = get_tracer()
+    if tracer is None:
+        yield _NULL
+        return
+    with tracer.span(name, symbol, **attrs) as sp:
+        yield sp
+
+
+def traced(name: str):
+    """
+    流水线阶段函数的装饰器：func(job) 或批处理阶段的 func(jobs)。
+    返回空值 (任务被丢弃) 记为错误，除非阶段自己标记了 skipped (如没有新 K 线)。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(job):
+            if isinstance(job, list):
+                ctx = span(name, ",".join(str(j.get("symbol")) for j in job), batch=len(job))
+            else:
+                ctx = span(name, job.get("symbol"))
+            with ctx as sp:
+                result = func(job)
+                if not result and isinstance(sp, Span) and sp.status == "ok" and not sp.attrs.get("skipped"):
+                    sp.status = "error"
+                    sp.error = f"returned {result!r}"
+                return result
+        return wrapper
+    return decorator